@@ -1,219 +1,400 @@
 import os
 import faiss
 import numpy as np
-import pandas as pd
-import torch
-import json
+import threading
+import time
 import traceback
 
 from flask import Flask, request, jsonify
-from model import Triple2Vec # Import the model class
+from candidate_cache import CandidateCache
+from micro_batcher import MicroBatcher
+from prefilter import build_filter_bitmap, filtered_search, filters_key, has_filters, validate_filters
+from artifacts import MODEL_DIR, ArtifactError, load_snapshot, resolve_model_version, list_model_versions, write_current_version
+from ranking import N_CANDIDATES, N_RECOMMENDATIONS, rank_by_gamma, score_candidates
 
 # --- 1. INITIALIZATION ---
 print("Initializing Flask ML Service...")
 app = Flask(__name__)
 
 # --- 2. LOAD ML ARTIFACTS ON STARTUP ---
-MODEL_DIR = 'ml_models'
-N_CANDIDATES = 100
-
-# --- Global variables for loaded artifacts ---
-faiss_index = None
-user_embeddings = None
-item_embeddings = None
-product_health_factors = None
-prod2idx = None
-idx2prod = None
-# user2idx = None # If you add user mapping later
+MAX_BATCH_SIZE = 5000
+RELOAD_POLL_SECONDS = float(os.environ.get('ML_RELOAD_POLL_SECONDS', 30)) # 0 disables the file watch
+ADMIN_TOKEN = os.environ.get('ML_ADMIN_TOKEN') # Required by /admin/* when set; otherwise localhost only
+CACHE_MAX_ENTRIES = int(os.environ.get('ML_CACHE_MAX_ENTRIES', 50_000)) # 0 disables the candidate cache
+CACHE_TTL_SECONDS = float(os.environ.get('ML_CACHE_TTL_SECONDS', 300))
+# Optional micro-batching of concurrent /recommend calls (needs a threaded server, e.g. gunicorn gthread)
+MICRO_BATCH_ENABLED = os.environ.get('ML_MICRO_BATCH', '0') == '1'
+MICRO_BATCH_MAX_WAIT_MS = float(os.environ.get('ML_MICRO_BATCH_MAX_WAIT_MS', 2.0))
+MICRO_BATCH_MAX_SIZE = int(os.environ.get('ML_MICRO_BATCH_MAX_SIZE', 64))
+MICRO_BATCH_TIMEOUT_SECONDS = 10.0
 
-def load_artifacts():
-    global faiss_index, user_embeddings, item_embeddings, product_health_factors, prod2idx, idx2prod #, user2idx
-
-    # Load FAISS index
-    faiss_index_path = os.path.join(MODEL_DIR, 'faiss_item_index.idx')
-    try:
-        print(f"Loading FAISS index from {faiss_index_path}...")
-        faiss_index = faiss.read_index(faiss_index_path)
-    except Exception as e:
-        print(f"❌ Error loading FAISS index: {e}")
-        exit()
+# --- The live model: one immutable ModelSnapshot, swapped atomically on reload ---
+# Request handlers read this reference ONCE and use that snapshot for the whole request,
+# so in-flight requests finish on the old model while new ones see the new model.
+current_snapshot = None
+_reload_lock = threading.Lock()
+_watcher_started = False
+reload_status = {"state": "idle", "version": None, "error": None, "finished_at": None}
 
-    # Load the trained Triple2Vec model weights
-    model_path = os.path.join(MODEL_DIR, 'triple2vec_model.pth')
-    print(f"Loading model weights from {model_path}...")
+# Candidates + preference scores depend on (user, basket, model) but not on gamma,
+# so slider moves and repeated requests only redo the cheap gamma re-rank.
+candidate_cache = CandidateCache(max_entries=CACHE_MAX_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS)
 
-    # --- Parameters from your training script ---
-    num_users = 206209
-    num_products = 10000
-    embedding_dim = 64
-    # ------------------------------------------
 
-    model = Triple2Vec(num_users, num_products, embedding_dim)
+def load_artifacts():
+    """Boot-time load. A broken model at startup is fatal; a broken model on reload is not."""
+    global current_snapshot
+    version = resolve_model_version(MODEL_DIR)
     try:
-        model.load_state_dict(torch.load(model_path, map_location="cpu"))
-        model.eval()
-    except FileNotFoundError:
-        print(f"❌ Error: Model file not found at '{model_path}'.")
-        exit()
-    except RuntimeError as e:
-        print(f"❌ Error loading model state dict: {e}")
-        print("   Ensure the .pth file exists and model parameters (U, V, D) above match training.")
-        exit()
-    except Exception as e:
-        print(f"❌ An unexpected error occurred loading the model: {e}")
+        current_snapshot = load_snapshot(MODEL_DIR, version)
+    except ArtifactError as e:
+        print(f"❌ Error loading ML artifacts: {e}")
         exit()
+    print(f"✅ ML artifacts loaded successfully (version '{version}').")
 
-    # Extract embeddings
+
+def reload_model(version=None):
+    """Loads + validates a version off the request path, then publishes it in one assignment."""
+    global current_snapshot
+    if not _reload_lock.acquire(blocking=False):
+        print("⚠️ Reload already in progress. Skipping.")
+        return False
     try:
-        user_embeddings = model.h.weight.data.cpu().numpy()
-        item_p = model.p.weight.data.cpu().numpy()
-        item_q = model.q.weight.data.cpu().numpy()
-        item_embeddings = (item_p + item_q) / 2.0
-        faiss.normalize_L2(item_embeddings)
-        print(f"Embeddings loaded and combined. Shape: {item_embeddings.shape}")
-    except Exception as e:
-        print(f"❌ Error extracting embeddings from model: {e}")
-        exit()
+        version = version or resolve_model_version(MODEL_DIR)
+        reload_status.update(state="loading", version=version, error=None)
+        started = time.time()
+        try:
+            snapshot = load_snapshot(MODEL_DIR, version)
+        except Exception as e:
+            print(f"❌ Reload of version '{version}' failed, keeping '{current_snapshot.version}': {e}")
+            reload_status.update(state="failed", error=str(e), finished_at=time.time())
+            return False
 
+        previous_version = current_snapshot.version if current_snapshot else None
+        current_snapshot = snapshot
+        candidate_cache.clear() # Entries are keyed by version; drop the old model's ones now
+        reload_status.update(state="idle", finished_at=time.time())
+        print(f"🔄 Swapped model '{previous_version}' -> '{version}' in {time.time() - started:.1f}s.")
+        return True
+    finally:
+        _reload_lock.release()
 
-    # Load product health factor data
-    nutrition_path = os.path.join(MODEL_DIR, 'products_with_nutrition_and_health_10k.parquet')
-    try:
-        print(f"Loading product health data from {nutrition_path}...")
-        product_df = pd.read_parquet(nutrition_path)
-        # --- FIXED Column Name ---
-        # Use 'instacart_product' as identified by your inspection script
-        product_health_factors = dict(zip(product_df['instacart_product'], product_df['health_factor']))
-        # -------------------------
-    except FileNotFoundError:
-         print(f"❌ Error: Product data file not found at '{nutrition_path}'.")
-         exit()
-    except KeyError as ke:
-         print(f"❌ Error loading product data: Missing expected column '{ke}'.")
-         print(f"   Available columns: {list(product_df.columns)}")
-         print("   Please ensure the Parquet file has the correct column names ('instacart_product', 'health_factor_score').")
-         exit()
-    except Exception as e:
-        print(f"❌ Error loading product data: {e}")
-        exit()
 
-    # Load Product ID to Index Mapping
-    prod2idx_path = os.path.join(MODEL_DIR, 'product_to_idx.json') # Ensure filename matches training script
-    try:
-        with open(prod2idx_path, 'r') as f:
-            prod2idx_str_keys = json.load(f)
-            prod2idx = {int(k): v for k, v in prod2idx_str_keys.items()}
-        idx2prod = {v: k for k, v in prod2idx.items()}
-        print(f"✅ Loaded product ID <-> index mappings ({len(prod2idx)} entries).")
-         # Sanity Check
-        if len(prod2idx) != num_products:
-             print(f"⚠️ Warning: Mismatch between num_products ({num_products}) and mapping size ({len(prod2idx)}).")
-        if item_embeddings.shape[0] != num_products:
-             print(f"⚠️ Warning: Mismatch between num_products ({num_products}) and item embedding rows ({item_embeddings.shape[0]}).")
-
-    except FileNotFoundError:
-        print(f"❌ Error: Product mapping file not found at '{prod2idx_path}'. Cannot run server.")
-        exit()
-    except Exception as e:
-        print(f"❌ Error loading product mapping: {e}")
-        exit()
+def reload_model_in_background(version=None):
+    thread = threading.Thread(target=reload_model, args=(version,), name="model-reload", daemon=True)
+    thread.start()
+    return thread
+
+
+def _watch_model_dir():
+    while True:
+        time.sleep(RELOAD_POLL_SECONDS)
+        try:
+            wanted = resolve_model_version(MODEL_DIR)
+            snapshot = current_snapshot
+            if snapshot is not None and wanted != snapshot.version and reload_status["version"] != wanted:
+                print(f"👀 Model directory now points at '{wanted}'. Reloading...")
+                reload_model(wanted)
+        except Exception as e:
+            print(f"⚠️ Model directory watch error: {e}")
+
+
+def start_model_watcher():
+    """Polls MODEL_DIR (CURRENT file / newest version) and hot-reloads on change.
+    Must be called in each serving process: threads do not survive gunicorn's fork."""
+    global _watcher_started
+    if _watcher_started or RELOAD_POLL_SECONDS <= 0:
+        return
+    _watcher_started = True
+    threading.Thread(target=_watch_model_dir, name="model-watcher", daemon=True).start()
+
+
+# --- 3. SHARED RECOMMENDATION HELPERS ---
+def build_query_vector(snap, original_user_id, original_basket_ids):
+    """Returns (query_vec, basket_indices). query_vec is None when there is nothing to query with."""
+    user_vec = None
+
+    if original_user_id is not None:
+        # This is an EXISTING user. Find their embedding vector.
+        user_index = snap.user2idx.get(int(original_user_id))
+
+        if user_index is not None:
+            user_vec = snap.user_vector(user_index)
+        else:
+            print(f"Warning: Existing user ID {original_user_id} not found. Treating as new user.")
+
+    # Convert basket IDs to indices
+    basket_indices = [snap.prod2idx.get(pid) for pid in original_basket_ids if snap.prod2idx.get(pid) is not None]
+
+    if user_vec is not None:
+        if not basket_indices:
+            return user_vec, basket_indices # No basket, use user history
+        # Has history AND basket, combine them
+        avg_basket_vec = np.mean(snap.item_embeddings[basket_indices], axis=0)
+        return (user_vec + avg_basket_vec) / 2.0, basket_indices
+
+    if not basket_indices:
+        return None, basket_indices
+    # New user, but has items in basket. Query is *only* the basket
+    return np.mean(snap.item_embeddings[basket_indices], axis=0), basket_indices
+
+
+def search_candidates(snap, query_vecs):
+    """Normalizes a (B, D) query matrix and runs ONE FAISS search over all rows."""
+    query_matrix = np.ascontiguousarray(np.vstack(query_vecs), dtype='float32')
+    faiss.normalize_L2(query_matrix)
+    _, candidate_indices = snap.faiss_index.search(query_matrix, N_CANDIDATES)
+    return query_matrix, candidate_indices
 
-    # --- TODO: Load user2idx mapping if available ---
 
-    print("✅ ML artifacts loaded successfully.")
+def precomputed_candidates(snap, user_index):
+    """
+    (safe_indices, pref_scores) for a known user with an empty basket, read straight from the
+    precomputed top-K arrays. Shaped like score_candidates() rows (N_CANDIDATES wide).
+    """
+    top_indices = np.asarray(snap.user_topk_indices[user_index, :N_CANDIDATES], dtype='int64')
+    top_scores = np.asarray(snap.user_topk_scores[user_index, :N_CANDIDATES], dtype='float32')
 
-# --- 3. DEFINE THE RECOMMENDATION API ENDPOINT ---
+    safe_indices = np.zeros(N_CANDIDATES, dtype='int64')
+    pref_scores = np.full(N_CANDIDATES, -np.inf, dtype='float32')
+    safe_indices[:len(top_indices)] = top_indices
+    pref_scores[:len(top_scores)] = np.where(snap.idx2prod_array[top_indices] >= 0, top_scores, -np.inf)
+    return safe_indices, pref_scores
+
+
+def prefiltered_candidates(snap, query_vec, basket_indices, filters):
+    """
+    (safe_indices, pref_scores) for ONE query whose ANN search is restricted up front with a
+    FAISS ID selector (basket rows and request filters excluded), so the list always fills.
+    """
+    query_row = np.ascontiguousarray(query_vec, dtype='float32').reshape(1, -1)
+    faiss.normalize_L2(query_row)
+    bitmap = build_filter_bitmap(snap, filters, basket_indices)
+    candidates = filtered_search(snap, query_row[0], bitmap, N_CANDIDATES, min_results=N_RECOMMENDATIONS)
+    safe_indices, pref_scores = score_candidates(snap, query_row, candidates.reshape(1, -1), [basket_indices])
+    return safe_indices[0], pref_scores[0]
+
+
+def recommend_many(snap, batch_requests):
+    """
+    batch_requests: list of (user_id, basket_ids, gamma, filters). Returns one product ID list per request.
+    Known users with empty carts read precomputed top-K rows, unfiltered cache misses share ONE FAISS
+    search, filtered requests use a pre-filtered search, and every row is gamma-ranked together.
+    """
+    scored = [None] * len(batch_requests) # row -> (safe_indices, pref_scores)
+    miss_rows, miss_keys, query_vecs, basket_indices_list = [], [], [], []
+
+    # 1. Precomputed top-K / cache lookup; build query vectors only for misses
+    for row, (user_id, basket_ids, _, filters) in enumerate(batch_requests):
+        filtered = has_filters(filters)
+        if not filtered and not basket_ids and user_id is not None and snap.user_topk_indices is not None:
+            # Known user, empty cart: query is the user vector alone, so the answer was precomputed
+            user_index = snap.user2idx.get(int(user_id))
+            if user_index is not None:
+                scored[row] = precomputed_candidates(snap, user_index)
+                continue
+
+        key = candidate_cache.make_key(user_id, basket_ids, snap.version, filters_key(filters))
+        entry = candidate_cache.get(key)
+        if entry is not None:
+            scored[row] = entry
+            continue
+        query_vec, basket_indices = build_query_vector(snap, user_id, basket_ids)
+        if query_vec is None: continue # New user with an empty basket
+        if filtered:
+            # Per-request eligibility set: one pre-filtered search for this row
+            scored[row] = prefiltered_candidates(snap, query_vec, basket_indices, filters)
+            candidate_cache.put(key, scored[row])
+            continue
+        miss_rows.append(row)
+        miss_keys.append(key)
+        query_vecs.append(query_vec)
+        basket_indices_list.append(basket_indices)
+
+    # 2. One FAISS search + preference scoring for all misses
+    if miss_rows:
+        query_matrix, candidate_indices = search_candidates(snap, query_vecs)
+        safe_indices, pref_scores = score_candidates(snap, query_matrix, candidate_indices, basket_indices_list)
+        for i, (row, key) in enumerate(zip(miss_rows, miss_keys)):
+            # Copy so a cached row does not keep the whole batch matrix alive
+            entry = (safe_indices[i].copy(), pref_scores[i].copy())
+            if np.isfinite(entry[1]).sum() < N_RECOMMENDATIONS:
+                # A large basket ate the post-filtered candidates: redo this row pre-filtered
+                entry = prefiltered_candidates(snap, query_vecs[i], basket_indices_list[i], None)
+            candidate_cache.put(key, entry)
+            scored[row] = entry
+
+    # 3. Gamma-only re-rank of every row together
+    results = [[] for _ in batch_requests]
+    ranked_rows = [row for row, entry in enumerate(scored) if entry is not None]
+    if ranked_rows:
+        ranked = rank_by_gamma(
+            snap,
+            np.vstack([scored[row][0] for row in ranked_rows]),
+            np.vstack([scored[row][1] for row in ranked_rows]),
+            [float(batch_requests[row][2]) for row in ranked_rows],
+        )
+        for row, recommendations in zip(ranked_rows, ranked):
+            results[row] = recommendations
+    return results
+
+
+def recommend_micro_batch(items):
+    # All requests gathered in one window share a snapshot, a FAISS search and a re-rank
+    return recommend_many(current_snapshot, items)
+
+
+micro_batcher = MicroBatcher(
+    recommend_micro_batch,
+    max_wait_ms=MICRO_BATCH_MAX_WAIT_MS,
+    max_batch=MICRO_BATCH_MAX_SIZE,
+) if MICRO_BATCH_ENABLED else None
+
+
+# --- 4. DEFINE THE RECOMMENDATION API ENDPOINTS ---
 @app.route('/recommend', methods=['POST'])
 def recommend():
     data = request.get_json()
     original_user_id = data.get('user_id') # This may be None
     original_basket_ids = data.get('basket_ids', [])
     gamma = data.get('gamma', 0.5)
+    filters = data.get('filters') # Optional: include_ids, exclude_ids, departments, aisles, min_health
+
+    if original_user_id is None and not original_basket_ids:
+        # New user AND empty basket. Node.js should have caught this,
+        # but we'll return an empty list just in case.
+        print("[Flask] Received request for new user with empty basket. Returning empty.")
+        return jsonify({"recommendations": []})
 
     try:
-        user_vec = None
-
-        # --- (FIXED) NEW USER LOGIC ---
-        if original_user_id is not None:
-            # This is an EXISTING user. Find their embedding vector.
-            # TODO: Add your user2idx.json mapping logic here
-            user_index = original_user_id # Assuming ID is index for now
-            
-            if user_index >= 0 and user_index < len(user_embeddings):
-                user_vec = user_embeddings[user_index]
-            else:
-                print(f"Warning: Existing user ID {original_user_id} not found. Treating as new user.")
-        # If original_user_id is None, user_vec remains None
-        # --- (END OF FIX) ---
-
-        # Convert basket IDs to indices
-        basket_indices = [prod2idx.get(pid) for pid in original_basket_ids if prod2idx.get(pid) is not None]
-
-        # 1. Construct Query Vector
-        if user_vec is not None:
-            # --- LOGIC FOR EXISTING USER ---
-            if not basket_indices:
-                query_vec = user_vec # No basket, use user history
-            else:
-                # Has history AND basket, combine them
-                basket_vecs = [item_embeddings[idx] for idx in basket_indices]
-                avg_basket_vec = np.mean(basket_vecs, axis=0)
-                query_vec = (user_vec + avg_basket_vec) / 2.0
+        if micro_batcher is not None:
+            future = micro_batcher.submit((original_user_id, original_basket_ids, gamma, filters))
+            recommendations = future.result(timeout=MICRO_BATCH_TIMEOUT_SECONDS)
         else:
-            # --- LOGIC FOR NEW USER ---
-            if not basket_indices:
-                # New user AND empty basket. Node.js should have caught this,
-                # but we'll return an empty list just in case.
-                print("[Flask] Received request for new user with empty basket. Returning empty.")
-                return jsonify({"recommendations": []})
-            else:
-                # New user, but has items in basket. Use basket ONLY.
-                print(f"[Flask] New user request. Using session-based recs for {len(basket_indices)} items.")
-                basket_vecs = [item_embeddings[idx] for idx in basket_indices]
-                avg_basket_vec = np.mean(basket_vecs, axis=0)
-                query_vec = avg_basket_vec # Query is *only* the basket
-        
-        # --- (Rest of the function is the same) ---
-
-        query_vec_norm = query_vec.reshape(1, -1).astype('float32')
-        faiss.normalize_L2(query_vec_norm)
-
-        # 2. Candidate Generation (FAISS returns INDICES)
+            snap = current_snapshot # Pin one model version for the whole request
+            recommendations = recommend_many(snap, [(original_user_id, original_basket_ids, gamma, filters)])[0]
+        return jsonify({"recommendations": recommendations})
+
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": f"Invalid request: {e}"}), 400
+
+    except Exception as e:
+        print(f"An unexpected error occurred during recommendation: {e}")
+        traceback.print_exc()
+        return jsonify({"error": "Could not process the request."}), 500
+
+
+def parse_batch_item(req):
+    """One /recommend/batch entry -> (user_id, basket_ids, gamma, filters); ValueError if malformed."""
+    if not isinstance(req, dict):
+        raise ValueError("each request must be an object.")
+    basket_ids = req.get('basket_ids', [])
+    if not isinstance(basket_ids, list):
+        raise ValueError("'basket_ids' must be a list.")
+    gamma = req.get('gamma', 0.5)
+    if isinstance(gamma, bool) or not isinstance(gamma, (int, float)):
+        raise ValueError("'gamma' must be a number.")
+    user_id = req.get('user_id')
+    if user_id is not None:
         try:
-            _, candidate_indices = faiss_index.search(query_vec_norm, k=N_CANDIDATES)
-            candidate_indices = candidate_indices[0] 
-        except Exception as faiss_e:
-             print(f"Error during FAISS search: {faiss_e}")
-             return jsonify({"error": "Failed during candidate search."}), 500
+            int(user_id)
+        except (TypeError, ValueError):
+            raise ValueError("'user_id' must be an integer.")
+    validate_filters(req.get('filters'))
+    return user_id, basket_ids, gamma, req.get('filters')
 
-        # 3. Re-ranking using INDICES
-        final_scores = []
-        for idx in candidate_indices:
-            idx = int(idx)
-            if idx < 0 or idx >= len(item_embeddings): continue
-            if idx in basket_indices: continue
 
-            original_pid = idx2prod.get(idx)
-            if original_pid is None: continue
+@app.route('/recommend/batch', methods=['POST'])
+def recommend_batch():
+    """
+    Body: {"requests": [{"user_id": ..., "basket_ids": [...], "gamma": 0.5, "filters": {...}}, ...]}
+    Returns {"results": [{"user_id": ..., "recommendations": [...]}, ...]} in request order.
+    All query vectors go through a single FAISS search and one re-rank pass.
+    """
+    data = request.get_json()
+    batch_requests = data.get('requests') if data else None
+    if not isinstance(batch_requests, list):
+        return jsonify({"error": "Expected a 'requests' list."}), 400
+    if len(batch_requests) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"Batch too large (max {MAX_BATCH_SIZE} requests)."}), 400
 
-            pref_score = np.dot(query_vec_norm[0], item_embeddings[idx])
-            health_score = product_health_factors.get(original_pid, 0.5) 
-            final_score = (1 - gamma) * pref_score + gamma * health_score
-            final_scores.append((original_pid, float(final_score)))
+    # Validate every entry up front so one malformed item is a 400 naming it, not a 500 for all
+    parsed_requests = []
+    for position, req in enumerate(batch_requests):
+        try:
+            parsed_requests.append(parse_batch_item(req))
+        except ValueError as e:
+            return jsonify({"error": f"Invalid request at index {position}: {e}"}), 400
 
-        # 4. Sort and return top N ORIGINAL product IDs
-        final_scores.sort(key=lambda x: x[1], reverse=True)
-        top_original_product_ids = [pid for pid, score in final_scores[:12]]
+    snap = current_snapshot # Pin one model version for the whole batch
 
-        return jsonify({"recommendations": top_original_product_ids})
+    try:
+        results = recommend_many(snap, parsed_requests)
+        return jsonify({"results": [
+            {"user_id": req.get('user_id'), "recommendations": recommendations}
+            for req, recommendations in zip(batch_requests, results)
+        ]})
 
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": f"Invalid request: {e}"}), 400
     except Exception as e:
-        print(f"An unexpected error occurred during recommendation: {e}")
+        print(f"An unexpected error occurred during batch recommendation: {e}")
         traceback.print_exc()
         return jsonify({"error": "Could not process the request."}), 500
 
-# --- 4. RUN THE APPLICATION ---
-if __name__ == '__main__':
+# --- 5. ADMIN: MODEL VERSIONS AND HOT RELOAD ---
+def _admin_allowed():
+    if ADMIN_TOKEN:
+        return request.headers.get('X-Admin-Token') == ADMIN_TOKEN
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+
+@app.route('/admin/model', methods=['GET'])
+def model_info():
+    if not _admin_allowed():
+        return jsonify({"error": "Forbidden."}), 403
+    snap = current_snapshot
+    return jsonify({
+        "version": snap.version if snap else None,
+        "loaded_at": snap.loaded_at if snap else None,
+        "available_versions": list_model_versions(MODEL_DIR),
+        "reload": reload_status,
+        "candidate_cache": candidate_cache.stats(),
+        "micro_batcher": micro_batcher.stats() if micro_batcher is not None else None,
+    })
+
+
+@app.route('/admin/reload', methods=['POST'])
+def trigger_reload():
+    """
+    Body (optional): {"version": "<dir name under MODEL_DIR>"}
+    Points CURRENT at the version (so every gunicorn worker's watcher follows) and starts
+    loading it in the background here. Returns 202 immediately; poll GET /admin/model.
+    """
+    if not _admin_allowed():
+        return jsonify({"error": "Forbidden."}), 403
+    data = request.get_json(silent=True) or {}
+    version = data.get('version')
+    if version is not None:
+        if version not in list_model_versions(MODEL_DIR):
+            return jsonify({"error": f"Unknown model version '{version}'."}), 404
+        write_current_version(MODEL_DIR, version)
+    reload_model_in_background(version)
+    return jsonify({"status": "reloading", "version": version or resolve_model_version(MODEL_DIR)}), 202
+
+# --- 6. APP FACTORY ---
+def create_app():
+    """
+    Loads every artifact and returns the Flask app.
+    gunicorn.conf.py calls this once in the master (preload_app=True) so workers
+    inherit the index, embeddings and id maps copy-on-write instead of loading their own.
+    """
     load_artifacts()
+    return app
+
+# --- 7. RUN THE APPLICATION (development server) ---
+if __name__ == '__main__':
+    create_app()
+    start_model_watcher()
     print(f"✅ Flask server starting on port 5000...")
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,323 @@
+import os
+import json
+import time
+from dataclasses import dataclass, field
+
+import faiss
+import numpy as np
+import pandas as pd
+
+# Artifacts live in versioned directories under MODEL_DIR:
+#
+#   ml_models/
+#     CURRENT                      <- optional, contains the active version name
+#     2025-11-02/
+#       manifest.json, user_embeddings.npy, item_embeddings.npy,
+#       product_to_idx.json, user_to_idx.json,                (from triple2vec_train.py)
+#       user_topk_indices.npy, user_topk_scores.npy           (optional, from precompute_user_topk.py)
+#       faiss_item_index.idx,                                 (from build_faiss.py)
+#       products_with_nutrition_and_health_10k.parquet        (from do_all.py; full catalog, legacy name)
+#       products.csv                                          (optional Instacart catalog: names, categories)
+#     2025-11-03/
+#       ...
+#
+# Without a CURRENT file the lexicographically latest version directory is used.
+# A flat MODEL_DIR (no version directories) is still accepted as version "default".
+
+MODEL_DIR = os.environ.get('MODEL_DIR', 'ml_models') # Root holding one directory per model version
+CURRENT_FILE = 'CURRENT'
+MANIFEST_FILE = 'manifest.json'
+FAISS_INDEX_FILE = 'faiss_item_index.idx'
+# Legacy name: do_all.py now enriches the full catalog, but existing model directories (and
+# ingest_products.py) expect this file name, and the unsuffixed name is map_products_to_nutrition.py's output.
+NUTRITION_FILE = 'products_with_nutrition_and_health_10k.parquet'
+PRODUCTS_CSV_FILE = 'products.csv'
+LEGACY_VERSION = 'default'
+DEFAULT_HEALTH_FACTOR = 0.5
+USER_EMBEDDING_DTYPES = ('float32', 'float16', 'int8')
+HEALTH_BUCKETS = 10 # Pre-filter bitmaps exist for health >= 0.0, 0.1, ..., 0.9
+
+
+class ArtifactError(Exception):
+    """Raised when a model version is missing files or fails validation."""
+
+
+@dataclass(frozen=True)
+class ModelSnapshot:
+    """Everything one request needs, loaded together and never mutated after publication."""
+    version: str
+    model_dir: str
+    manifest: dict
+    faiss_index: object
+    user_embeddings: np.ndarray   # (num_users, dim) float32 / float16 / int8, memory-mapped
+    item_embeddings: np.ndarray   # float32 (num_products, dim), normalized, memory-mapped
+    item_health: np.ndarray       # float32 health factor per embedding row
+    prod2idx: dict
+    idx2prod_array: np.ndarray    # embedding row -> product ID (-1 when unmapped)
+    user2idx: dict
+    user_topk_indices: np.ndarray = None # int32 (num_users, K) precomputed candidates, best first (optional)
+    user_topk_scores: np.ndarray = None  # float16 (num_users, K) preference scores for those candidates
+    user_scales: np.ndarray = None       # float32 (num_users,) per-row scales for int8 user embeddings
+    # Packed (np.packbits, little bit order) bitmaps over embedding rows, for FAISS IDSelectorBitmap
+    mapped_bitmap: np.ndarray = None     # rows that have a product ID
+    health_bitmaps: tuple = ()           # health_bitmaps[b]: rows with health >= b / HEALTH_BUCKETS
+    category_bitmaps: dict = None        # {"department": {id: bitmap}, "aisle": {id: bitmap}}
+    loaded_at: float = field(default_factory=time.time)
+
+    def user_vector(self, user_index):
+        """float32 embedding for one user, dequantized when the bundle stores float16 / int8."""
+        row = np.asarray(self.user_embeddings[user_index], dtype='float32')
+        if self.user_scales is not None:
+            row = row * self.user_scales[user_index]
+        return row
+
+
+def list_model_versions(model_root):
+    """Version directories under model_root that contain a serving manifest, oldest first."""
+    if not os.path.isdir(model_root):
+        return []
+    return sorted(
+        name for name in os.listdir(model_root)
+        if os.path.isfile(os.path.join(model_root, name, MANIFEST_FILE))
+    )
+
+
+def resolve_model_version(model_root):
+    """Returns the version that should be live: CURRENT, else the latest directory, else the flat layout."""
+    current_path = os.path.join(model_root, CURRENT_FILE)
+    if os.path.isfile(current_path):
+        with open(current_path, 'r') as f:
+            version = f.read().strip()
+        if version:
+            return version
+
+    versions = list_model_versions(model_root)
+    if versions:
+        return versions[-1]
+    return LEGACY_VERSION
+
+
+def version_dir(model_root, version):
+    if version == LEGACY_VERSION and not os.path.isdir(os.path.join(model_root, version)):
+        return model_root
+    return os.path.join(model_root, version)
+
+
+def write_current_version(model_root, version):
+    """Atomically points CURRENT at version (write to a temp file, then rename)."""
+    tmp_path = os.path.join(model_root, f".{CURRENT_FILE}.tmp")
+    with open(tmp_path, 'w') as f:
+        f.write(version + "\n")
+    os.replace(tmp_path, os.path.join(model_root, CURRENT_FILE))
+
+
+def read_faiss_index(path):
+    """
+    Reads the FAISS index. Workers share it through preload_app + fork copy-on-write (the
+    index is never written after loading). FAISS cannot mmap HNSW indexes, so IO_FLAG_MMAP
+    does nothing here. Where the installed faiss has IO_FLAG_MMAP_IFC, the flat vector
+    storage is mapped in place as a best effort, and the graph is still read into memory.
+    """
+    mmap_flag = getattr(faiss, 'IO_FLAG_MMAP_IFC', None)
+    if mmap_flag is None:
+        return faiss.read_index(path)
+    try:
+        return faiss.read_index(path, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError as e:
+        print(f"⚠️ Warning: Could not map FAISS index storage in place ({e}). Reading it into memory instead.")
+        return faiss.read_index(path)
+
+
+def load_id_map(path, name):
+    try:
+        with open(path, 'r') as f:
+            return {int(k): int(v) for k, v in json.load(f).items()}
+    except FileNotFoundError:
+        raise ArtifactError(f"{name} mapping file not found at '{path}'.")
+    except (ValueError, AttributeError) as e:
+        raise ArtifactError(f"Could not parse {name} mapping '{path}': {e}")
+
+
+def load_health_vector(model_dir, prod2idx, num_items):
+    """Builds a float32 health vector indexed by embedding row (DEFAULT_HEALTH_FACTOR where unknown)."""
+    nutrition_path = os.path.join(model_dir, NUTRITION_FILE)
+    print(f"Loading product health data from {nutrition_path}...")
+    try:
+        product_df = pd.read_parquet(nutrition_path)
+    except FileNotFoundError:
+        raise ArtifactError(f"Product data file not found at '{nutrition_path}'.")
+
+    if 'health_factor' not in product_df.columns:
+        raise ArtifactError(f"'{nutrition_path}' has no 'health_factor' column. Available: {list(product_df.columns)}")
+
+    item_health = np.full(num_items, DEFAULT_HEALTH_FACTOR, dtype='float32')
+
+    if 'product_id' in product_df.columns:
+        product_ids = product_df['product_id']
+    else:
+        # Older enrichment outputs only carry 'instacart_product' (the name);
+        # recover product IDs from the Instacart catalog like ingest_products.py does.
+        products_csv_path = os.path.join(model_dir, PRODUCTS_CSV_FILE)
+        try:
+            catalog_df = pd.read_csv(products_csv_path, usecols=['product_id', 'product_name'])
+        except FileNotFoundError:
+            print(f"⚠️ Warning: '{nutrition_path}' has no 'product_id' column and '{products_csv_path}' is missing.")
+            print(f"   Every product will use the default health factor ({DEFAULT_HEALTH_FACTOR}).")
+            return item_health
+        name2pid = dict(zip(catalog_df['product_name'], catalog_df['product_id']))
+        product_ids = product_df['instacart_product'].map(name2pid)
+
+    health_rows = product_ids.map(prod2idx)
+    health_values = pd.to_numeric(product_df['health_factor'], errors='coerce')
+    has_health = (health_rows.notna() & health_values.notna()).to_numpy()
+
+    item_health[health_rows[has_health].to_numpy(dtype='int64')] = health_values[has_health].to_numpy(dtype='float32')
+    print(f"✅ Health factors aligned to {int(has_health.sum())} / {num_items} embedding rows.")
+    return item_health
+
+
+def pack_rows(mask):
+    """Bool mask over embedding rows -> packed bitmap in the bit order faiss.IDSelectorBitmap expects."""
+    return np.packbits(mask, bitorder='little')
+
+
+def load_category_bitmaps(model_dir, prod2idx, num_items):
+    """Department / aisle bitmaps from the Instacart products.csv, when it is shipped with the model."""
+    products_csv_path = os.path.join(model_dir, PRODUCTS_CSV_FILE)
+    try:
+        catalog_df = pd.read_csv(products_csv_path, usecols=['product_id', 'aisle_id', 'department_id'])
+    except (FileNotFoundError, ValueError):
+        print(f"⚠️ Warning: No usable '{products_csv_path}'. Category filters are disabled for this model.")
+        return {"department": {}, "aisle": {}}
+
+    catalog_df['row'] = catalog_df['product_id'].map(prod2idx)
+    catalog_df = catalog_df.dropna(subset=['row'])
+    rows = catalog_df['row'].to_numpy(dtype='int64')
+
+    category_bitmaps = {}
+    for kind, column in (("department", 'department_id'), ("aisle", 'aisle_id')):
+        bitmaps = {}
+        for category_id, group_rows in pd.Series(rows).groupby(catalog_df[column].to_numpy()):
+            mask = np.zeros(num_items, dtype=bool)
+            mask[group_rows.to_numpy()] = True
+            bitmaps[int(category_id)] = pack_rows(mask)
+        category_bitmaps[kind] = bitmaps
+    print(f"✅ Built pre-filter bitmaps for {len(category_bitmaps['department'])} departments "
+          f"and {len(category_bitmaps['aisle'])} aisles.")
+    return category_bitmaps
+
+
+def load_snapshot(model_root, version):
+    """Loads and validates one model version. Raises ArtifactError instead of exiting."""
+    model_dir = version_dir(model_root, version)
+    print(f"📦 Loading model version '{version}' from {model_dir}...")
+
+    # Serving bundle manifest (exported by triple2vec_train.py)
+    manifest_path = os.path.join(model_dir, MANIFEST_FILE)
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        bundle_files = manifest['files']
+        num_users = manifest['num_users']
+        num_products = manifest['num_products']
+        embedding_dim = manifest['embedding_dim']
+    except FileNotFoundError:
+        raise ArtifactError(f"Serving bundle manifest not found at '{manifest_path}'. "
+                            "Run 'triple2vec_train.py' and copy data/embeddings/serving/ into the model directory.")
+    except (KeyError, ValueError) as e:
+        raise ArtifactError(f"Invalid serving bundle manifest '{manifest_path}': {e}")
+
+    # Memory-map the embeddings: pages are read lazily and shared between processes
+    try:
+        user_embeddings = np.load(os.path.join(model_dir, bundle_files['user_embeddings']['path']), mmap_mode='r')
+        item_embeddings = np.load(os.path.join(model_dir, bundle_files['item_embeddings']['path']), mmap_mode='r')
+    except FileNotFoundError as e:
+        raise ArtifactError(f"Embedding file not found: {e}")
+    if user_embeddings.shape != (num_users, embedding_dim) or item_embeddings.shape != (num_products, embedding_dim):
+        raise ArtifactError(f"Embedding shapes {user_embeddings.shape} / {item_embeddings.shape} do not match the manifest.")
+    if user_embeddings.dtype.name not in USER_EMBEDDING_DTYPES or item_embeddings.dtype != np.float32:
+        raise ArtifactError(f"Unsupported embedding dtypes {user_embeddings.dtype} / {item_embeddings.dtype}.")
+    user_scales = None
+    if user_embeddings.dtype == np.int8:
+        if 'user_scales' not in bundle_files:
+            raise ArtifactError("int8 user embeddings need 'user_scales' in the manifest.")
+        user_scales = np.load(os.path.join(model_dir, bundle_files['user_scales']['path']), mmap_mode='r')
+        if user_scales.shape != (num_users,):
+            raise ArtifactError(f"User scales shape {user_scales.shape} does not match {num_users} users.")
+    print(f"Embeddings memory-mapped. Users: {user_embeddings.shape} {user_embeddings.dtype}, Items: {item_embeddings.shape}")
+
+    # FAISS index
+    faiss_index_path = os.path.join(model_dir, FAISS_INDEX_FILE)
+    if not os.path.isfile(faiss_index_path):
+        raise ArtifactError(f"FAISS index not found at '{faiss_index_path}'.")
+    print(f"Loading FAISS index from {faiss_index_path}...")
+    faiss_index = read_faiss_index(faiss_index_path)
+    if faiss_index.d != embedding_dim or faiss_index.ntotal != num_products:
+        raise ArtifactError(f"FAISS index (d={faiss_index.d}, ntotal={faiss_index.ntotal}) does not match "
+                            f"the embeddings (d={embedding_dim}, rows={num_products}).")
+
+    # Product / user mappings
+    prod2idx = load_id_map(os.path.join(model_dir, bundle_files['product_to_idx']['path']), "Product")
+    user2idx = load_id_map(os.path.join(model_dir, bundle_files['user_to_idx']['path']), "User")
+    if len(prod2idx) != num_products:
+        print(f"⚠️ Warning: Mismatch between num_products ({num_products}) and mapping size ({len(prod2idx)}).")
+    if len(user2idx) != num_users:
+        print(f"⚠️ Warning: Mismatch between num_users ({num_users}) and mapping size ({len(user2idx)}).")
+    if any(not 0 <= idx < num_users for idx in user2idx.values()):
+        raise ArtifactError("User mapping points outside the user embedding table.")
+
+    # Dense row -> product ID lookup used by the re-ranker
+    idx2prod_array = np.full(num_products, -1, dtype='int64')
+    for pid, idx in prod2idx.items():
+        if not 0 <= idx < num_products:
+            raise ArtifactError(f"Product mapping points outside the item embedding table (row {idx}).")
+        idx2prod_array[idx] = pid
+    print(f"✅ Loaded product ID <-> index mappings ({len(prod2idx)} entries) and {len(user2idx)} users.")
+
+    item_health = load_health_vector(model_dir, prod2idx, num_products)
+
+    # Optional: precomputed top-K per known user (precompute_user_topk.py)
+    user_topk_indices = user_topk_scores = None
+    if 'user_topk_indices' in bundle_files and 'user_topk_scores' in bundle_files:
+        try:
+            user_topk_indices = np.load(os.path.join(model_dir, bundle_files['user_topk_indices']['path']), mmap_mode='r')
+            user_topk_scores = np.load(os.path.join(model_dir, bundle_files['user_topk_scores']['path']), mmap_mode='r')
+        except FileNotFoundError as e:
+            raise ArtifactError(f"Top-K file listed in the manifest is missing: {e}")
+        if user_topk_indices.shape != user_topk_scores.shape or user_topk_indices.shape[0] != num_users:
+            raise ArtifactError(f"Top-K arrays {user_topk_indices.shape} / {user_topk_scores.shape} "
+                                f"do not match {num_users} users.")
+        print(f"✅ Precomputed top-{user_topk_indices.shape[1]} candidates memory-mapped for {num_users} users.")
+
+    # Smoke test: the index must answer a query built from its own embeddings
+    probe = np.ascontiguousarray(item_embeddings[:1], dtype='float32')
+    _, probe_indices = faiss_index.search(probe, 1)
+    if probe_indices.shape != (1, 1) or probe_indices[0, 0] < 0:
+        raise ArtifactError("FAISS index returned no result for a probe query.")
+
+    # Pre-filter bitmaps (ANN search restricted with faiss.IDSelectorBitmap)
+    mapped_bitmap = pack_rows(idx2prod_array >= 0)
+    health_bitmaps = tuple(pack_rows(item_health >= b / HEALTH_BUCKETS) for b in range(HEALTH_BUCKETS))
+    category_bitmaps = load_category_bitmaps(model_dir, prod2idx, num_products)
+
+    for array in (idx2prod_array, item_health, mapped_bitmap, *health_bitmaps):
+        array.flags.writeable = False
+
+    return ModelSnapshot(
+        version=version,
+        model_dir=model_dir,
+        manifest=manifest,
+        faiss_index=faiss_index,
+        user_embeddings=user_embeddings,
+        item_embeddings=item_embeddings,
+        item_health=item_health,
+        prod2idx=prod2idx,
+        idx2prod_array=idx2prod_array,
+        user2idx=user2idx,
+        user_topk_indices=user_topk_indices,
+        user_topk_scores=user_topk_scores,
+        user_scales=user_scales,
+        mapped_bitmap=mapped_bitmap,
+        health_bitmaps=health_bitmaps,
+        category_bitmaps=category_bitmaps,
+    )
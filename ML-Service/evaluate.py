@@ -0,0 +1,246 @@
+# evaluate.py
+# Offline quality gate for a served model version.
+#
+# Holds out every user's last order (orders.csv eval_set == "train", lines from
+# order_products__train.csv), queries the model exactly as /recommend does for a known user with
+# an empty basket (same snapshot, FAISS index, score_candidates and gamma fusion), and reports
+# recall@12 / NDCG@12 plus health-weighted variants over a sweep of gamma and N_CANDIDATES.
+#
+#   python evaluate.py --version v2 --gammas 0 0.5 1 --candidates 50 100 200
+import argparse
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv as pa_csv
+
+from artifacts import MODEL_DIR, ArtifactError, load_snapshot, resolve_model_version
+from ranking import N_CANDIDATES, N_RECOMMENDATIONS, rank_rows_by_gamma, score_candidates
+
+# --- Configuration ---
+KAGGLE_DIR = "offline-ml-pipeline/data/kaggle"
+HELDOUT_EVAL_SET = "train" # Instacart's last order per user; "prior" orders are what the model trained on
+GAMMAS = (0.0, 0.25, 0.5, 0.75, 1.0)
+CANDIDATES = (50, N_CANDIDATES, 200)
+BATCH_SIZE = 4096
+REPORT_FILE = "evaluation_report.json"
+# ---------------------
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Recall/NDCG@12 of a served model version on held-out last orders.")
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    parser.add_argument("--version", default=None, help="Model version to evaluate (default: the live one)")
+    parser.add_argument("--kaggle-dir", default=KAGGLE_DIR)
+    parser.add_argument("--gammas", nargs="+", type=float, default=list(GAMMAS))
+    parser.add_argument("--candidates", nargs="+", type=int, default=list(CANDIDATES))
+    parser.add_argument("--sample-users", type=int, default=0, help="Evaluate a random subset (0 = all held-out users)")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE)
+    parser.add_argument("--report", default=REPORT_FILE)
+    return parser.parse_args()
+
+
+class StageTimer:
+    def __init__(self):
+        self.seconds = {}
+
+    def add(self, name, started):
+        self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - started
+
+    def rounded(self):
+        return {name: round(seconds, 3) for name, seconds in self.seconds.items()}
+
+
+def load_heldout(kaggle_dir, snap):
+    """
+    Held-out baskets in CSR form over the snapshot's embedding rows:
+    (user_rows, offsets, item_rows). Users the model never saw and products outside its
+    vocabulary are dropped; users left with an empty basket are skipped.
+    """
+    orders = pa_csv.read_csv(
+        os.path.join(kaggle_dir, "orders.csv"),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=["order_id", "user_id", "eval_set"],
+            column_types={"order_id": pa.int32(), "user_id": pa.int32(), "eval_set": pa.string()},
+        ),
+    )
+    orders = orders.filter(pc.equal(orders.column("eval_set"), HELDOUT_EVAL_SET))
+    lines = pa_csv.read_csv(
+        os.path.join(kaggle_dir, f"order_products__{HELDOUT_EVAL_SET}.csv"),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=["order_id", "product_id"],
+            column_types={"order_id": pa.int32(), "product_id": pa.int32()},
+        ),
+    )
+
+    order_ids = orders.column("order_id").to_numpy()
+    user_ids = orders.column("user_id").to_numpy()
+    line_orders = lines.column("order_id").to_numpy()
+    line_products = lines.column("product_id").to_numpy()
+
+    # Dense id -> row lookups, so whole columns are remapped with one fancy index
+    order_to_user = np.full(max(int(order_ids.max()), int(line_orders.max())) + 1, -1, dtype='int64')
+    order_to_user[order_ids] = [snap.user2idx.get(int(uid), -1) for uid in user_ids]
+    product_lookup = np.full(max(int(line_products.max()), max(snap.prod2idx)) + 1, -1, dtype='int64')
+    product_lookup[list(snap.prod2idx.keys())] = list(snap.prod2idx.values())
+    line_users = order_to_user[line_orders]
+    line_items = product_lookup[line_products]
+    keep = (line_users >= 0) & (line_items >= 0)
+
+    # One held-out basket per user: group lines by user row
+    line_users, line_items = line_users[keep], line_items[keep]
+    order = np.argsort(line_users, kind='stable')
+    line_users, line_items = line_users[order], line_items[order]
+    users, starts, counts = np.unique(line_users, return_index=True, return_counts=True)
+    offsets = np.append(starts, len(line_users)).astype('int64')
+    return users, offsets, line_items
+
+
+def query_matrix_for(snap, user_rows):
+    """Empty-basket /recommend query: the (dequantized) user vector, L2-normalized."""
+    queries = np.ascontiguousarray(np.vstack([snap.user_vector(int(row)) for row in user_rows]), dtype='float32')
+    faiss.normalize_L2(queries)
+    return queries
+
+
+def batch_metrics(snap, ranked_rows, truth_offsets, truth_items, batch_start):
+    """Per-user sums for one batch; truth is the CSR slice belonging to users batch_start.. ."""
+    num_rows, k = ranked_rows.shape
+    num_items = len(snap.item_embeddings)
+    lo, hi = truth_offsets[batch_start], truth_offsets[batch_start + num_rows]
+    truth_sizes = np.diff(truth_offsets[batch_start:batch_start + num_rows + 1])
+    truth_owner = np.repeat(np.arange(num_rows, dtype='int64'), truth_sizes)
+    truth_items = truth_items[lo:hi]
+    truth_keys = truth_owner * num_items + truth_items
+
+    rec_keys = np.arange(num_rows, dtype='int64')[:, None] * num_items + np.maximum(ranked_rows, 0)
+    hits = np.isin(rec_keys, truth_keys) & (ranked_rows >= 0)
+
+    health = snap.item_health
+    rec_health = np.where(ranked_rows >= 0, health[np.maximum(ranked_rows, 0)], 0.0)
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+
+    # Ideal DCG: all relevant items first (binary) / highest-health relevant items first (weighted)
+    ideal_counts = np.minimum(truth_sizes, k)
+    ideal_dcg = np.concatenate([[0.0], np.cumsum(discounts)])[ideal_counts]
+    truth_health = health[truth_items]
+    truth_health_sum = np.bincount(truth_owner, weights=truth_health, minlength=num_rows)
+    sorted_health = np.zeros((num_rows, k))
+    by_health = np.lexsort((-truth_health, truth_owner))
+    rank_in_user = np.arange(len(by_health)) - np.repeat(truth_offsets[batch_start:batch_start + num_rows] - lo, truth_sizes)
+    top = rank_in_user < k
+    sorted_health[truth_owner[by_health][top], rank_in_user[top]] = truth_health[by_health][top]
+    ideal_weighted_dcg = sorted_health @ discounts
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        recall = hits.sum(axis=1) / truth_sizes
+        ndcg = (hits * discounts).sum(axis=1) / ideal_dcg
+        weighted_recall = np.where(truth_health_sum > 0, (hits * rec_health).sum(axis=1) / truth_health_sum, 0.0)
+        weighted_ndcg = np.where(ideal_weighted_dcg > 0, (hits * rec_health * discounts).sum(axis=1) / ideal_weighted_dcg, 0.0)
+        filled = (ranked_rows >= 0).sum(axis=1)
+        mean_health = np.where(filled > 0, rec_health.sum(axis=1) / np.maximum(filled, 1), 0.0)
+
+    return {
+        "recall": float(recall.sum()),
+        "ndcg": float(ndcg.sum()),
+        "health_recall": float(weighted_recall.sum()),
+        "health_ndcg": float(weighted_ndcg.sum()),
+        "mean_rec_health": float(mean_health.sum()),
+    }
+
+
+def main():
+    args = parse_args()
+    timer = StageTimer()
+
+    # --- 1. Model snapshot (exactly what app.py would serve) ---
+    started = time.perf_counter()
+    version = args.version or resolve_model_version(args.model_dir)
+    try:
+        snap = load_snapshot(args.model_dir, version)
+    except ArtifactError as e:
+        print(f"❌ {e}")
+        exit()
+    timer.add("load_model", started)
+
+    # --- 2. Held-out last orders ---
+    started = time.perf_counter()
+    try:
+        user_rows, truth_offsets, truth_items = load_heldout(args.kaggle_dir, snap)
+    except FileNotFoundError as e:
+        print(f"❌ Error loading held-out orders: {e}")
+        exit()
+    if args.sample_users and args.sample_users < len(user_rows):
+        rng = np.random.default_rng(0)
+        picked = np.sort(rng.choice(len(user_rows), size=args.sample_users, replace=False))
+        sizes = np.diff(truth_offsets)[picked]
+        truth_items = np.concatenate([truth_items[truth_offsets[i]:truth_offsets[i + 1]] for i in picked])
+        user_rows = user_rows[picked]
+        truth_offsets = np.concatenate([[0], np.cumsum(sizes)]).astype('int64')
+    timer.add("load_heldout", started)
+    num_users = len(user_rows)
+    print(f"🧺 Evaluating {num_users:,} users on their held-out last order "
+          f"({len(truth_items):,} items, mean {len(truth_items) / max(num_users, 1):.1f} per basket)")
+
+    # --- 3. Sweep: one FAISS search per (batch, N_CANDIDATES), every gamma re-ranks the same candidates ---
+    sums = {(n, g): {} for n in args.candidates for g in args.gammas}
+    for batch_start in range(0, num_users, args.batch):
+        batch_rows = user_rows[batch_start:batch_start + args.batch]
+        started = time.perf_counter()
+        queries = query_matrix_for(snap, batch_rows)
+        timer.add("build_queries", started)
+
+        for n in args.candidates:
+            started = time.perf_counter()
+            _, candidate_indices = snap.faiss_index.search(queries, n)
+            timer.add(f"faiss_search@{n}", started)
+
+            started = time.perf_counter()
+            safe_indices, pref_scores = score_candidates(snap, queries, candidate_indices, [[] for _ in batch_rows])
+            timer.add(f"score_candidates@{n}", started)
+
+            for gamma in args.gammas:
+                started = time.perf_counter()
+                ranked = rank_rows_by_gamma(snap, safe_indices, pref_scores, gamma, N_RECOMMENDATIONS)
+                timer.add("rank_by_gamma", started)
+                started = time.perf_counter()
+                for name, value in batch_metrics(snap, ranked, truth_offsets, truth_items, batch_start).items():
+                    sums[(n, gamma)][name] = sums[(n, gamma)].get(name, 0.0) + value
+                timer.add("metrics", started)
+        print(f"   • {min(batch_start + args.batch, num_users):,}/{num_users:,} users")
+
+    # --- 4. Report ---
+    k = N_RECOMMENDATIONS
+    results = [
+        dict(n_candidates=n, gamma=gamma, **{f"{name}@{k}" if name != "mean_rec_health" else name: round(total / num_users, 5)
+                                             for name, total in sums[(n, gamma)].items()})
+        for n in args.candidates for gamma in args.gammas
+    ]
+    print(f"\n{'N_cand':>7}{'gamma':>7}{f'recall@{k}':>12}{f'ndcg@{k}':>11}{f'h-recall@{k}':>14}{f'h-ndcg@{k}':>13}{'rec health':>12}")
+    for row in results:
+        print(f"{row['n_candidates']:>7}{row['gamma']:>7.2f}{row[f'recall@{k}']:>12.4f}{row[f'ndcg@{k}']:>11.4f}"
+              f"{row[f'health_recall@{k}']:>14.4f}{row[f'health_ndcg@{k}']:>13.4f}{row['mean_rec_health']:>12.4f}")
+    print("\n⏱️ Wall time per stage (s): " + ", ".join(f"{name} {seconds}" for name, seconds in timer.rounded().items()))
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "model_version": version,
+        "faiss_index": type(faiss.downcast_index(snap.faiss_index)).__name__,
+        "user_embedding_dtype": str(snap.user_embeddings.dtype),
+        "num_users": num_users,
+        "heldout_eval_set": HELDOUT_EVAL_SET,
+        "k": k,
+        "results": results,
+        "stage_seconds": timer.rounded(),
+    }
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Evaluation report saved to: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+# gunicorn.conf.py
+# Pre-fork serving mode: run from ML-Service/ with
+#   gunicorn -c gunicorn.conf.py
+#
+# The master imports app.py and calls create_app() once (preload_app=True), so the
+# FAISS index, the memory-mapped embeddings and the id maps are loaded before forking
+# and shared copy-on-write by every worker. The HNSW index is a heap copy (FAISS cannot
+# mmap it); its pages stay shared only because workers never write to it.
+import os
+import multiprocessing
+
+# --- Worker layout ---
+bind = os.environ.get("ML_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("ML_WORKERS", 8))
+# With ML_MICRO_BATCH=1 each worker needs several request threads so their
+# /recommend calls can be gathered into one FAISS search (see micro_batcher.py).
+threads = int(os.environ.get("ML_THREADS", 16 if os.environ.get("ML_MICRO_BATCH") == "1" else 1))
+worker_class = "gthread" if threads > 1 else "sync"
+timeout = int(os.environ.get("ML_TIMEOUT", 60))
+preload_app = True
+wsgi_app = "app:create_app()"
+
+# --- Per-worker thread budget ---
+# N workers each spinning up one OpenMP/BLAS thread per core would oversubscribe the box,
+# so every worker gets an equal share of the cores (at least one).
+THREADS_PER_WORKER = int(os.environ.get(
+    "ML_THREADS_PER_WORKER",
+    max(1, multiprocessing.cpu_count() // workers),
+))
+
+# These must be set before numpy/faiss are imported, i.e. before the app is preloaded.
+for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(var, str(THREADS_PER_WORKER))
+
+
+def post_fork(server, worker):
+    import faiss
+    from app import start_model_watcher
+    faiss.omp_set_num_threads(THREADS_PER_WORKER)
+    server.log.info(f"Worker {worker.pid} using {THREADS_PER_WORKER} FAISS/OpenMP thread(s).")
+    # Each worker follows MODEL_DIR/CURRENT on its own. Memory-mapped files of the new
+    # version are still shared through the page cache across workers.
+    start_model_watcher()
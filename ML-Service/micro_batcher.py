@@ -0,0 +1,95 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Collects items submitted by concurrent request threads and hands them to
+    process_batch(items) -> results in groups.
+
+    A batch is dispatched as soon as it holds max_batch items or max_wait_ms has passed
+    since its first item arrived, whichever comes first. Each caller gets a Future that
+    completes with its own entry of the results list. If a batch raises, its items are retried
+    one at a time, so only the request that actually fails gets the exception.
+    The dispatcher thread is started lazily on first use so it is created in the serving
+    process (after a gunicorn fork), never in the master.
+    """
+
+    def __init__(self, process_batch, max_wait_ms=2.0, max_batch=64, name="micro-batcher"):
+        self.process_batch = process_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch = max_batch
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, item):
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def stats(self):
+        return {
+            "max_wait_ms": self.max_wait * 1000.0,
+            "max_batch": self.max_batch,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else None,
+            "queued": self._queue.qsize(),
+        }
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()] # Block until there is work
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            try:
+                results = self.process_batch(items)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    self._run_one_by_one(batch)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def _run_one_by_one(self, batch):
+        # One bad item (e.g. a malformed filter) must not fail the requests batched with it
+        for item, future in batch:
+            try:
+                result = self.process_batch([item])[0]
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += 1
+            future.set_result(result)
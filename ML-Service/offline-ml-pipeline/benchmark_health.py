@@ -0,0 +1,119 @@
+import argparse
+import json
+import math
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from compute_health_factor import PROFILES, ideal, score_frame, score_nutrient_dicts
+
+# --- Configuration ---
+NUM_ROWS = 3_000_000   # Roughly the size of the OpenFoodFacts dump
+ROW_LOOP_ROWS = 200_000 # Per-row baselines are timed on a slice and extrapolated
+MISSING_RATE = 0.15    # Share of missing individual nutrient values
+REPORT_FILE = "data/health_benchmark.json"
+# ---------------------
+
+NUTRIENTS = ["proteins_100g", "fat_100g", "carbohydrates_100g", "sugars_100g", "fiber_100g",
+             "saturated_fat_100g", "salt_100g"]
+
+
+# --- Per-row formulas the library replaced (reference for speed and agreement) ---
+def row_macro_balance(nutriments):
+    # compute_health_factor.compute_hf / do_all.compute_health_factor
+    p = nutriments.get('proteins_100g') or 0.0
+    f = nutriments.get('fat_100g') or 0.0
+    c = nutriments.get('carbohydrates_100g') or 0.0
+    dev = np.sqrt((p - ideal['protein']) ** 2 + (f - ideal['fat']) ** 2 + (c - ideal['carbs']) ** 2)
+    return max(0.0, 1.0 - dev / 100.0)
+
+
+def row_additive(nutrients):
+    # map_products_to_nutrition.compute_health_factor, rescaled from 0-100 to [0, 1]
+    protein = nutrients.get("proteins_100g") or 0
+    fiber = nutrients.get("fiber_100g") or 0
+    sugar = nutrients.get("sugars_100g") or 0
+    sat_fat = nutrients.get("saturated_fat_100g") or 0
+    salt = nutrients.get("salt_100g") or 0
+    score = (protein * 2 + fiber * 1.5) - (sugar * 1.2 + sat_fat * 1.0 + salt * 1.3)
+    return max(0, min(100, 50 + score)) / 100.0
+
+
+ROW_FORMULAS = {"macro_balance": row_macro_balance, "additive": row_additive}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Vectorized health factors vs the per-row implementations.")
+    parser.add_argument("--rows", type=int, default=NUM_ROWS)
+    parser.add_argument("--row-loop-rows", type=int, default=ROW_LOOP_ROWS)
+    parser.add_argument("--profiles", nargs="+", choices=list(ROW_FORMULAS), default=list(ROW_FORMULAS))
+    return parser.parse_args()
+
+
+def synthetic_nutrients(rows, seed=0):
+    """OFF-like per-100g values (float32, like the Parquet cache) with missing entries."""
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({name: rng.gamma(1.5, 8.0, size=rows).astype('float32') for name in NUTRIENTS})
+    for name in NUTRIENTS:
+        frame.loc[rng.random(rows) < MISSING_RATE, name] = np.nan
+    return frame
+
+
+def to_dicts(frame):
+    """Row dicts with None for missing values, as the per-row code received them."""
+    return [{k: (None if math.isnan(v) else float(v)) for k, v in row.items()} for row in frame.to_dict('records')]
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def main():
+    args = parse_args()
+    frame = synthetic_nutrients(args.rows)
+    sample = frame.head(args.row_loop_rows)
+    sample_dicts = to_dicts(sample)
+    print(f"🚀 Scoring {args.rows:,} rows (per-row baselines on {len(sample):,} rows, extrapolated)")
+
+    results = []
+    for profile in args.profiles:
+        row_fn = ROW_FORMULAS[profile]
+        row_scores, row_seconds = timed(lambda: np.array([row_fn(d) for d in sample_dicts]))
+        apply_scores, apply_seconds = timed(lambda: pd.Series(sample_dicts).apply(row_fn).to_numpy())
+        dict_scores, dict_seconds = timed(lambda: score_nutrient_dicts(sample_dicts, profile))
+        column_scores, column_seconds = timed(lambda: score_frame(frame, profile))
+
+        scale = args.rows / len(sample)
+        agreement = float(np.max(np.abs(np.round(row_scores, 3) - column_scores[:len(sample)])))
+        assert np.allclose(apply_scores, row_scores)
+        assert np.allclose(dict_scores, column_scores[:len(sample)])
+        results.append({
+            "profile": profile,
+            "columns": list(PROFILES[profile][0]),
+            "row_loop_sec_est": round(row_seconds * scale, 2),
+            "pandas_apply_sec_est": round(apply_seconds * scale, 2),
+            "dict_column_sec_est": round(dict_seconds * scale, 2),
+            "columnar_sec": round(column_seconds, 3),
+            "speedup_vs_row_loop": round(row_seconds * scale / column_seconds, 1),
+            "max_abs_diff_vs_row_loop": agreement,
+        })
+
+    # --- Report ---
+    print(f"\n{'profile':<16}{'row loop':>12}{'apply':>12}{'dict cols':>12}{'columnar':>12}{'speedup':>10}{'max diff':>10}")
+    for row in results:
+        print(f"{row['profile']:<16}{row['row_loop_sec_est']:>11.2f}s{row['pandas_apply_sec_est']:>11.2f}s"
+              f"{row['dict_column_sec_est']:>11.2f}s{row['columnar_sec']:>11.3f}s{row['speedup_vs_row_loop']:>9.0f}x"
+              f"{row['max_abs_diff_vs_row_loop']:>10.4f}")
+
+    os.makedirs(os.path.dirname(REPORT_FILE), exist_ok=True)
+    with open(REPORT_FILE, 'w') as f:
+        json.dump({"rows": args.rows, "row_loop_rows": len(sample), "results": results}, f, indent=2)
+    print(f"\n💾 Benchmark report saved to: {REPORT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
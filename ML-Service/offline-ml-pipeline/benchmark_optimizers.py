@@ -0,0 +1,109 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+from triple_sampler import BasketCSR, TripleBatchSampler
+from triple2vec_model import OPTIMIZERS, build_model, make_optimizer, train_step
+
+# --- Configuration (defaults mirror triple2vec_train.py on the full Instacart user table) ---
+NUM_USERS = 206209
+NUM_PRODUCTS = 49688 # Full Instacart catalog
+NUM_BASKETS = 200000
+EMBED_DIM = 64
+BATCH = 512
+NEG_SAMPLES = 5
+LR = 0.001
+WARMUP_BATCHES = 20
+TIMED_BATCHES = 200
+REPORT_FILE = "data/optimizer_benchmark.json"
+# ---------------------
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure triple2vec training samples/sec per optimizer (dense vs sparse).")
+    parser.add_argument("--optimizers", nargs="+", choices=list(OPTIMIZERS), default=list(OPTIMIZERS))
+    parser.add_argument("--users", type=int, default=NUM_USERS)
+    parser.add_argument("--products", type=int, default=NUM_PRODUCTS)
+    parser.add_argument("--baskets", type=int, default=NUM_BASKETS)
+    parser.add_argument("--embed-dim", type=int, default=EMBED_DIM)
+    parser.add_argument("--batch", type=int, default=BATCH)
+    parser.add_argument("--batches", type=int, default=TIMED_BATCHES, help="Timed batches per optimizer")
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads (default: torch's choice)")
+    return parser.parse_args()
+
+
+def synthetic_baskets(num_users, num_products, num_baskets, seed=0):
+    """
+    Random baskets with Instacart-like sizes (2-30 items, skewed small). The cost being measured is the
+    optimizer step versus table size, which does not depend on the basket contents.
+    """
+    rng = np.random.default_rng(seed)
+    sizes = np.clip(rng.geometric(0.1, size=num_baskets) + 1, 2, 30)
+    offsets = np.zeros(num_baskets + 1, dtype='int64')
+    np.cumsum(sizes, out=offsets[1:])
+    items = rng.integers(0, num_products, size=int(offsets[-1]))
+    users = rng.integers(0, num_users, size=num_baskets)
+    return BasketCSR(offsets, items, users)
+
+
+def benchmark_optimizer(name, baskets, args, device):
+    torch.manual_seed(0)
+    model = build_model(args.users, args.products, args.embed_dim, name, device)
+    opt = make_optimizer(model, name, LR)
+    sampler = TripleBatchSampler(baskets, args.products, args.batch, NEG_SAMPLES, seed=0)
+    batches = iter(sampler)
+
+    for _ in range(WARMUP_BATCHES):
+        train_step(model, opt, next(batches), device)
+
+    losses = []
+    started = time.perf_counter()
+    for _ in range(args.batches):
+        losses.append(train_step(model, opt, next(batches), device))
+    seconds = time.perf_counter() - started
+
+    return {
+        "optimizer": name,
+        "sparse": OPTIMIZERS[name],
+        "samples_per_sec": round(args.batches * args.batch / seconds, 1),
+        "ms_per_batch": round(seconds * 1000.0 / args.batches, 3),
+        "final_loss": round(float(np.mean(losses[-20:])), 4),
+    }
+
+
+def main():
+    args = parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    needed = (WARMUP_BATCHES + args.batches) * args.batch
+    baskets = synthetic_baskets(args.users, args.products, max(args.baskets, needed))
+    print(f"🚀 Benchmarking {', '.join(args.optimizers)} on {device} ({torch.get_num_threads()} threads): "
+          f"U={args.users}, V={args.products}, D={args.embed_dim}, batch={args.batch}")
+
+    results = []
+    for name in args.optimizers:
+        print(f"⏱️ {name}...")
+        results.append(benchmark_optimizer(name, baskets, args, device))
+
+    # --- Report ---
+    baseline = next((r for r in results if r["optimizer"] == "adam"), None)
+    print(f"\n{'optimizer':<18}{'samples/s':>14}{'ms/batch':>12}{'speedup':>10}{'loss':>10}")
+    for row in results:
+        speedup = row["samples_per_sec"] / baseline["samples_per_sec"] if baseline else float('nan')
+        row["speedup_vs_adam"] = round(speedup, 2) if baseline else None
+        print(f"{row['optimizer']:<18}{row['samples_per_sec']:>14,.0f}{row['ms_per_batch']:>12.2f}{speedup:>10.2f}{row['final_loss']:>10.4f}")
+
+    os.makedirs(os.path.dirname(REPORT_FILE), exist_ok=True)
+    with open(REPORT_FILE, 'w') as f:
+        json.dump({"device": device, "threads": torch.get_num_threads(), "users": args.users, "products": args.products,
+                   "embed_dim": args.embed_dim, "batch": args.batch, "timed_batches": args.batches, "results": results}, f, indent=2)
+    print(f"\n💾 Benchmark report saved to: {REPORT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
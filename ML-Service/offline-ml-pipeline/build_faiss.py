@@ -1,79 +1,284 @@
 import faiss
 import numpy as np
+import argparse
 import json
 import os
+import time
 
 # --- Configuration (Should match outputs from triple2vec_train.py) ---
 EMBEDDINGS_PATH = "data/embeddings/product_embeddings.npy"
 PROD2IDX_PATH = "data/embeddings/product_to_idx.json"
+USER_EMBEDDINGS_PATH = "data/embeddings/serving/user_embeddings.npy" # Benchmark queries, if available
 OUTPUT_DIR = "data" # Directory to save the FAISS index
 FAISS_INDEX_FILE = os.path.join(OUTPUT_DIR, "faiss_item_index.idx")
+BENCHMARK_REPORT_FILE = os.path.join(OUTPUT_DIR, "faiss_benchmark.json")
 
 # FAISS Index Configuration
 FAISS_METRIC = faiss.METRIC_INNER_PRODUCT # Use Inner Product for cosine similarity with normalized vectors
+# Any faiss.index_factory string; {placeholders} are filled from INDEX_PARAMS.
 # HNSW is generally a good balance of speed and accuracy
 # M=32 is a standard value for the number of connections per layer in HNSW
-FAISS_INDEX_TYPE = f"HNSW{32}"
-
-# Create output directory if it doesn't exist
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-print("🚀 Starting FAISS index build process...")
-
-# --- 1. Load Pre-computed Product Embeddings ---
-try:
-    print(f"📦 Loading product embeddings from: {EMBEDDINGS_PATH}")
-    product_embeddings = np.load(EMBEDDINGS_PATH)
-    # Ensure embeddings are in float32 format, required by FAISS
-    product_embeddings = product_embeddings.astype('float32')
-    num_products, embed_dim = product_embeddings.shape
-    print(f"✅ Loaded {num_products} product embeddings with dimension {embed_dim}.")
-except FileNotFoundError:
-    print(f"❌ Error: Embeddings file not found at '{EMBEDDINGS_PATH}'.")
-    print("➡ Please run 'triple2vec_train.py' first to generate embeddings.")
-    exit()
-except Exception as e:
-    print(f"❌ Error loading embeddings: {e}")
-    exit()
-
-# --- 2. Load Product-to-Index Mapping (Optional but recommended for verification) ---
-try:
-    with open(PROD2IDX_PATH, 'r') as f:
-        prod2idx = json.load(f)
-    print(f"✅ Loaded product-to-index mapping from: {PROD2IDX_PATH}")
-    # Sanity check: Ensure mapping size matches embedding count
-    if len(prod2idx) != num_products:
-        print(f"⚠️ Warning: Number of products in mapping ({len(prod2idx)}) does not match embeddings count ({num_products}).")
-except FileNotFoundError:
-    print(f"⚠️ Warning: Product-to-index mapping file not found at '{PROD2IDX_PATH}'. Index will be built, but mapping verification skipped.")
-except Exception as e:
-    print(f"⚠️ Warning: Error loading product mapping: {e}")
-
-
-# --- 3. Normalize Embeddings for Cosine Similarity ---
-# Normalizing ensures that Inner Product search is equivalent to Cosine Similarity
-print("📏 Normalizing embeddings (L2 normalization)...")
-faiss.normalize_L2(product_embeddings)
-print("✅ Embeddings normalized.")
-
-# --- 4. Build the FAISS Index ---
-print(f"🛠️ Building FAISS index ({FAISS_INDEX_TYPE}, Metric: {FAISS_METRIC})...")
-# Use IndexFactory for flexibility, HNSWFlat is efficient
-index = faiss.index_factory(embed_dim, FAISS_INDEX_TYPE, FAISS_METRIC)
-
-# Check if the index needs training (some index types do, HNSWFlat does not)
-if not index.is_trained:
-    print("   Index requires training...")
-    # Training is usually done on a subset of data for indexes like IVFFlat
-    # HNSWFlat does not require a separate training step.
-    # index.train(product_embeddings) # Uncomment if using an index that needs training
-    pass # HNSWFlat doesn't need explicit training
-
-print(f"➕ Adding {num_products} vectors to the index...")
-index.add(product_embeddings)
-print(f"✅ Index built successfully. Total vectors in index: {index.ntotal}")
-
-# --- 5. Save the Index ---
-print(f"💾 Saving FAISS index to: {FAISS_INDEX_FILE}")
-faiss.write_index(index, FAISS_INDEX_FILE)
-print("🎉 FAISS index build complete!")
+FAISS_INDEX_TYPE = "HNSW{hnsw_m}"
+# Compressed item storage presets for --quantize (graph stays HNSW, vectors are SQ8 / PQ codes).
+# app.py re-ranks with the float32 item table from the serving bundle, so only candidate recall is affected.
+ITEM_QUANTIZATION_PRESETS = {
+    "none": "HNSW{hnsw_m}",
+    "sq8": "HNSW{hnsw_m},SQ8",
+    "pq": "HNSW{hnsw_m},PQ{pq_m}",
+}
+INDEX_PARAMS = {
+    "hnsw_m": 32,
+    "ef_construction": 40,  # HNSW build-time beam width (higher = better graph, slower build)
+    "ef_search": 128,       # HNSW query-time beam width (>= N_CANDIDATES in ranking.py)
+    "nlist": 0,             # IVF lists; 0 = 4 * sqrt(num_products)
+    "nprobe": 16,           # IVF lists visited per query
+    "pq_m": 16,             # PQ sub-quantizers (must divide the embedding dim)
+    "pq_nbits": 8,          # Bits per PQ code
+}
+
+# --- Benchmark Configuration ---
+BENCHMARK_INDEX_TYPES = [
+    "HNSW{hnsw_m}",
+    "HNSW{hnsw_m},SQ8",
+    "HNSW{hnsw_m},PQ{pq_m}",
+    "IVF{nlist},Flat",
+    "IVF{nlist},PQ{pq_m}x{pq_nbits}",
+    "IVF{nlist},SQ8",
+]
+BENCHMARK_K = 100               # Same as N_CANDIDATES in ranking.py
+BENCHMARK_NUM_QUERIES = 2000
+BENCHMARK_SINGLE_QUERIES = 500  # Timed one at a time for p50/p99
+# ---------------------------------------------------------------------
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build (or benchmark) the FAISS item index.")
+    parser.add_argument("--index", default=FAISS_INDEX_TYPE, help="faiss.index_factory string, e.g. 'IVF{nlist},PQ{pq_m}'")
+    parser.add_argument("--quantize", choices=sorted(ITEM_QUANTIZATION_PRESETS), default=None,
+                        help="Shortcut for --index: HNSW with flat, SQ8 or PQ vector storage.")
+    parser.add_argument("--hnsw-m", type=int, default=INDEX_PARAMS["hnsw_m"])
+    parser.add_argument("--ef-construction", type=int, default=INDEX_PARAMS["ef_construction"])
+    parser.add_argument("--ef-search", type=int, default=INDEX_PARAMS["ef_search"])
+    parser.add_argument("--nlist", type=int, default=INDEX_PARAMS["nlist"])
+    parser.add_argument("--nprobe", type=int, default=INDEX_PARAMS["nprobe"])
+    parser.add_argument("--pq-m", type=int, default=INDEX_PARAMS["pq_m"])
+    parser.add_argument("--pq-nbits", type=int, default=INDEX_PARAMS["pq_nbits"])
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Build every BENCHMARK_INDEX_TYPES entry (plus --index) and write a recall/latency report instead of saving an index.")
+    parser.add_argument("--benchmark-index", action="append", default=None,
+                        help="Override BENCHMARK_INDEX_TYPES (repeatable).")
+    args = parser.parse_args()
+    if args.quantize:
+        args.index = ITEM_QUANTIZATION_PRESETS[args.quantize]
+    params = {
+        "hnsw_m": args.hnsw_m,
+        "ef_construction": args.ef_construction,
+        "ef_search": args.ef_search,
+        "nlist": args.nlist,
+        "nprobe": args.nprobe,
+        "pq_m": args.pq_m,
+        "pq_nbits": args.pq_nbits,
+    }
+    return args, params
+
+
+def load_embeddings():
+    # --- 1. Load Pre-computed Product Embeddings ---
+    try:
+        print(f"📦 Loading product embeddings from: {EMBEDDINGS_PATH}")
+        product_embeddings = np.load(EMBEDDINGS_PATH)
+        # Ensure embeddings are in float32 format, required by FAISS
+        product_embeddings = np.ascontiguousarray(product_embeddings, dtype='float32')
+        num_products, embed_dim = product_embeddings.shape
+        print(f"✅ Loaded {num_products} product embeddings with dimension {embed_dim}.")
+    except FileNotFoundError:
+        print(f"❌ Error: Embeddings file not found at '{EMBEDDINGS_PATH}'.")
+        print("➡ Please run 'triple2vec_train.py' first to generate embeddings.")
+        exit()
+    except Exception as e:
+        print(f"❌ Error loading embeddings: {e}")
+        exit()
+
+    # --- 2. Load Product-to-Index Mapping (Optional but recommended for verification) ---
+    try:
+        with open(PROD2IDX_PATH, 'r') as f:
+            prod2idx = json.load(f)
+        print(f"✅ Loaded product-to-index mapping from: {PROD2IDX_PATH}")
+        # Sanity check: Ensure mapping size matches embedding count
+        if len(prod2idx) != num_products:
+            print(f"⚠️ Warning: Number of products in mapping ({len(prod2idx)}) does not match embeddings count ({num_products}).")
+    except FileNotFoundError:
+        print(f"⚠️ Warning: Product-to-index mapping file not found at '{PROD2IDX_PATH}'. Index will be built, but mapping verification skipped.")
+    except Exception as e:
+        print(f"⚠️ Warning: Error loading product mapping: {e}")
+
+    # --- 3. Normalize Embeddings for Cosine Similarity ---
+    # Normalizing ensures that Inner Product search is equivalent to Cosine Similarity
+    print("📏 Normalizing embeddings (L2 normalization)...")
+    faiss.normalize_L2(product_embeddings)
+    print("✅ Embeddings normalized.")
+    return product_embeddings
+
+
+def resolve_params(params, num_products):
+    params = dict(params)
+    if params["nlist"] <= 0:
+        params["nlist"] = max(1, int(4 * np.sqrt(num_products)))
+    return params
+
+
+def build_index(embeddings, index_type, params):
+    """Builds, trains (if needed), fills and tunes one index. Returns (index, factory_string, build_seconds)."""
+    num_products, embed_dim = embeddings.shape
+    factory_string = index_type.format(**params)
+    started = time.time()
+
+    index = faiss.index_factory(embed_dim, factory_string, FAISS_METRIC)
+
+    # Build-time HNSW parameter has to be set before vectors are added
+    ivf = faiss.try_extract_index_ivf(index) if "IVF" in factory_string else None
+    base = faiss.downcast_index(ivf.quantizer if ivf is not None else index)
+    if hasattr(base, "hnsw"):
+        base.hnsw.efConstruction = params["ef_construction"]
+
+    # IVF / PQ / SQ indexes need training; HNSWFlat does not
+    if not index.is_trained:
+        print(f"   Training {factory_string} on {num_products} vectors...")
+        index.train(embeddings)
+
+    index.add(embeddings)
+    set_search_params(index, factory_string, params)
+    return index, factory_string, time.time() - started
+
+
+def set_search_params(index, factory_string, params):
+    """Query-time knobs. Both are stored in the written index, so app.py picks them up."""
+    space = faiss.ParameterSpace()
+    if "HNSW" in factory_string:
+        space.set_index_parameter(index, "efSearch", params["ef_search"])
+    if "IVF" in factory_string:
+        space.set_index_parameter(index, "nprobe", params["nprobe"])
+
+
+def index_size_bytes(index):
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def load_benchmark_queries(embeddings):
+    """User vectors from the serving bundle when present (real query distribution), else perturbed items."""
+    rng = np.random.default_rng(0)
+    if os.path.exists(USER_EMBEDDINGS_PATH):
+        users = np.load(USER_EMBEDDINGS_PATH, mmap_mode='r')
+        rows = np.sort(rng.choice(users.shape[0], size=min(BENCHMARK_NUM_QUERIES, users.shape[0]), replace=False))
+        queries = np.ascontiguousarray(users[rows], dtype='float32')
+        print(f"🎯 Using {len(queries)} user vectors from {USER_EMBEDDINGS_PATH} as benchmark queries.")
+    else:
+        rows = rng.choice(embeddings.shape[0], size=min(BENCHMARK_NUM_QUERIES, embeddings.shape[0]), replace=False)
+        noise = rng.normal(scale=0.1, size=(len(rows), embeddings.shape[1])).astype('float32')
+        queries = np.ascontiguousarray(embeddings[rows] + noise)
+        print(f"🎯 No user embeddings found. Using {len(queries)} perturbed item vectors as benchmark queries.")
+    faiss.normalize_L2(queries)
+    return queries
+
+
+def recall_at_k(found, truth):
+    k = truth.shape[1]
+    hits = sum(len(np.intersect1d(f[f >= 0], t, assume_unique=True)) for f, t in zip(found, truth))
+    return hits / (k * len(truth))
+
+
+def benchmark_index(index, queries, truth, k):
+    # Single-query latency (the /recommend path)
+    latencies = []
+    for row in range(min(BENCHMARK_SINGLE_QUERIES, len(queries))):
+        started = time.perf_counter()
+        index.search(queries[row:row + 1], k)
+        latencies.append((time.perf_counter() - started) * 1000.0)
+
+    # Batched latency (the /recommend/batch and top-K precompute path)
+    started = time.perf_counter()
+    _, found = index.search(queries, k)
+    batch_seconds = time.perf_counter() - started
+
+    return {
+        f"recall@{k}": round(recall_at_k(found, truth), 4),
+        "single_p50_ms": round(float(np.percentile(latencies, 50)), 4),
+        "single_p99_ms": round(float(np.percentile(latencies, 99)), 4),
+        "batch_total_ms": round(batch_seconds * 1000.0, 2),
+        "batch_qps": round(len(queries) / batch_seconds, 1),
+    }
+
+
+def run_benchmark(embeddings, index_types, params):
+    k = min(BENCHMARK_K, embeddings.shape[0])
+    queries = load_benchmark_queries(embeddings)
+
+    # Exact ground truth
+    print(f"📐 Computing exact top-{k} ground truth with IndexFlatIP...")
+    exact = faiss.IndexFlatIP(embeddings.shape[1])
+    exact.add(embeddings)
+    _, truth = exact.search(queries, k)
+
+    results = [dict(index="Flat (exact)", build_seconds=0.0, size_bytes=index_size_bytes(exact), **benchmark_index(exact, queries, truth, k))]
+    for index_type in index_types:
+        try:
+            print(f"🛠️ Building {index_type.format(**params)}...")
+            index, factory_string, build_seconds = build_index(embeddings, index_type, params)
+        except Exception as e:
+            print(f"⚠️ Skipping {index_type}: {e}")
+            continue
+        row = {"index": factory_string, "build_seconds": round(build_seconds, 2), "size_bytes": index_size_bytes(index)}
+        row.update(benchmark_index(index, queries, truth, k))
+        results.append(row)
+
+    # --- Report ---
+    recall_key = f"recall@{k}"
+    print(f"\n{'index':<28}{recall_key:>12}{'p50 ms':>10}{'p99 ms':>10}{'batch QPS':>12}{'size MB':>10}{'build s':>9}")
+    for row in results:
+        print(f"{row['index']:<28}{row[recall_key]:>12.4f}{row['single_p50_ms']:>10.3f}{row['single_p99_ms']:>10.3f}"
+              f"{row['batch_qps']:>12,.0f}{row['size_bytes'] / 1e6:>10.1f}{row['build_seconds']:>9.1f}")
+
+    report = {
+        "num_products": int(embeddings.shape[0]),
+        "embedding_dim": int(embeddings.shape[1]),
+        "num_queries": int(len(queries)),
+        "k": k,
+        "params": params,
+        "faiss_omp_threads": faiss.omp_get_max_threads(),
+        "results": results,
+    }
+    with open(BENCHMARK_REPORT_FILE, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Benchmark report saved to: {BENCHMARK_REPORT_FILE}")
+
+
+def main():
+    args, params = parse_args()
+
+    # Create output directory if it doesn't exist
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    print("🚀 Starting FAISS index build process...")
+    product_embeddings = load_embeddings()
+    params = resolve_params(params, product_embeddings.shape[0])
+
+    if args.benchmark:
+        index_types = args.benchmark_index or BENCHMARK_INDEX_TYPES
+        if args.index not in index_types:
+            index_types = [args.index] + list(index_types)
+        run_benchmark(product_embeddings, index_types, params)
+        return
+
+    # --- 4. Build the FAISS Index ---
+    print(f"🛠️ Building FAISS index ({args.index.format(**params)}, Metric: {FAISS_METRIC})...")
+    index, factory_string, build_seconds = build_index(product_embeddings, args.index, params)
+    print(f"✅ Index built in {build_seconds:.1f}s. Total vectors in index: {index.ntotal}")
+
+    # --- 5. Save the Index ---
+    print(f"💾 Saving FAISS index to: {FAISS_INDEX_FILE}")
+    faiss.write_index(index, FAISS_INDEX_FILE)
+    print("🎉 FAISS index build complete!")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,118 @@
 # compute_health_factor.py
-import pandas as pd
+# Column-wise health factors shared by every pipeline script (do_all.py, map_products_to_nutrition.py,
+# enrich_script.py, ...). Nutrients come in as whole columns - NumPy arrays, pandas Series or Arrow
+# arrays of per-100g values - and one call scores the full table:
+#
+#   scores = score_columns({"proteins_100g": p, "fat_100g": f, "carbohydrates_100g": c})
+#   df["health_factor"] = score_frame(df)                    # flat nutrient columns
+#   df["health_factor"] = score_nutrient_dicts(df["nutrients"])  # column of dicts / JSON strings
+#
+# Scores are float64 in [0, 1], rounded to DECIMALS, NaN for rows without nutrient data. Missing
+# individual nutrients count as 0 g (same as the per-row formulas this replaced).
+# Profiles are pluggable: register_profile(name, columns) registers a function that receives
+# {column: float64 array} and returns raw scores; see "macro_balance" and "additive" below.
+import json
+
 import numpy as np
+import pandas as pd
 
 # Define ideal per-100g macros (this is example; adjust to WHO/custom profile)
-ideal = {"protein":10.0,"fat":10.0,"carbs":30.0}  # grams per 100g, example
-
-def compute_hf(nutriments):
-    # nutriments: dict from OpenFoodFacts, might contain 'proteins_100g','fat_100g','carbohydrates_100g'
-    p = nutriments.get('proteins_100g') or 0.0
-    f = nutriments.get('fat_100g') or 0.0
-    c = nutriments.get('carbohydrates_100g') or 0.0
-    # normalized deviation (L2)
-    dev = np.sqrt((p-ideal['protein'])**2 + (f-ideal['fat'])**2 + (c-ideal['carbs'])**2)
-    # convert to score in [0,1] where smaller dev => higher HF
+ideal = {"protein": 10.0, "fat": 10.0, "carbs": 30.0}  # grams per 100g, example
+
+DEFAULT_PROFILE = "macro_balance"  # What the healthFactorScore column is built from
+DECIMALS = 3
+
+PROFILES = {}
+
+
+def register_profile(name, columns):
+    """Decorator: adds a scoring function over the given nutrient columns to PROFILES."""
+    def register(fn):
+        PROFILES[name] = (tuple(columns), fn)
+        return fn
+    return register
+
+
+@register_profile("macro_balance", ["proteins_100g", "fat_100g", "carbohydrates_100g"])
+def macro_balance(n):
+    # normalized deviation (L2) from the ideal macros; smaller dev => higher HF
+    dev = np.sqrt((n["proteins_100g"] - ideal["protein"]) ** 2
+                  + (n["fat_100g"] - ideal["fat"]) ** 2
+                  + (n["carbohydrates_100g"] - ideal["carbs"]) ** 2)
     max_dev = 100.0
-    hf = max(0.0, 1.0 - dev / max_dev)
-    return hf
\ No newline at end of file
+    return np.maximum(0.0, 1.0 - dev / max_dev)
+
+
+@register_profile("additive", ["proteins_100g", "fiber_100g", "sugars_100g", "saturated_fat_100g", "salt_100g"])
+def additive(n):
+    # Higher protein & fiber = better; high sugar, salt and saturated fat = worse (scaled to [0, 1])
+    score = ((n["proteins_100g"] * 2 + n["fiber_100g"] * 1.5)
+             - (n["sugars_100g"] * 1.2 + n["saturated_fat_100g"] * 1.0 + n["salt_100g"] * 1.3))
+    return np.clip(50 + score, 0, 100) / 100.0
+
+
+def _as_float(column):
+    """NumPy / pandas / Arrow column -> float64 ndarray (nulls and unparsable values -> NaN)."""
+    try:
+        return np.asarray(column, dtype=np.float64)
+    except (TypeError, ValueError):
+        return pd.to_numeric(pd.Series(column), errors='coerce').to_numpy(dtype=np.float64)
+
+
+def score_columns(columns, profile=DEFAULT_PROFILE, present=None, length=None):
+    """
+    columns: {nutrient column: array-like}; columns the profile needs but that are absent count as 0.
+    present: optional bool mask of rows that have nutrient data at all (others score NaN).
+    length:  row count, only needed when `columns` is empty and `present` is not given.
+    """
+    needed, fn = PROFILES[profile]
+    if length is None:
+        length = len(present) if present is not None else len(next(iter(columns.values())))
+    values = {}
+    for name in needed:
+        values[name] = np.nan_to_num(_as_float(columns[name]), nan=0.0) if name in columns else np.zeros(length)
+    scores = np.round(fn(values), DECIMALS)
+    if present is not None:
+        scores = np.where(np.asarray(present, dtype=bool), scores, np.nan)
+    return scores
+
+
+def score_frame(df, profile=DEFAULT_PROFILE, present=None):
+    """Scores a DataFrame with flat nutrient columns (e.g. the OFF Parquet cache)."""
+    needed, _ = PROFILES[profile]
+    return score_columns({name: df[name] for name in needed if name in df.columns}, profile, present, len(df))
+
+
+def parse_nutrients(value):
+    """dict / JSON string -> dict; anything else -> None."""
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, str):
+        try:
+            parsed = json.loads(value)
+        except (json.JSONDecodeError, TypeError):
+            return None
+        return parsed if isinstance(parsed, dict) else None
+    return None
+
+
+def score_nutrient_dicts(nutrients, profile=DEFAULT_PROFILE):
+    """
+    Scores a column of nutrient dicts (or JSON strings, as stored in the nutriments column).
+    Rows that are empty / unparsable score NaN. The dicts are unpacked once per needed nutrient,
+    then scored column-wise.
+    """
+    needed, _ = PROFILES[profile]
+    parsed = [parse_nutrients(value) for value in nutrients]
+    present = np.fromiter((bool(d) for d in parsed), dtype=bool, count=len(parsed))
+    columns = {}
+    for name in needed:
+        columns[name] = pd.to_numeric(pd.Series([d.get(name) if d else None for d in parsed], dtype=object),
+                                      errors='coerce').to_numpy(dtype=np.float64)
+    return score_columns(columns, profile, present)
+
+
+def compute_hf(nutriments, profile=DEFAULT_PROFILE):
+    # Single-product score (nutriments: dict from OpenFoodFacts); None when there is no data
+    score = score_nutrient_dicts([nutriments], profile)[0]
+    return None if np.isnan(score) else float(score)
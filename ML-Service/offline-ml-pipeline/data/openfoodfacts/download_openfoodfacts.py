@@ -66,28 +66,160 @@
 #     print("\n⚠️ Test complete. No data remained after filtering the first 1000 rows.")
 #     print("   This is OK, try increasing 'nrows' to 5000 or 10000 if you see this.")
 
+import argparse
+import io
 import requests
 import gzip
 import shutil
 import os
+import sys
+import time
+import pyarrow as pa
+import urllib3
 from tqdm import tqdm
 
+# off_cache.py lives in the pipeline root (run this script from there, like the others)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from off_cache import OFF_PARQUET_DIR, write_cache
+
 # --- Configuration ---
 URL = "https://static.openfoodfacts.org/data/en.openfoodfacts.org.products.tsv.gz"
 DOWNLOAD_DIR = "data/openfoodfacts"
 COMPRESSED_FILE = os.path.join(DOWNLOAD_DIR, "en.openfoodfacts.org.products.tsv.gz")
 UNCOMPRESSED_FILE = os.path.join(DOWNLOAD_DIR, "en.openfoodfacts.org.products.csv") # Save as .csv to match your next script
+CHUNK_BYTES = 8 << 20        # HTTP read size (the old 1 KB chunks cost one Python call per KB)
+STREAM_BUFFER_BYTES = 16 << 20  # Buffer between the decompressor and the TSV parser
+MAX_RETRIES = 5              # Reconnects (Range requests) before giving up
+RETRY_BACKOFF_SECONDS = 2    # First reconnect delay; doubles per consecutive failure (max 30 s)
+TIMEOUT = (10, 60)           # (connect, read) seconds
 # ---------------------
 
-def download_file():
+
+class SourceChangedError(RuntimeError):
+    pass
+
+
+# A dropped connection surfaces from resp.raw.read() as urllib3's ProtocolError / ReadTimeoutError,
+# which are neither requests exceptions nor OSErrors
+CONNECTION_ERRORS = (requests.exceptions.RequestException, urllib3.exceptions.HTTPError, OSError)
+
+
+class ResumableHTTPStream(io.RawIOBase):
+    """
+    Read-only file object over an HTTP body. When the connection drops it reconnects with
+    'Range: bytes=<offset>-' (guarded by If-Range on the ETag / Last-Modified of the first
+    response) and carries on from the same byte, so the consumer never notices.
+    Servers that ignore Range (plain 200) are handled by skipping the bytes already read.
+    """
+
+    def __init__(self, url, max_retries=MAX_RETRIES, progress=None, backoff=RETRY_BACKOFF_SECONDS):
+        self.url = url
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.progress = progress
+        self.offset = 0
+        self.validator = None
+        self.session = requests.Session()
+        self._resp = self._request()
+        self.total = int(self._resp.headers.get('content-length', 0)) or None
+        etag = self._resp.headers.get('ETag')
+        # Weak ETags are not allowed in If-Range
+        self.validator = etag if etag and not etag.startswith('W/') else self._resp.headers.get('Last-Modified')
+        self.source_info = {"url": url, "etag": etag, "last_modified": self._resp.headers.get('Last-Modified'),
+                            "size": self.total}
+
+    def _request(self):
+        headers = {}
+        if self.offset:
+            headers["Range"] = f"bytes={self.offset}-"
+            if self.validator:
+                headers["If-Range"] = self.validator
+        resp = self.session.get(self.url, headers=headers, stream=True, timeout=TIMEOUT)
+        resp.raise_for_status()
+        if self.offset and resp.status_code != 206:
+            # Full body again: fine if it is the same file, fatal if it changed mid-download
+            if self.validator and self.validator not in (resp.headers.get('ETag'), resp.headers.get('Last-Modified')):
+                resp.close()
+                raise SourceChangedError(f"{self.url} changed during the download; start again.")
+            skip = self.offset
+            while skip:
+                skipped = len(resp.raw.read(min(skip, CHUNK_BYTES)))
+                if not skipped:
+                    raise IOError(f"body ended before byte {self.offset} while resuming")
+                skip -= skipped
+        return resp
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        failures = 0
+        while True:
+            try:
+                if self._resp is None:
+                    self._resp = self._request()
+                data = self._resp.raw.read(min(len(buffer), CHUNK_BYTES))
+                if not data and self.total is not None and self.offset < self.total:
+                    raise IOError("connection closed early")
+            except CONNECTION_ERRORS as e:
+                failures += 1
+                if failures > self.max_retries:
+                    raise IOError(f"Download failed after {self.max_retries} reconnects at byte {self.offset:,}: {e}")
+                print(f"\n⚠️ Connection lost at byte {self.offset:,} ({e}); resuming "
+                      f"(attempt {failures}/{self.max_retries})...")
+                if self._resp is not None:
+                    self._resp.close()
+                    self._resp = None
+                time.sleep(min(self.backoff * 2 ** (failures - 1), 30))
+                continue
+            size = len(data)
+            buffer[:size] = data
+            self.offset += size
+            if self.progress is not None:
+                self.progress.update(size)
+            return size
+
+    def close(self):
+        if self._resp is not None:
+            self._resp.close()
+        self.session.close()
+        super().close()
+
+
+def stream_to_parquet(url=URL, out_dir=OFF_PARQUET_DIR):
+    """
+    HTTP body -> gzip decompression -> chunked TSV parsing -> Parquet row groups, in one pass.
+    Neither the .gz nor the uncompressed dump touches the disk. The new cache is built next to the
+    old one and swapped in only when complete.
+    """
+    staging_dir = out_dir.rstrip("/") + ".partial"
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+    print(f"📦 Streaming {url} into the Parquet cache...")
+    with tqdm(desc="Downloading", unit='iB', unit_scale=True, unit_divisor=1024) as bar:
+        http = ResumableHTTPStream(url, progress=bar)
+        bar.total = http.total
+        try:
+            tsv = pa.input_stream(http, compression='gzip', buffer_size=STREAM_BUFFER_BYTES)
+            rows = write_cache(tsv, staging_dir, http.source_info)
+        finally:
+            http.close()
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(staging_dir, out_dir)
+    print(f"✅ Wrote {rows:,} OpenFoodFacts products to {out_dir}")
+    return rows
+
+
+def download_file(url=URL):
     """Downloads the large file with a progress bar."""
-    print(f"📦 Starting download from {URL}...")
+    print(f"📦 Starting download from {url}...")
     try:
         # Create the directory if it doesn't exist
         os.makedirs(DOWNLOAD_DIR, exist_ok=True)
         
         # Use streaming download for large files
-        resp = requests.get(URL, stream=True, allow_redirects=True)
+        resp = requests.get(url, stream=True, allow_redirects=True)
         resp.raise_for_status() # Check for HTTP errors
         
         total_size = int(resp.headers.get('content-length', 0))
@@ -99,7 +231,7 @@ def download_file():
             unit_scale=True,
             unit_divisor=1024,
         ) as bar:
-            for chunk in resp.iter_content(chunk_size=1024):
+            for chunk in resp.iter_content(chunk_size=CHUNK_BYTES):
                 size = f.write(chunk)
                 bar.update(size)
                 
@@ -116,7 +248,7 @@ def decompress_file():
     try:
         with gzip.open(COMPRESSED_FILE, 'rb') as f_in:
             with open(UNCOMPRESSED_FILE, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
+                shutil.copyfileobj(f_in, f_out, CHUNK_BYTES)
         print(f"✅ Unzip complete. File saved to {UNCOMPRESSED_FILE}")
         
         # Clean up the compressed file
@@ -126,7 +258,22 @@ def decompress_file():
     except Exception as e:
         print(f"❌ Error unzipping file: {e}")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Download the OpenFoodFacts TSV dump.")
+    parser.add_argument("--stream", action="store_true",
+                        help="Build the Parquet cache straight from the HTTP stream (no .gz / .csv on disk)")
+    parser.add_argument("--url", default=URL)
+    parser.add_argument("--out", default=OFF_PARQUET_DIR, help="Parquet cache directory for --stream")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    if download_file():
+    args = parse_args()
+    if args.stream:
+        try:
+            stream_to_parquet(args.url, args.out)
+        except CONNECTION_ERRORS + (SourceChangedError,) as e:
+            print(f"❌ Error streaming OpenFoodFacts: {e}")
+            exit()
+    elif download_file(args.url):
         decompress_file()
-    print("🎉 All done. The data is ready for processing.")
\ No newline at end of file
+    print("🎉 All done. The data is ready for processing.")
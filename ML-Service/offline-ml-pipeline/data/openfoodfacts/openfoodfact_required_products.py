@@ -1,27 +1,30 @@
+import os
+import sys
 import pandas as pd
 
+# off_cache.py lives in the pipeline root (run this script from there, like the others)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from off_cache import read_off
+
 # Paths
 instacart_path = "data/instacart_product_nutrition.parquet"
-off_full_path = "data/openfoodfacts_full.csv"  # Your full OFF CSV (if available)
-filtered_off_path = "data/openfoodfacts_filtered.csv"
+filtered_off_path = "data/openfoodfacts_filtered/openfoodfacts_filtered.parquet"
 
 # Load Instacart mapped data
 instacart_df = pd.read_parquet(instacart_path)
 needed_codes = instacart_df['matched_off_code'].astype(str).unique()
 print(f"ℹ️ Total unique OFF codes needed: {len(needed_codes)}")
 
-# Filter OFF dataset in chunks
-chunk_size = 500_000
-filtered_chunks = []
-
-for chunk in pd.read_csv(off_full_path, chunksize=chunk_size, dtype={'code': str}):
-    filtered = chunk[chunk['code'].isin(needed_codes)]
-    if not filtered.empty:
-        filtered_chunks.append(filtered)
+# Filter OFF in the Parquet scan instead of re-reading the full dump in chunks
+try:
+    off_filtered = read_off(codes=needed_codes)
+except FileNotFoundError as e:
+    print(f"❌ Error: {e}")
+    exit()
 
-if filtered_chunks:
-    off_filtered = pd.concat(filtered_chunks, ignore_index=True)
-    off_filtered.to_csv(filtered_off_path, index=False)
+if not off_filtered.empty:
+    os.makedirs(os.path.dirname(filtered_off_path), exist_ok=True)
+    off_filtered.to_parquet(filtered_off_path, index=False)
     print(f"✅ Filtered OFF dataset saved: {len(off_filtered)} products")
 else:
-    print("⚠️ No matching OFF products found in the dataset.")
\ No newline at end of file
+    print("⚠️ No matching OFF products found in the dataset.")
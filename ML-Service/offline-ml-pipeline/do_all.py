@@ -1,13 +1,14 @@
 import pandas as pd
-import numpy as np
 import os
-from tqdm import tqdm
-from rapidfuzz import process, fuzz
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from compute_health_factor import score_nutrient_dicts
+from fuzzy_matcher import BlockedFuzzyMatcher, PREFIX_LEN
+from off_cache import read_off, initials_of, snapshot_version
+from match_store import MatchStore
 
 # ---------------- CONFIG ---------------- #
 INSTACART_PRODUCTS_FILE = "data/kaggle/products.csv"
-OPENFOODFACTS_FILE = "data/openfoodfacts/en.openfoodfacts.org.products.csv"
+# Full catalog despite the "_10k": the name is kept because model directories and ingest_products.py
+# look for it (see artifacts.NUTRITION_FILE)
 OUTPUT_PARQUET_FILE = "data/products_with_nutrition_and_health_10k.parquet"
 
 KEEP_COLS = [
@@ -17,118 +18,96 @@ KEEP_COLS = [
 ]
 
 MATCH_THRESHOLD = 85
-IDEAL_NUTRIENTS = {"protein": 10.0, "fat": 10.0, "carbs": 30.0}
-CHUNK_SIZE = 500_000  # adjust for memory
-MAX_INSTACART = 10_000  # first 10k products
-NUM_THREADS = 4  # adjust based on your CPU
+HEALTH_PROFILE = "macro_balance"  # see compute_health_factor.PROFILES
+MAX_INSTACART = None  # None = full catalog (must cover MAX_PRODUCTS in triple2vec_train.py)
+NUM_WORKERS = os.cpu_count()  # matcher processes; adjust based on your CPU
+NUTRIENT_COLS = ["proteins_100g", "fat_100g", "carbohydrates_100g", "sugars_100g", "fiber_100g", "salt_100g"]
+# Stored matches are reused while the OFF snapshot and these settings are unchanged
+MATCHER_NAME = "blocked_wratio"
+MATCHER_CONFIG = {"scorer": "WRatio", "threshold": MATCH_THRESHOLD, "prefix_len": PREFIX_LEN}
 # ---------------------------------------- #
 
-def compute_health_factor(nutrients: dict):
-    if not nutrients:
-        return None
-    try:
-        p = float(nutrients.get("proteins_100g") or 0)
-        f = float(nutrients.get("fat_100g") or 0)
-        c = float(nutrients.get("carbohydrates_100g") or 0)
-        deviation = np.sqrt((p - IDEAL_NUTRIENTS["protein"])**2 +
-                            (f - IDEAL_NUTRIENTS["fat"])**2 +
-                            (c - IDEAL_NUTRIENTS["carbs"])**2)
-        return round(max(0.0, 1.0 - deviation / 100.0), 3)
-    except (ValueError, TypeError):
-        return None
-
-def match_product(product_name, product_lower, off_groups):
-    if not product_lower:
-        return {
-            "instacart_product": product_name,
-            "matched_off_product": None,
-            "match_score": None,
-            "image_url": None,
-            "brands": None,
-            "nutrients": None,
-            "health_factor": None,
-            "off_code": None,
-            "countries_tags": None,
-        }
-
-    # First 2-letter filtering
-    prefix = product_lower[:2]
-    candidates_df = off_groups.get(prefix, pd.DataFrame(columns=KEEP_COLS + ["product_name_lower"]))
-    candidates_names = candidates_df["product_name_lower"].tolist()
-
-    # Exact match first
-    if product_lower in candidates_names:
-        idx = candidates_names.index(product_lower)
-        matched_row = candidates_df.iloc[idx]
-        score = 100
-    else:
-        # RapidFuzz matching
-        match_data = process.extractOne(product_lower, candidates_names, scorer=fuzz.WRatio)
-        if not match_data or match_data[1] < MATCH_THRESHOLD:
-            return {
-                "instacart_product": product_name,
-                "matched_off_product": None,
-                "match_score": None,
-                "image_url": None,
-                "brands": None,
-                "nutrients": None,
-                "health_factor": None,
-                "off_code": None,
-                "countries_tags": None,
-            }
-        _, score, idx = match_data
-        matched_row = candidates_df.iloc[idx]
-
-    nutrients = {col: matched_row[col] for col in ["proteins_100g","fat_100g","carbohydrates_100g",
-                                                   "sugars_100g","fiber_100g","salt_100g"]}
-    health_factor = compute_health_factor(nutrients)
+NO_MATCH = {"off_code": None, "matched_off_product": None, "match_score": None, "image_url": None,
+            "brands": None, "countries_tags": None, "nutrients": None}
 
+def match_record(off_df, row, score):
+    """What the match store keeps for one name: the matched OFF row's fields, or NO_MATCH."""
+    if row < 0:
+        return dict(NO_MATCH)
+    matched_row = off_df.iloc[row]
     return {
-        "instacart_product": product_name,
+        "off_code": matched_row["code"],
         "matched_off_product": matched_row["product_name"],
-        "match_score": round(score, 2),
+        "match_score": round(float(score), 2),
         "image_url": matched_row["image_url"],
         "brands": matched_row["brands"],
-        "nutrients": nutrients,
-        "health_factor": health_factor,
-        "off_code": matched_row["code"],
         "countries_tags": matched_row["countries_tags"],
+        "nutrients": {col: None if pd.isna(matched_row[col]) else float(matched_row[col]) for col in NUTRIENT_COLS},
     }
 
+def build_enriched_rows(instacart_df, records):
+    """One output record per Instacart product, from the match records keyed by lower-cased name."""
+    enriched_rows = []
+    for product_id, product_name, product_lower in zip(instacart_df["product_id"], instacart_df["product_name"],
+                                                       instacart_df["product_name_lower"]):
+        record = records.get(product_lower, NO_MATCH)
+        matched = record["matched_off_product"] is not None
+        enriched_rows.append({
+            "product_id": int(product_id),
+            "instacart_product": product_name,
+            "matched_off_product": record["matched_off_product"],
+            "match_score": record["match_score"],
+            "image_url": record["image_url"],
+            "brands": record["brands"],
+            "nutrients": record["nutrients"] if matched else None,
+            "off_code": record["off_code"],
+            "countries_tags": record["countries_tags"],
+        })
+    return enriched_rows
+
 def main():
     print("📊 Loading Instacart products...")
-    instacart_df = pd.read_csv(INSTACART_PRODUCTS_FILE).head(MAX_INSTACART)
+    instacart_df = pd.read_csv(INSTACART_PRODUCTS_FILE)
+    if MAX_INSTACART:
+        instacart_df = instacart_df.head(MAX_INSTACART)
     instacart_df["product_name_lower"] = instacart_df["product_name"].astype(str).str.lower().str.strip()
     print(f"✅ Loaded {len(instacart_df)} Instacart products")
 
-    # Prepare OFF groups with first 2 letters
-    off_groups = {}
-    print("📦 Processing OpenFoodFacts CSV in chunks...")
-    for chunk in tqdm(pd.read_csv(OPENFOODFACTS_FILE, sep='\t', usecols=KEEP_COLS, dtype=str,
-                                  low_memory=False, chunksize=CHUNK_SIZE, on_bad_lines='skip'),
-                      desc="Loading OFF"):
-        chunk = chunk.dropna(subset=["product_name"]).copy()
-        chunk["product_name_lower"] = chunk["product_name"].str.lower().str.strip()
-        chunk["prefix2"] = chunk["product_name_lower"].str[:2]
-        for prefix, df in chunk.groupby("prefix2"):
-            if prefix in off_groups:
-                off_groups[prefix] = pd.concat([off_groups[prefix], df], ignore_index=True)
-            else:
-                off_groups[prefix] = df.copy()
-
-    print(f"✅ Prepared {sum(len(df) for df in off_groups.values())} OFF products in groups")
-
-    enriched_rows = []
-    print("\n🔍 Matching and enriching products with parallelism...")
-
-    # Use ThreadPoolExecutor for parallel matching
-    with ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
-        futures = [executor.submit(match_product, pname, plower, off_groups)
-                   for pname, plower in zip(instacart_df["product_name"], instacart_df["product_name_lower"])]
-        for future in tqdm(as_completed(futures), total=len(futures), desc="Enriching"):
-            enriched_rows.append(future.result())
+    # Reuse stored matches for this OFF snapshot + matcher config; match only names not seen yet
+    try:
+        store = MatchStore(MATCHER_NAME, MATCHER_CONFIG, snapshot_version())
+    except FileNotFoundError as e:
+        print(f"❌ Error: {e}")
+        exit()
+    purged = store.purge_stale()
+    if purged:
+        print(f"🧹 Dropped {purged} stored matches from an older OFF snapshot or matcher config")
+    records = store.lookup()
+    new_names = [name for name in pd.unique(instacart_df["product_name_lower"]) if name not in records]
+    print(f"♻️ {len(records)} names already matched, {len(new_names)} new names to match")
+
+    if new_names:
+        # Only the needed columns, and only the name-initial partitions the new names can match in
+        print("📦 Loading OpenFoodFacts from the Parquet cache...")
+        off_df = read_off(columns=KEEP_COLS + ["product_name_lower"], initials=initials_of(new_names))
+
+        # Prefix blocks + exact-match hash index, built once
+        matcher = BlockedFuzzyMatcher(off_df["product_name_lower"], threshold=MATCH_THRESHOLD, workers=NUM_WORKERS)
+        print(f"✅ Prepared {len(matcher)} OFF products in {len(matcher.candidates_by_prefix)} prefix groups")
+
+        print(f"\n🔍 Matching {len(new_names)} products with {NUM_WORKERS} processes...")
+        rows, scores = matcher.match(new_names)
+        new_records = {name: match_record(off_df, row, score) for name, row, score in zip(new_names, rows, scores)}
+        store.save(new_records)
+        records.update(new_records)
+    store.close()
+
+    enriched_rows = build_enriched_rows(instacart_df, records)
 
     enriched_df = pd.DataFrame(enriched_rows)
+    # Scored column-wise over the whole table (NaN where there is no match)
+    enriched_df.insert(enriched_df.columns.get_loc("nutrients") + 1, "health_factor",
+                       score_nutrient_dicts(enriched_df["nutrients"], HEALTH_PROFILE))
     print(f"\n✅ Enriched {enriched_df['matched_off_product'].notna().sum()} / {len(enriched_df)} products successfully")
 
     os.makedirs(os.path.dirname(OUTPUT_PARQUET_FILE), exist_ok=True)
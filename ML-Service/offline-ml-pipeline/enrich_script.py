@@ -1,109 +1,154 @@
 # enrich_script_fast_debug.py
-import pandas as pd
-import numpy as np
-from compute_health_factor import compute_hf
-import json
+# Adds image_url and health_factor_score to the Instacart<->OFF mapped products.
+# The input is streamed one Parquet record batch at a time and every step runs on Arrow compute
+# kernels: the OFF join is an index_in lookup, missing image URLs are built from the barcode with
+# vectorized string ops, and the nutriments JSON of a whole batch is parsed in one pyarrow.json call.
+# Memory stays bounded by BATCH_ROWS (plus the code -> image_url table of the matched OFF products).
+import io
 import os
-from tqdm import tqdm
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pa_json
+import pyarrow.parquet as pq
+
+from compute_health_factor import PROFILES, parse_nutrients, score_columns
+from off_cache import image_url_from_code, read_off_table
 
 # --- Configuration ---
 input_parquet_path = "data/instacart_product_nutrition.parquet"
-off_parquet_path = "data/openfoodfacts_filtered/openfoodfacts_filtered.parquet"
 output_parquet_path = "data/products_with_health_score_debug.parquet"
-
-print("🚀 Starting SmartCart ML data enrichment pipeline (debug version)...")
-
-# --- Load Instacart↔OFF mapped data ---
-instacart_df = pd.read_parquet(input_parquet_path)
-print(f"✅ Loaded Instacart↔OFF mapped data ({len(instacart_df)} rows).")
-
-# --- Load OFF data ---
-off_df = pd.read_parquet(off_parquet_path, columns=['code', 'images'])
-print(f"📦 Loaded OpenFoodFacts data ({len(off_df)} rows).")
-
-# --- Ensure types match for merge ---
-instacart_df['matched_off_code'] = instacart_df['matched_off_code'].astype(str)
-off_df['code'] = off_df['code'].astype(str)
-
-# --- Check overlap between datasets ---
-instacart_codes = set(instacart_df['matched_off_code'])
-off_codes = set(off_df['code'])
-intersection = instacart_codes.intersection(off_codes)
-
-print(f"🔍 Matching stats:")
-print(f"   • Instacart mapped codes: {len(instacart_codes)}")
-print(f"   • OFF available codes:    {len(off_codes)}")
-print(f"   • Overlapping codes:      {len(intersection)} "
-      f"({len(intersection)/len(instacart_codes)*100:.2f}%)\n")
-
-# --- Extract first image id ---
-def extract_imgid(images):
-    if isinstance(images, list) and len(images) > 0 and isinstance(images[0], dict):
-        return images[0].get('imgid')
-    return None
-
-off_df['imgid'] = off_df['images'].map(extract_imgid)
-
-# --- Build image URLs ---
-def build_image_url(code, imgid):
-    if pd.isna(imgid) or not isinstance(code, str):
-        return None
-    if len(code) > 8:
-        code_path = f"{code[:3]}/{code[3:6]}/{code[6:9]}/{code[9:]}"
-    else:
-        code_path = code
-    return f"https://images.openfoodfacts.org/images/products/{code_path}/{imgid}.400.jpg"
-
-off_df['image_url'] = [build_image_url(c, i) for c, i in zip(off_df['code'], off_df['imgid'])]
-
-# --- Simplify and remove duplicates ---
-off_df_simple = off_df[['code', 'image_url']].drop_duplicates(subset=['code'])
-
-# --- Merge with Instacart data ---
-print("🔗 Merging image URLs into main dataset...")
-merged_df = instacart_df.merge(
-    off_df_simple,
-    left_on='matched_off_code',
-    right_on='code',
-    how='left'
-).drop(columns=['code'])
-
-missing_images = merged_df['image_url'].isna().sum()
-print(f"⚠️ {missing_images:,} products have no image URL "
-      f"({missing_images/len(merged_df)*100:.2f}%).")
-
-# --- Parse nutriments and compute health factor ---
-def parse_nutriments(nut):
-    if isinstance(nut, dict):
-        return nut
+HEALTH_PROFILE = "macro_balance"  # see compute_health_factor.PROFILES
+BATCH_ROWS = 65_536               # Rows per record batch (and per output row group)
+# ---------------------
+
+NUTRIENT_SCHEMA = pa.schema([(name, pa.float64()) for name in PROFILES[HEALTH_PROFILE][0]])
+
+
+def load_off_images(codes):
+    """code / image_url table for the OFF products the mapping points at (filter pushed into the scan)."""
+    off = read_off_table(columns=['code', 'image_url'], codes=codes)
+    return off.column('code').combine_chunks(), off.column('image_url').combine_chunks()
+
+
+def attach_image_urls(codes, off_codes, off_images):
+    """OFF image_url for each code (first OFF row per code), else the URL built from the barcode."""
+    positions = pc.index_in(codes, value_set=off_codes)
+    found = pc.is_valid(positions)
+    image_url = pc.take(off_images, positions)
+    fallback = pc.if_else(found, image_url_from_code(codes), pa.scalar(None, pa.string()))
+    return pc.coalesce(image_url, fallback), found
+
+
+def _nutrients_from_rows(values):
+    # Per-row fallback for batches the bulk parser rejects (malformed JSON, numbers stored as text)
+    rows = [parse_nutrients(value) for value in values.to_pylist()]
+    columns = {name: pd.to_numeric(pd.Series([row.get(name) if row else None for row in rows], dtype=object),
+                                   errors='coerce').to_numpy(dtype='float64')
+               for name in NUTRIENT_SCHEMA.names}
+    return columns, pa.array([bool(row) for row in rows])
+
+
+def extract_nutrients(nutriments):
+    """
+    nutriments column (JSON strings, or structs when the Parquet stores them typed) -> ({nutrient: float64
+    array}, present mask). JSON is parsed for the whole batch at once as newline-delimited JSON.
+    """
+    if pa.types.is_struct(nutriments.type):
+        fields = {nutriments.type.field(i).name for i in range(nutriments.type.num_fields)}
+        columns = {name: pc.cast(pc.struct_field(nutriments, name), pa.float64())
+                   for name in NUTRIENT_SCHEMA.names if name in fields}
+        return columns, pc.is_valid(nutriments)
+
+    text = pc.utf8_trim_whitespace(pc.cast(nutriments, pa.string()))
+    present = pc.fill_null(pc.and_(pc.starts_with(text, "{"), pc.not_equal(text, "{}")), False)
+    lines = pc.if_else(present, pc.replace_substring(text, "\n", " "), "{}")
     try:
-        return json.loads(nut) if isinstance(nut, str) else None
-    except (json.JSONDecodeError, TypeError):
-        return None
-
-merged_df['nutriments_parsed'] = merged_df['nutriments'].map(parse_nutriments)
+        parsed = pa_json.read_json(
+            io.BytesIO("\n".join(lines.to_pylist()).encode()),
+            parse_options=pa_json.ParseOptions(explicit_schema=NUTRIENT_SCHEMA, unexpected_field_behavior="ignore"),
+        )
+    except pa.ArrowInvalid:
+        return _nutrients_from_rows(nutriments)
+    if parsed.num_rows != len(nutriments):
+        return _nutrients_from_rows(nutriments)
+    return {name: parsed.column(name).combine_chunks() for name in NUTRIENT_SCHEMA.names}, present
+
+
+def enrich_batch(batch, off_codes, off_images):
+    codes = pc.cast(batch.column('matched_off_code'), pa.string())
+    image_url, found = attach_image_urls(codes, off_codes, off_images)
+    nutrients, present = extract_nutrients(batch.column('nutriments'))
+    health = score_columns(nutrients, HEALTH_PROFILE, present.to_numpy(zero_copy_only=False), len(batch))
+
+    table = pa.Table.from_batches([batch])
+    table = table.set_column(table.schema.get_field_index('matched_off_code'), 'matched_off_code', codes)
+    table = table.append_column('image_url', image_url)
+    table = table.append_column('health_factor_score', pa.array(health, type=pa.float64()))
+    return table, found
+
+
+def main():
+    print("🚀 Starting SmartCart ML data enrichment pipeline (debug version)...")
+
+    # --- Only the code column up front: which OFF products to load ---
+    source = pq.ParquetFile(input_parquet_path)
+    mapped_codes = pc.unique(pc.cast(pq.read_table(input_parquet_path, columns=['matched_off_code'])
+                                     .column('matched_off_code'), pa.string()))
+    print(f"✅ Instacart↔OFF mapped data: {source.metadata.num_rows} rows, {len(mapped_codes)} distinct OFF codes.")
 
-def compute_hf_safe(nut_dict):
     try:
-        return compute_hf(nut_dict) if nut_dict is not None else np.nan
-    except Exception:
-        return np.nan
-
-tqdm.pandas(desc="⚙️ Computing health factor")
-merged_df['health_factor_score'] = merged_df['nutriments_parsed'].progress_apply(compute_hf_safe)
-merged_df.drop(columns=['nutriments_parsed'], inplace=True)
-
-# --- Save enriched data ---
-os.makedirs(os.path.dirname(output_parquet_path), exist_ok=True)
-merged_df.to_parquet(output_parquet_path, index=False)
-print(f"✅ Enriched data saved to '{output_parquet_path}'")
-
-# --- Sample output ---
-print("\n--- SAMPLE OUTPUT ---")
-print(merged_df[["product_name", "matched_off_code", "image_url", "health_factor_score"]].head(10))
-print("----------------------")
-
-# --- Extra debugging info ---
-unmatched_codes = merged_df.loc[merged_df['image_url'].isna(), 'matched_off_code'].unique()
-print(f"⚠️ Sample unmatched OFF codes: {unmatched_codes[:10]}")
-print(f"\n🏁 Pipeline completed successfully.")
\ No newline at end of file
+        off_codes, off_images = load_off_images(pc.drop_null(mapped_codes).to_numpy(zero_copy_only=False))
+    except FileNotFoundError as e:
+        print(f"❌ Error: {e}")
+        exit()
+    overlap = int(pc.sum(pc.is_in(mapped_codes, value_set=off_codes)).as_py() or 0)
+    print(f"📦 Loaded OpenFoodFacts data ({len(off_codes)} rows).")
+    print(f"🔍 Matching stats:")
+    print(f"   • Instacart mapped codes: {len(mapped_codes)}")
+    print(f"   • OFF available codes:    {len(pc.unique(off_codes))}")
+    print(f"   • Overlapping codes:      {overlap} "
+          f"({overlap / max(len(mapped_codes), 1) * 100:.2f}%)\n")
+
+    # --- Stream: enrich one record batch at a time, write it as a row group ---
+    print(f"🔗 Enriching in batches of {BATCH_ROWS:,} rows...")
+    os.makedirs(os.path.dirname(output_parquet_path), exist_ok=True)
+    rows = missing_images = 0
+    unmatched_sample = []
+    sample = None
+    writer = None
+    try:
+        for batch in source.iter_batches(batch_size=BATCH_ROWS):
+            table, found = enrich_batch(batch, off_codes, off_images)
+            if writer is None:
+                writer = pq.ParquetWriter(output_parquet_path, table.schema)
+                sample = table.slice(0, 10)
+            writer.write_table(table)
+
+            rows += table.num_rows
+            missing_images += table.column('image_url').null_count
+            if len(unmatched_sample) < 10:
+                unmatched = pc.unique(pc.filter(table.column('matched_off_code'), pc.invert(found)))
+                unmatched_sample.extend(unmatched.to_pylist()[:10 - len(unmatched_sample)])
+    finally:
+        if writer is not None:
+            writer.close()
+
+    print(f"⚠️ {missing_images:,} products have no image URL "
+          f"({missing_images / max(rows, 1) * 100:.2f}%).")
+    print(f"✅ Enriched data saved to '{output_parquet_path}'")
+
+    # --- Sample output ---
+    print("\n--- SAMPLE OUTPUT ---")
+    if sample is not None:
+        print(sample.select(["product_name", "matched_off_code", "image_url", "health_factor_score"]).to_pandas())
+    print("----------------------")
+
+    # --- Extra debugging info ---
+    print(f"⚠️ Sample unmatched OFF codes: {unmatched_sample}")
+    print(f"\n🏁 Pipeline completed successfully.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# fuzzy_matcher.py
+# Blocked name matcher used by do_all.py: Instacart product names -> OpenFoodFacts rows.
+#
+# Candidates are grouped by name prefix ONCE (one stable sort, one list per prefix), exact names
+# are answered from a hash index, and the rest are scored with rapidfuzz.process.cdist: each task is
+# one block of Instacart names against one prefix's candidate list. Blocks run in a
+# ProcessPoolExecutor whose workers receive the candidate lists once, at start-up.
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz, process
+from tqdm import tqdm
+
+PREFIX_LEN = 2            # Same 2-letter blocking as the original matcher
+BLOCK_CELLS = 8_000_000   # Max query x candidate scores per task (float32: 32 MB per task)
+
+# Set in each worker process by _init_worker
+_worker_candidates = None
+
+
+def _init_worker(candidates_by_prefix):
+    global _worker_candidates
+    _worker_candidates = candidates_by_prefix
+
+
+def _match_block(task):
+    """Best candidate (local position, score) for each query in one block; -1 below threshold."""
+    prefix, positions, queries, threshold = task
+    scores = process.cdist(queries, _worker_candidates[prefix], scorer=fuzz.WRatio,
+                           score_cutoff=threshold, dtype=np.float32, workers=1)
+    best = scores.argmax(axis=1) # first of equal scores wins, like extractOne
+    best_scores = scores[np.arange(len(queries)), best]
+    best[best_scores < threshold] = -1
+    return positions, best, best_scores
+
+
+class BlockedFuzzyMatcher:
+    """
+    match(queries) -> (rows, scores): for every (lower-cased) query the row in `candidate_names`
+    of its best WRatio match among candidates sharing its prefix, or -1 when nothing reaches
+    `threshold`. Exact matches short-circuit with score 100 (first occurrence wins).
+    """
+
+    def __init__(self, candidate_names, threshold=85, prefix_len=PREFIX_LEN, workers=None, block_cells=BLOCK_CELLS):
+        self.threshold = threshold
+        self.prefix_len = prefix_len
+        self.workers = workers
+        self.block_cells = block_cells
+
+        names = pd.Series(candidate_names, dtype=object).reset_index(drop=True)
+        # Hash index for exact matches
+        first = ~names.duplicated()
+        self.exact_index = dict(zip(names[first], names.index[first]))
+
+        # One stable sort by prefix: each prefix is a contiguous run, in original row order
+        prefixes = names.str[:prefix_len].to_numpy()
+        order = np.argsort(prefixes, kind='stable')
+        unique_prefixes, starts, counts = np.unique(prefixes[order], return_index=True, return_counts=True)
+        sorted_names = names.to_numpy()[order]
+        self.candidates_by_prefix = {}
+        self.rows_by_prefix = {}
+        for prefix, start, count in zip(unique_prefixes, starts, counts):
+            self.candidates_by_prefix[prefix] = sorted_names[start:start + count].tolist()
+            self.rows_by_prefix[prefix] = order[start:start + count]
+
+    def __len__(self):
+        return sum(len(rows) for rows in self.rows_by_prefix.values())
+
+    def _tasks(self, pending, queries):
+        for prefix, positions in pending.items():
+            block_rows = max(1, self.block_cells // len(self.candidates_by_prefix[prefix]))
+            for start in range(0, len(positions), block_rows):
+                block = positions[start:start + block_rows]
+                yield prefix, np.asarray(block), [queries[p] for p in block], self.threshold
+
+    def match(self, queries):
+        queries = list(queries)
+        rows = np.full(len(queries), -1, dtype='int64')
+        scores = np.full(len(queries), np.nan)
+
+        pending = defaultdict(list)
+        for position, query in enumerate(queries):
+            if not query:
+                continue
+            row = self.exact_index.get(query)
+            if row is not None:
+                rows[position], scores[position] = row, 100.0
+                continue
+            prefix = query[:self.prefix_len]
+            if prefix in self.candidates_by_prefix:
+                pending[prefix].append(position)
+        print(f"   • {int((rows >= 0).sum())} exact matches, {sum(map(len, pending.values()))} names left for fuzzy matching")
+
+        tasks = list(self._tasks(pending, queries))
+        if not tasks:
+            return rows, scores
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.candidates_by_prefix,)) as executor:
+            prefixes = [task[0] for task in tasks]
+            for prefix, (positions, best, best_scores) in tqdm(
+                    zip(prefixes, executor.map(_match_block, tasks)), total=len(tasks), desc="Fuzzy blocks"):
+                found = best >= 0
+                rows[positions[found]] = self.rows_by_prefix[prefix][best[found]]
+                scores[positions[found]] = best_scores[found]
+        return rows, scores
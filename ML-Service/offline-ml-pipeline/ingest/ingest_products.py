@@ -38,20 +38,25 @@ except Exception as e:
     exit()
 
 # --- 3. PATCH THE DATA (JOIN TO GET MISSING product_id) ---
-print("🔧 Patching data: Joining enriched file with original file to get product_id...")
-
-# Prepare the original data: we only need 'product_id' and 'product_name'
-df_original_products = df_original_products[['product_id', 'product_name']]
-
-# Join the two dataframes
-# We join your enriched file's 'instacart_product' column
-# with the original file's 'product_name' column.
-df_patched = df_enriched.merge(
-    df_original_products,
-    left_on='instacart_product',
-    right_on='product_name',
-    how='left'
-)
+if 'product_id' in df_enriched.columns:
+    # Newer do_all.py outputs already carry the Instacart product_id
+    print("✅ Enriched file already has 'product_id'. Skipping name join.")
+    df_patched = df_enriched
+else:
+    print("🔧 Patching data: Joining enriched file with original file to get product_id...")
+
+    # Prepare the original data: we only need 'product_id' and 'product_name'
+    df_original_products = df_original_products[['product_id', 'product_name']]
+
+    # Join the two dataframes
+    # We join your enriched file's 'instacart_product' column
+    # with the original file's 'product_name' column.
+    df_patched = df_enriched.merge(
+        df_original_products,
+        left_on='instacart_product',
+        right_on='product_name',
+        how='left'
+    )
 
 # Check if the join was successful
 missing_ids = df_patched['product_id'].isna().sum()
@@ -11,11 +11,6 @@ MODEL_PATH = "ml_models/triple2vec_model.pth"
 USER_MAP_PATH = "data/embeddings/user2idx.json" # Adjust path if needed
 ENV_PATH = os.path.join(os.path.dirname(__file__), '..', 'smartcart-backend', '.env')
 
-# --- Model parameters (MUST match training script) ---
-NUM_USERS = 206209
-NUM_PRODUCTS = 10000
-EMBED_DIM = 64
-
 print("🚀 Starting User Embedding Ingestion Script...")
 
 # --- 1. LOAD DATABASE URL ---
@@ -43,8 +38,12 @@ except Exception as e:
 
 # --- 3. LOAD MODEL & EXTRACT EMBEDDINGS ---
 try:
-    model = Triple2Vec(NUM_USERS, NUM_PRODUCTS, EMBED_DIM)
-    model.load_state_dict(torch.load(MODEL_PATH, map_location="cpu"))
+    # Table sizes come from the checkpoint, so full-catalog and incremental models load too
+    state = torch.load(MODEL_PATH, map_location="cpu")
+    num_users, embed_dim = state['h.weight'].shape
+    num_products = state['p.weight'].shape[0]
+    model = Triple2Vec(num_users, num_products, embed_dim)
+    model.load_state_dict(state)
     model.eval()
     user_embeddings = model.h.weight.data.cpu().numpy()
     print(f"✅ Loaded user embeddings from model. Shape: {user_embeddings.shape}")
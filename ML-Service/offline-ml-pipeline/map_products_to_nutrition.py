@@ -1,14 +1,22 @@
 import pandas as pd
 import numpy as np
 import difflib
-import json
 from tqdm import tqdm
-import math
+from compute_health_factor import score_nutrient_dicts
+from off_cache import read_off, snapshot_version
+from match_store import MatchStore
 
 # ---------------- CONFIG ---------------- #
 input_instacart_path = "data/instacart_product_nutrition.parquet"
-openfoodfacts_path = "data/openfoodfacts_filtered/openfoodfacts_filtered.parquet"
+# OpenFoodFacts comes from the Parquet cache built by off_cache.py (typed nutrient columns)
+OFF_COLUMNS = ["product_name", "product_name_lower", "code", "image_url", "energy_kcal_100g", "fat_100g",
+               "saturated_fat_100g", "carbohydrates_100g", "sugars_100g", "fiber_100g", "proteins_100g", "salt_100g"]
 output_path = "data/products_with_nutrition_and_health.parquet"
+MATCH_CUTOFF = 0.85
+# Stored matches are reused while the OFF snapshot and these settings are unchanged
+MATCHER_NAME = "difflib"
+MATCHER_CONFIG = {"cutoff": MATCH_CUTOFF}
+HEALTH_PROFILE = "macro_balance"  # see compute_health_factor.PROFILES ("additive" = the old formula here)
 # ---------------------------------------- #
 
 
@@ -21,135 +29,98 @@ def find_best_match(name, candidates, cutoff=0.85):
 
 
 # ✅ Extract nutrients safely
-def extract_nutrients(nutriments):
-    """Extract relevant nutrient values from a dict."""
-    if isinstance(nutriments, str):
-        try:
-            nutriments = json.loads(nutriments)
-        except Exception:
-            return None
-
-    if not isinstance(nutriments, dict):
-        return None
+def extract_nutrients(matched_row):
+    """Relevant nutrient values from the cache's typed columns (missing values -> None)."""
+    def value(col):
+        v = matched_row[col]
+        return None if pd.isna(v) else float(v)
 
     return {
-        "energy_kcal_100g": nutriments.get("energy-kcal_100g") or nutriments.get("energy-kcal_value"),
-        "fat_100g": nutriments.get("fat_100g"),
-        "saturated_fat_100g": nutriments.get("saturated-fat_100g"),
-        "carbohydrates_100g": nutriments.get("carbohydrates_100g"),
-        "sugars_100g": nutriments.get("sugars_100g"),
-        "fiber_100g": nutriments.get("fiber_100g"),
-        "proteins_100g": nutriments.get("proteins_100g"),
-        "salt_100g": nutriments.get("salt_100g"),
+        "energy_kcal_100g": value("energy_kcal_100g"),
+        "fat_100g": value("fat_100g"),
+        "saturated_fat_100g": value("saturated_fat_100g"),
+        "carbohydrates_100g": value("carbohydrates_100g"),
+        "sugars_100g": value("sugars_100g"),
+        "fiber_100g": value("fiber_100g"),
+        "proteins_100g": value("proteins_100g"),
+        "salt_100g": value("salt_100g"),
     }
 
 
 # ✅ Extract valid image URL
-def extract_image_url(code, images):
-    """Return a valid OpenFoodFacts image URL."""
+def extract_image_url(code, image_url):
+    """Return the OFF front image URL, or the conventional path built from the barcode."""
+    if isinstance(image_url, str) and image_url:
+        return image_url
     if not code:
         return None
 
+    # Format product code as segmented path (OFF style)
     base = "https://images.openfoodfacts.org/images/products"
-
-    # Try to format product code as segmented path (OFF style)
     code_str = str(code)
     code_path = "/".join([code_str[i:i + 3] for i in range(0, len(code_str), 3)])
-
-    if isinstance(images, str):
-        try:
-            images = json.loads(images)
-        except Exception:
-            return None
-
-    if isinstance(images, dict):
-        # Try the 'front' image field
-        front = images.get("front")
-        if isinstance(front, dict):
-            if "display" in front:
-                return front["display"]
-            elif "small" in front:
-                return front["small"]
-        # If not, try a generic fallback
-        return f"{base}/{code_path}/front_en.400.jpg"
-
     return f"{base}/{code_path}/front_en.400.jpg"
 
 
-# ✅ Compute Health Factor
-def compute_health_factor(nutrients):
-    """
-    Compute a simple health score based on macro balance.
-    Higher protein & fiber = better.
-    High sugar, salt, and saturated fat = worse.
-    """
-    if not nutrients or not isinstance(nutrients, dict):
-        return None
-
-    # Extract with defaults
-    protein = nutrients.get("proteins_100g") or 0
-    fiber = nutrients.get("fiber_100g") or 0
-    sugar = nutrients.get("sugars_100g") or 0
-    sat_fat = nutrients.get("saturated_fat_100g") or 0
-    salt = nutrients.get("salt_100g") or 0
-
-    # Scale into 0–100
-    score = (
-        (protein * 2 + fiber * 1.5)
-        - (sugar * 1.2 + sat_fat * 1.0 + salt * 1.3)
-    )
-
-    # Normalize and cap
-    score = max(0, min(100, 50 + score))
-    return round(score, 2)
-
-
 # ---------------- MAIN ---------------- #
 print("🚀 Loading data...")
 
 instacart_df = pd.read_parquet(input_instacart_path)
-off_df = pd.read_parquet(openfoodfacts_path)
-
-print(f"✅ Loaded {len(instacart_df)} Instacart items and {len(off_df)} OpenFoodFacts entries")
-
-# Keep only relevant columns
-off_df = off_df[["product_name", "nutriments", "images", "code"]].dropna(subset=["product_name"])
-off_names = off_df["product_name"].str.lower().tolist()
-
+print(f"✅ Loaded {len(instacart_df)} Instacart items")
+
+# Reuse stored matches for this OFF snapshot + cutoff; only names not seen yet are matched
+try:
+    store = MatchStore(MATCHER_NAME, MATCHER_CONFIG, snapshot_version())
+except FileNotFoundError as e:
+    print(f"❌ Error: {e}")
+    exit()
+purged = store.purge_stale()
+if purged:
+    print(f"🧹 Dropped {purged} stored matches from an older OFF snapshot or cutoff")
+records = store.lookup()
+new_names = [name for name in pd.unique(instacart_df["product_name"].dropna().str.lower())
+             if name.strip() and name not in records]
+print(f"♻️ {len(records)} names already matched, {len(new_names)} new names to match")
+
+if new_names:
+    off_df = read_off(columns=OFF_COLUMNS)
+    print(f"✅ Loaded {len(off_df)} OpenFoodFacts entries")
+    off_names = off_df["product_name_lower"].tolist()
+    first_row = off_df.drop_duplicates(subset=["product_name_lower"]).set_index("product_name_lower")
+
+    print("🔍 Matching new products...")
+    new_records = {}
+    for name in tqdm(new_names):
+        best_match = find_best_match(name, off_names, cutoff=MATCH_CUTOFF)
+        if best_match:
+            matched_row = first_row.loc[best_match]
+            new_records[name] = {
+                "matched_off_product": matched_row["product_name"],
+                "off_code": matched_row["code"],
+                "image_url": extract_image_url(matched_row["code"], matched_row["image_url"]),
+                "nutrients": extract_nutrients(matched_row),
+            }
+        else:
+            new_records[name] = {"matched_off_product": None, "off_code": None, "image_url": None, "nutrients": None}
+    store.save(new_records)
+    records.update(new_records)
+store.close()
+
+no_match = {"matched_off_product": None, "off_code": None, "image_url": None, "nutrients": None}
 enriched_rows = []
-
-print("🔍 Matching and enriching products...")
-
-for _, row in tqdm(instacart_df.iterrows(), total=len(instacart_df)):
-    product_name = row["product_name"]
-    best_match = find_best_match(product_name, off_names, cutoff=0.85)
-
-    if best_match:
-        matched_row = off_df[off_df["product_name"].str.lower() == best_match].iloc[0]
-        nutrients = extract_nutrients(matched_row["nutriments"])
-        img_url = extract_image_url(matched_row["code"], matched_row["images"])
-        health_factor = compute_health_factor(nutrients)
-
-        enriched_rows.append({
-            "instacart_product": product_name,
-            "matched_off_product": matched_row["product_name"],
-            "off_code": matched_row["code"],
-            "image_url": img_url,
-            "nutrients": nutrients,
-            "health_factor": health_factor
-        })
-    else:
-        enriched_rows.append({
-            "instacart_product": product_name,
-            "matched_off_product": None,
-            "off_code": None,
-            "image_url": None,
-            "nutrients": None,
-            "health_factor": None
-        })
+for product_name in instacart_df["product_name"]:
+    record = records.get(product_name.lower(), no_match) if isinstance(product_name, str) else no_match
+    enriched_rows.append({
+        "instacart_product": product_name,
+        "matched_off_product": record["matched_off_product"],
+        "off_code": record["off_code"],
+        "image_url": record["image_url"],
+        "nutrients": record["nutrients"],
+    })
 
 # Convert to DataFrame
 enriched_df = pd.DataFrame(enriched_rows)
+enriched_df["health_factor"] = score_nutrient_dicts(enriched_df["nutrients"], HEALTH_PROFILE)
 
 print(f"\n✅ Enriched {enriched_df['matched_off_product'].notna().sum()} / {len(enriched_df)} products successfully")
 
@@ -159,4 +130,4 @@ print(f"💾 Saved enriched dataset to: {output_path}")
 
 # Optional preview
 print("\n📊 Sample:")
-print(enriched_df.head(10))
\ No newline at end of file
+print(enriched_df.head(10))
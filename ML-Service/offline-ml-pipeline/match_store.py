@@ -0,0 +1,92 @@
+# match_store.py
+# Persistent Instacart-name -> OpenFoodFacts match results (SQLite, stdlib only).
+#
+# Rows are keyed by (matcher, config_key, snapshot, name_lower):
+#   matcher    - which script/algorithm produced the match ("blocked_wratio", "difflib", ...)
+#   config_key - hash of the matcher settings (threshold, prefix length, ...)
+#   snapshot   - off_cache.snapshot_version() of the OFF data that was searched
+# A run only reads rows for its current key, so a new OFF snapshot or a changed threshold
+# re-matches everything once; purge_stale() then drops the superseded rows.
+# "No match" results are stored too, so unmatched names are not retried every run.
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+MATCH_STORE_FILE = "data/match_store.sqlite"
+
+_FIELDS = ("off_code", "matched_off_product", "match_score", "image_url", "brands", "countries_tags", "nutrients")
+
+
+def config_key(config):
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class MatchStore:
+    def __init__(self, matcher, config, snapshot, path=MATCH_STORE_FILE):
+        self.matcher = matcher
+        self.config_key = config_key(config)
+        self.snapshot = snapshot
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS matches (
+                matcher TEXT NOT NULL,
+                config_key TEXT NOT NULL,
+                snapshot TEXT NOT NULL,
+                name_lower TEXT NOT NULL,
+                off_code TEXT,
+                matched_off_product TEXT,
+                match_score REAL,
+                image_url TEXT,
+                brands TEXT,
+                countries_tags TEXT,
+                nutrients TEXT,
+                matched_at TEXT NOT NULL,
+                PRIMARY KEY (matcher, config_key, snapshot, name_lower)
+            )
+        """)
+        self._conn.commit()
+
+    def lookup(self):
+        """All stored results for the current key: {name_lower: record}, record['off_code'] None = no match."""
+        cursor = self._conn.execute(
+            f"SELECT name_lower, {', '.join(_FIELDS)} FROM matches WHERE matcher = ? AND config_key = ? AND snapshot = ?",
+            (self.matcher, self.config_key, self.snapshot),
+        )
+        records = {}
+        for name_lower, *values in cursor:
+            record = dict(zip(_FIELDS, values))
+            record["nutrients"] = json.loads(record["nutrients"]) if record["nutrients"] else None
+            records[name_lower] = record
+        return records
+
+    def save(self, records):
+        """records: {name_lower: record} with the _FIELDS keys (missing keys are stored as NULL)."""
+        now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        rows = [
+            (self.matcher, self.config_key, self.snapshot, name_lower,
+             *(json.dumps(record.get(field)) if field == "nutrients" and record.get(field) is not None else record.get(field)
+               for field in _FIELDS),
+             now)
+            for name_lower, record in records.items()
+        ]
+        self._conn.executemany(
+            f"INSERT OR REPLACE INTO matches (matcher, config_key, snapshot, name_lower, {', '.join(_FIELDS)}, matched_at) "
+            f"VALUES ({', '.join('?' * (len(_FIELDS) + 5))})",
+            rows,
+        )
+        self._conn.commit()
+
+    def purge_stale(self):
+        """Deletes this matcher's rows from other snapshots / configs. Returns the number removed."""
+        cursor = self._conn.execute(
+            "DELETE FROM matches WHERE matcher = ? AND (config_key != ? OR snapshot != ?)",
+            (self.matcher, self.config_key, self.snapshot),
+        )
+        self._conn.commit()
+        return cursor.rowcount
+
+    def close(self):
+        self._conn.close()
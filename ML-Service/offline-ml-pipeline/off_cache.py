@@ -0,0 +1,226 @@
+# off_cache.py
+# One-time conversion of the OpenFoodFacts TSV into a partitioned Parquet dataset, plus the
+# reader every matching / enrichment script uses.
+#
+#   python off_cache.py        # TSV -> data/openfoodfacts/parquet/ (streams; memory stays bounded)
+#   (or build it straight from the download: data/openfoodfacts/download_openfoodfacts.py --stream)
+#
+# Dataset layout (hive partitioning on the first character of the normalized name):
+#   data/openfoodfacts/parquet/name_initial=a/part-0.parquet, name_initial=b/..., name_initial=_/...
+# Columns: code, product_name, product_name_lower, name_prefix (first 2 chars of the lower name),
+# brands, countries_tags, image_url (strings) and float32 nutrients per 100 g.
+# _snapshot.json identifies the OFF dump the cache was built from (see snapshot_version()).
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pyarrow import csv as pa_csv
+
+# --- Configuration ---
+OFF_TSV_FILE = "data/openfoodfacts/en.openfoodfacts.org.products.csv"
+OFF_PARQUET_DIR = "data/openfoodfacts/parquet"
+READ_BLOCK_BYTES = 64 << 20     # TSV bytes parsed per record batch
+ROWS_PER_GROUP = 1_000_000     # Parquet row-group size
+# ---------------------
+
+OFF_IMAGE_BASE = "https://images.openfoodfacts.org/images/products"
+SNAPSHOT_FILE = "_snapshot.json" # Written after a conversion; '_' keeps it out of dataset discovery
+
+TEXT_COLS = ["code", "product_name", "brands", "countries_tags", "image_url"]
+# TSV column -> typed cache column
+NUTRIENT_COLS = {
+    "energy-kcal_100g": "energy_kcal_100g",
+    "proteins_100g": "proteins_100g",
+    "fat_100g": "fat_100g",
+    "saturated-fat_100g": "saturated_fat_100g",
+    "carbohydrates_100g": "carbohydrates_100g",
+    "sugars_100g": "sugars_100g",
+    "fiber_100g": "fiber_100g",
+    "salt_100g": "salt_100g",
+}
+PARTITION_COL = "name_initial"
+
+SCHEMA = pa.schema(
+    [(name, pa.string()) for name in TEXT_COLS]
+    + [("product_name_lower", pa.string()), ("name_prefix", pa.string())]
+    + [(name, pa.float32()) for name in NUTRIENT_COLS.values()]
+    + [(PARTITION_COL, pa.string())]
+)
+
+
+def name_initial(lower_names):
+    """Partition key: first character when it is [a-z0-9], else '_'."""
+    initial = pc.utf8_slice_codeunits(lower_names, 0, 1)
+    return pc.if_else(pc.match_substring_regex(initial, "^[a-z0-9]$"), initial, "_")
+
+
+def _to_float32(column):
+    # OFF values are mostly clean numbers; anything unparsable becomes null
+    return pa.array(pd.to_numeric(column.to_pandas(), errors='coerce').astype('float32'), type=pa.float32())
+
+
+def normalize_batch(batch):
+    """One raw TSV record batch -> one cache batch (rows without a product name are dropped)."""
+    table = pa.Table.from_batches([batch])
+    lower = pc.utf8_trim_whitespace(pc.utf8_lower(table.column("product_name")))
+    keep = pc.fill_null(pc.greater(pc.utf8_length(lower), 0), False)
+    table, lower = table.filter(keep), lower.filter(keep)
+
+    columns = {name: table.column(name) for name in TEXT_COLS}
+    columns["product_name_lower"] = lower
+    columns["name_prefix"] = pc.utf8_slice_codeunits(lower, 0, 2)
+    for source, target in NUTRIENT_COLS.items():
+        columns[target] = _to_float32(table.column(source))
+    columns[PARTITION_COL] = name_initial(lower)
+    return pa.Table.from_pydict(columns, schema=SCHEMA).to_batches()
+
+
+def write_cache(tsv_source, out_dir, source_info):
+    """
+    Streams a TSV (path or readable stream, e.g. a decompressing HTTP body) through normalize_batch
+    into the partitioned dataset, then writes _snapshot.json for `source_info`. Returns rows written.
+    """
+    reader = pa_csv.open_csv(
+        tsv_source,
+        read_options=pa_csv.ReadOptions(block_size=READ_BLOCK_BYTES),
+        parse_options=pa_csv.ParseOptions(delimiter="\t", quote_char=False, invalid_row_handler=lambda row: "skip"),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=TEXT_COLS + list(NUTRIENT_COLS),
+            column_types={name: pa.string() for name in TEXT_COLS + list(NUTRIENT_COLS)},
+        ),
+    )
+    written = 0
+
+    def batches():
+        nonlocal written
+        for batch in reader:
+            for out in normalize_batch(batch):
+                written += out.num_rows
+                yield out
+
+    ds.write_dataset(
+        batches(),
+        out_dir,
+        schema=SCHEMA,
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([(PARTITION_COL, pa.string())]), flavor="hive"),
+        existing_data_behavior="delete_matching",
+        max_rows_per_group=ROWS_PER_GROUP,
+        min_rows_per_group=min(ROWS_PER_GROUP, 100_000),
+    )
+
+    snapshot = {
+        "version": hashlib.sha256(json.dumps(source_info, sort_keys=True).encode()).hexdigest()[:16],
+        "source": source_info,
+        "rows": written,
+        "converted_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    with open(os.path.join(out_dir, SNAPSHOT_FILE), 'w') as f:
+        json.dump(snapshot, f, indent=2)
+    return written
+
+
+def convert_tsv_to_parquet(tsv_path=OFF_TSV_FILE, out_dir=OFF_PARQUET_DIR):
+    """Converts the downloaded TSV file. Returns rows written."""
+    stat = os.stat(tsv_path)
+    source_info = {"path": os.path.abspath(tsv_path), "size": stat.st_size, "mtime": int(stat.st_mtime)}
+    return write_cache(tsv_path, out_dir, source_info)
+
+
+def snapshot_version(parquet_dir=OFF_PARQUET_DIR):
+    """
+    Identifier of the OFF dump behind the cache (keys the match store). Caches written before
+    snapshot files existed fall back to a hash of their file listing.
+    """
+    try:
+        with open(os.path.join(parquet_dir, SNAPSHOT_FILE), 'r') as f:
+            return json.load(f)["version"]
+    except FileNotFoundError:
+        if not os.path.isdir(parquet_dir):
+            raise FileNotFoundError(f"No OpenFoodFacts Parquet cache at '{parquet_dir}'. Run 'off_cache.py' first.")
+    listing = sorted(
+        (os.path.relpath(os.path.join(root, name), parquet_dir), os.path.getsize(os.path.join(root, name)),
+         int(os.path.getmtime(os.path.join(root, name))))
+        for root, _, names in os.walk(parquet_dir) for name in names
+    )
+    return hashlib.sha256(json.dumps(listing).encode()).hexdigest()[:16]
+
+
+def read_off_table(columns=None, initials=None, codes=None, countries=None, parquet_dir=OFF_PARQUET_DIR):
+    """
+    Reads the cache as an Arrow table, touching only the requested columns.
+      initials  - iterable of name initials (partition pruning: other directories are never opened)
+      codes     - only these OFF barcodes
+      countries - substrings that must appear in countries_tags (e.g. ["united-states"])
+    Raises FileNotFoundError when the cache has not been built yet.
+    """
+    if not os.path.isdir(parquet_dir):
+        raise FileNotFoundError(f"No OpenFoodFacts Parquet cache at '{parquet_dir}'. Run 'off_cache.py' first.")
+    dataset = ds.dataset(parquet_dir, format="parquet", partitioning="hive", schema=SCHEMA)
+
+    conditions = []
+    if initials is not None:
+        conditions.append(ds.field(PARTITION_COL).isin(sorted(set(initials))))
+    if codes is not None:
+        conditions.append(ds.field("code").isin(pa.array(np.unique(np.asarray(codes, dtype=str)), type=pa.string())))
+    if countries:
+        conditions.append(pc.match_substring_regex(ds.field("countries_tags"), pattern="|".join(countries)))
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return dataset.to_table(columns=columns, filter=expression)
+
+
+def read_off(columns=None, initials=None, codes=None, countries=None, parquet_dir=OFF_PARQUET_DIR):
+    """read_off_table() as a pandas DataFrame."""
+    return read_off_table(columns, initials, codes, countries, parquet_dir).to_pandas()
+
+
+def image_url_from_code(codes):
+    """
+    Conventional OFF front-image URL for each barcode (Arrow string array in, out; null stays null).
+    Codes longer than 8 characters are stored under code[:3]/code[3:6]/code[6:9]/code[9:];
+    shorter codes are a single path segment.
+    """
+    codes = pc.if_else(pc.greater(pc.utf8_length(codes), 0), codes, pa.scalar(None, pa.string()))
+    split = pc.binary_join_element_wise(
+        pc.utf8_slice_codeunits(codes, 0, 3), pc.utf8_slice_codeunits(codes, 3, 6),
+        pc.utf8_slice_codeunits(codes, 6, 9), pc.utf8_slice_codeunits(codes, 9), "/")
+    path = pc.if_else(pc.greater(pc.utf8_length(codes), 8), split, codes)
+    return pc.binary_join_element_wise(OFF_IMAGE_BASE, path, "front_en.400.jpg", "/")
+
+
+def initials_of(names):
+    """Partition keys needed to find candidates for these (lower-cased) names."""
+    lower = pa.array(pd.Series(names, dtype=object).fillna("").astype(str))
+    return set(name_initial(lower).to_pylist())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Convert the OpenFoodFacts TSV into the partitioned Parquet cache.")
+    parser.add_argument("--tsv", default=OFF_TSV_FILE)
+    parser.add_argument("--out", default=OFF_PARQUET_DIR)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not os.path.exists(args.tsv):
+        print(f"❌ Error: '{args.tsv}' not found. Run 'data/openfoodfacts/download_openfoodfacts.py' first.")
+        exit()
+    print(f"📦 Converting {args.tsv} to Parquet under {args.out}...")
+    started = time.time()
+    rows = convert_tsv_to_parquet(args.tsv, args.out)
+    print(f"✅ Wrote {rows:,} OpenFoodFacts products in {time.time() - started:.0f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import json
+import os
+import time
+
+import numpy as np
+
+from serving_bundle import USER_TOPK_INDICES_FILE, USER_TOPK_SCORES_FILE, dequantize_user_embeddings
+
+# --- Configuration (Should match outputs from triple2vec_train.py) ---
+SERVING_BUNDLE_DIR = "data/embeddings/serving" # Top-K files + manifest entries are written here
+TOP_K = 100          # Same as N_CANDIDATES in ranking.py: gamma re-ranking happens at serve time
+BLOCK_SIZE = 4096    # Users scored per matmul; a block costs BLOCK_SIZE x num_products x 4 bytes
+INDICES_FILE = USER_TOPK_INDICES_FILE # int32 (num_users, TOP_K) embedding rows, best first
+SCORES_FILE = USER_TOPK_SCORES_FILE   # float16 (num_users, TOP_K) cosine preference scores
+# ---------------------------------------------------------------------
+
+print("🚀 Starting offline top-K precompute for all known users...")
+
+# --- 1. Load the serving bundle ---
+manifest_path = os.path.join(SERVING_BUNDLE_DIR, "manifest.json")
+try:
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    user_embeddings = np.load(os.path.join(SERVING_BUNDLE_DIR, manifest['files']['user_embeddings']['path']), mmap_mode='r')
+    item_embeddings = np.load(os.path.join(SERVING_BUNDLE_DIR, manifest['files']['item_embeddings']['path']))
+    # Quantized (int8) bundles carry per-row scales
+    user_scales = None
+    if 'user_scales' in manifest['files']:
+        user_scales = np.load(os.path.join(SERVING_BUNDLE_DIR, manifest['files']['user_scales']['path']), mmap_mode='r')
+except FileNotFoundError as e:
+    print(f"❌ Error: Serving bundle file not found: {e}")
+    print("➡ Please run 'triple2vec_train.py' first to export the serving bundle.")
+    exit()
+
+num_users, embed_dim = user_embeddings.shape
+num_products = item_embeddings.shape[0]
+k = min(TOP_K, num_products)
+print(f"✅ Loaded {num_users} users and {num_products} items (dim {embed_dim}). Computing top-{k}.")
+
+# Item rows are already L2-normalized in the bundle; make the matrix contiguous for BLAS
+item_matrix_t = np.ascontiguousarray(item_embeddings.astype('float32').T)
+
+# --- 2. Score users block by block: one BLAS matmul + one argpartition per block ---
+topk_indices = np.lib.format.open_memmap(
+    os.path.join(SERVING_BUNDLE_DIR, INDICES_FILE), mode='w+', dtype='int32', shape=(num_users, k))
+topk_scores = np.lib.format.open_memmap(
+    os.path.join(SERVING_BUNDLE_DIR, SCORES_FILE), mode='w+', dtype='float16', shape=(num_users, k))
+
+started = time.time()
+for start in range(0, num_users, BLOCK_SIZE):
+    end = min(start + BLOCK_SIZE, num_users)
+
+    # Same query as app.py for an empty basket: the user vector, L2-normalized
+    queries = dequantize_user_embeddings(
+        user_embeddings[start:end], user_scales[start:end] if user_scales is not None else None)
+    queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+    scores = queries @ item_matrix_t # (block, num_products)
+    if k < num_products:
+        cols = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        cols = np.broadcast_to(np.arange(num_products), scores.shape).copy()
+    block_scores = np.take_along_axis(scores, cols, axis=1)
+    order = np.argsort(-block_scores, axis=1)
+
+    topk_indices[start:end] = np.take_along_axis(cols, order, axis=1)
+    topk_scores[start:end] = np.take_along_axis(block_scores, order, axis=1)
+
+    if (start // BLOCK_SIZE) % 10 == 0:
+        print(f"   • {end}/{num_users} users ({end / (time.time() - started):,.0f} users/s)")
+
+topk_indices.flush()
+topk_scores.flush()
+del topk_indices, topk_scores
+print(f"✅ Scored {num_users} users in {time.time() - started:.1f}s.")
+
+# --- 3. Register the files in the manifest so app.py picks them up ---
+manifest['files']['user_topk_indices'] = {"path": INDICES_FILE, "dtype": "int32", "shape": [num_users, k]}
+manifest['files']['user_topk_scores'] = {"path": SCORES_FILE, "dtype": "float16", "shape": [num_users, k]}
+with open(manifest_path, 'w') as f:
+    json.dump(manifest, f, indent=2)
+print(f"💾 Saved top-{k} arrays to {SERVING_BUNDLE_DIR} and updated {manifest_path}")
+print("🎉 Top-K precompute complete!")
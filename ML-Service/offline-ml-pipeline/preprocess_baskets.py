@@ -0,0 +1,169 @@
+# preprocess_baskets.py
+# Columnar, cached preprocessing of the Instacart order files into CSR baskets.
+#
+# The CSVs are read once with pyarrow (only the needed columns, int32), filtered to the product
+# vocabulary and written to data/cache/baskets/<key>/, where <key> hashes the input files
+# (path, size, mtime) and the config. triple2vec_train.py and the evaluation scripts call
+# load_baskets(), which reuses the artifact when the key matches and rebuilds it otherwise.
+#
+# Artifact layout:
+#   baskets.npz      - BasketCSR: offsets (int64), items / users / order_ids (int32)
+#   product_ids.npy  - int32 product_id of each item row   (prod2idx = {pid: row})
+#   user_ids.npy     - int32 user_id of each user row      (user2idx = {uid: row})
+#   meta.json        - key inputs, counts and build time (written last: its presence marks a complete artifact)
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv as pa_csv
+
+from triple_sampler import BasketCSR
+
+# --- Configuration ---
+KAGGLE_DIR = "data/kaggle"
+ORDER_PRODUCTS_FILE = os.path.join(KAGGLE_DIR, "order_products__prior.csv")
+ORDERS_FILE = os.path.join(KAGGLE_DIR, "orders.csv")
+PRODUCTS_FILE = os.path.join(KAGGLE_DIR, "products.csv")
+CACHE_DIR = "data/cache/baskets"
+MAX_PRODUCTS = None   # Same as triple2vec_train.py; None = full catalog
+FORMAT_VERSION = 1    # Bump when the artifact layout or the preprocessing logic changes
+# ---------------------
+
+BASKETS_FILE = "baskets.npz"
+PRODUCT_IDS_FILE = "product_ids.npy"
+USER_IDS_FILE = "user_ids.npy"
+META_FILE = "meta.json"
+
+
+def read_int32_columns(path, columns):
+    """Only `columns` are parsed, straight into int32 Arrow arrays."""
+    return pa_csv.read_csv(
+        path,
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=list(columns),
+            column_types={name: pa.int32() for name in columns},
+        ),
+    )
+
+
+def _file_fingerprint(path):
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+def artifact_key(order_products_file, orders_file, products_file, max_products):
+    config = {
+        "format_version": FORMAT_VERSION,
+        "max_products": max_products or 0,
+        "inputs": [_file_fingerprint(p) for p in (order_products_file, orders_file, products_file)],
+    }
+    digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+    return digest, config
+
+
+def dense_lookup(ids, rows=None, size=None):
+    """
+    int32 array mapping id -> row (or -1), so whole columns can be remapped with one fancy index.
+    rows defaults to each id's position; size (> every id that will be looked up) defaults to ids.max() + 1.
+    """
+    lookup = np.full(max(int(ids.max()) + 1, size or 0), -1, dtype='int32')
+    lookup[ids] = np.arange(len(ids), dtype='int32') if rows is None else rows
+    return lookup
+
+
+def build_baskets(order_products_file, orders_file, products_file, max_products):
+    """Returns (BasketCSR, product_ids, user_ids) for the given CSVs."""
+    product_ids = read_int32_columns(products_file, ["product_id"]).column("product_id").to_numpy()
+    if max_products:
+        product_ids = product_ids[:max_products]
+
+    orders_meta = read_int32_columns(orders_file, ["order_id", "user_id"])
+    meta_order_ids = orders_meta.column("order_id").to_numpy()
+    meta_user_ids = orders_meta.column("user_id").to_numpy()
+    # Same user order as the original groupby pipeline: first appearance in orders.csv
+    user_ids = pd.unique(meta_user_ids).astype('int32')
+    print(f"   • Vocab sizes: Products={len(product_ids)}, Users={len(user_ids)}")
+
+    lines = read_int32_columns(order_products_file, ["order_id", "product_id"])
+    print(f"   • Read {lines.num_rows:,} order lines from {order_products_file}")
+    lines = lines.filter(pc.is_in(lines.column("product_id"), value_set=pa.array(product_ids)))
+    line_orders = lines.column("order_id").to_numpy()
+    line_products = lines.column("product_id").to_numpy()
+    print(f"   • {lines.num_rows:,} lines remain after filtering to the product vocabulary")
+
+    # order_id -> user row, then line -> user row, without a DataFrame merge
+    order_to_user = np.full(int(meta_order_ids.max()) + 1, -1, dtype='int32')
+    order_to_user[meta_order_ids] = dense_lookup(user_ids)[meta_user_ids]
+    line_users = order_to_user[line_orders]
+    known = line_users >= 0
+
+    baskets = BasketCSR.from_orders(
+        line_orders[known], dense_lookup(product_ids)[line_products[known]], line_users[known])
+    return baskets, product_ids, user_ids
+
+
+def load_baskets(order_products_file=ORDER_PRODUCTS_FILE, orders_file=ORDERS_FILE, products_file=PRODUCTS_FILE,
+                 max_products=MAX_PRODUCTS, cache_dir=CACHE_DIR, force=False):
+    """
+    Returns (baskets, prod2idx, user2idx), building and caching the artifact on a key miss.
+    Raises FileNotFoundError when an input CSV is missing.
+    """
+    key, config = artifact_key(order_products_file, orders_file, products_file, max_products)
+    artifact_dir = os.path.join(cache_dir, key)
+
+    if force or not os.path.exists(os.path.join(artifact_dir, META_FILE)):
+        print(f"🧺 Building basket artifact {key} (inputs or config changed)...")
+        started = time.time()
+        baskets, product_ids, user_ids = build_baskets(order_products_file, orders_file, products_file, max_products)
+        os.makedirs(artifact_dir, exist_ok=True)
+        baskets.save(os.path.join(artifact_dir, BASKETS_FILE))
+        np.save(os.path.join(artifact_dir, PRODUCT_IDS_FILE), product_ids)
+        np.save(os.path.join(artifact_dir, USER_IDS_FILE), user_ids)
+        meta = dict(config, key=key, num_baskets=len(baskets), num_items=int(len(baskets.items)),
+                    num_products=int(len(product_ids)), num_users=int(len(user_ids)),
+                    build_seconds=round(time.time() - started, 1))
+        with open(os.path.join(artifact_dir, META_FILE), 'w') as f:
+            json.dump(meta, f, indent=2)
+        print(f"💾 Saved {len(baskets):,} baskets to {artifact_dir} in {meta['build_seconds']}s")
+    else:
+        print(f"♻️ Reusing basket artifact {artifact_dir}")
+        baskets = BasketCSR.load(os.path.join(artifact_dir, BASKETS_FILE))
+        product_ids = np.load(os.path.join(artifact_dir, PRODUCT_IDS_FILE))
+        user_ids = np.load(os.path.join(artifact_dir, USER_IDS_FILE))
+
+    prod2idx = {int(p): i for i, p in enumerate(product_ids.tolist())}
+    user2idx = {int(u): i for i, u in enumerate(user_ids.tolist())}
+    return baskets, prod2idx, user2idx
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build (or reuse) the cached CSR basket artifact from the Instacart CSVs.")
+    parser.add_argument("--order-products", default=ORDER_PRODUCTS_FILE)
+    parser.add_argument("--orders", default=ORDERS_FILE)
+    parser.add_argument("--products", default=PRODUCTS_FILE)
+    parser.add_argument("--max-products", type=int, default=MAX_PRODUCTS, help="0 keeps the full catalog")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--force", action="store_true", help="Rebuild even when a matching artifact exists")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    try:
+        baskets, prod2idx, user2idx = load_baskets(args.order_products, args.orders, args.products,
+                                                   args.max_products, args.cache_dir, args.force)
+    except FileNotFoundError as e:
+        print(f"❌ Error loading data: {e}")
+        print("Please ensure the Kaggle Instacart data is in the 'data/kaggle/' directory.")
+        exit()
+    print(f"✅ {len(baskets):,} baskets, {len(prod2idx)} products, {len(user2idx)} users.")
+
+
+if __name__ == "__main__":
+    main()
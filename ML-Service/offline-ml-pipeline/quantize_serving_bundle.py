@@ -0,0 +1,99 @@
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+
+from serving_bundle import (
+    MANIFEST_FILE, USER_EMBEDDINGS_FILE, USER_SCALES_FILE, USER_EMBEDDING_DTYPES,
+    quantize_user_embeddings, dequantize_user_embeddings,
+)
+
+# --- Configuration ---
+SOURCE_BUNDLE_DIR = "data/embeddings/serving"  # float32 bundle from triple2vec_train.py
+ACCURACY_SAMPLE_USERS = 5000
+ACCURACY_K = (12, 100)  # Final list size and N_CANDIDATES in ranking.py
+# ---------------------
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Quantize the user table of a serving bundle and check ranking overlap.")
+    parser.add_argument("--dtype", choices=[d for d in USER_EMBEDDING_DTYPES if d != "float32"], default="int8")
+    parser.add_argument("--src", default=SOURCE_BUNDLE_DIR)
+    parser.add_argument("--dst", default=None, help="Output bundle directory (default: <src>_<dtype>)")
+    return parser.parse_args()
+
+
+def top_k(queries, item_embeddings, k):
+    queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    scores = queries @ item_embeddings.T
+    return np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+
+def ranking_overlap(baseline_users, quantized_users, item_embeddings, k):
+    """Mean |top-k(float32) ∩ top-k(quantized)| / k over the sampled users (exact matmul, no ANN noise)."""
+    k = min(k, item_embeddings.shape[0])
+    base = top_k(baseline_users, item_embeddings, k)
+    quant = top_k(quantized_users, item_embeddings, k)
+    overlaps = [len(np.intersect1d(b, q, assume_unique=True)) / k for b, q in zip(base, quant)]
+    return float(np.mean(overlaps)), float(np.min(overlaps))
+
+
+def main():
+    args = parse_args()
+    dst = args.dst or f"{args.src.rstrip('/')}_{args.dtype}"
+
+    # --- 1. Load the float32 bundle ---
+    try:
+        with open(os.path.join(args.src, MANIFEST_FILE), 'r') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        print(f"❌ Error: No serving bundle manifest in '{args.src}'. Run 'triple2vec_train.py' first.")
+        exit()
+    if manifest['files']['user_embeddings']['dtype'] != "float32":
+        print(f"❌ Error: '{args.src}' is already quantized ({manifest['files']['user_embeddings']['dtype']}). Start from a float32 bundle.")
+        exit()
+
+    user_embeddings = np.load(os.path.join(args.src, USER_EMBEDDINGS_FILE), mmap_mode='r')
+    item_embeddings = np.load(os.path.join(args.src, manifest['files']['item_embeddings']['path']))
+    print(f"📦 Loaded {user_embeddings.shape[0]} users ({user_embeddings.nbytes / 1e6:.1f} MB float32) from {args.src}")
+
+    # --- 2. Quantize and write the new bundle (every other file is copied as-is) ---
+    stored, scales = quantize_user_embeddings(user_embeddings, args.dtype)
+    os.makedirs(dst, exist_ok=True)
+    for name in os.listdir(args.src):
+        if name not in (MANIFEST_FILE, USER_EMBEDDINGS_FILE, USER_SCALES_FILE):
+            shutil.copy2(os.path.join(args.src, name), os.path.join(dst, name))
+    np.save(os.path.join(dst, USER_EMBEDDINGS_FILE), stored)
+    manifest['files']['user_embeddings']['dtype'] = args.dtype
+    manifest['files'].pop('user_scales', None)
+    if scales is not None:
+        np.save(os.path.join(dst, USER_SCALES_FILE), scales)
+        manifest['files']['user_scales'] = {"path": USER_SCALES_FILE, "dtype": "float32", "shape": list(scales.shape)}
+    quantized_bytes = stored.nbytes + (scales.nbytes if scales is not None else 0)
+    print(f"✅ Quantized user table to {args.dtype}: {quantized_bytes / 1e6:.1f} MB "
+          f"({user_embeddings.nbytes / quantized_bytes:.1f}x smaller)")
+
+    # --- 3. Accuracy check: ranking overlap against the float32 baseline ---
+    rng = np.random.default_rng(0)
+    rows = np.sort(rng.choice(user_embeddings.shape[0], size=min(ACCURACY_SAMPLE_USERS, user_embeddings.shape[0]), replace=False))
+    baseline = np.asarray(user_embeddings[rows], dtype='float32')
+    restored = dequantize_user_embeddings(stored[rows], scales[rows] if scales is not None else None)
+
+    report = {"dtype": args.dtype, "sample_users": int(len(rows)),
+              "max_abs_error": float(np.abs(baseline - restored).max())}
+    print(f"\n📊 Ranking overlap vs float32 on {len(rows)} users:")
+    for k in ACCURACY_K:
+        mean_overlap, min_overlap = ranking_overlap(baseline, restored, item_embeddings, k)
+        report[f"overlap@{k}"] = {"mean": round(mean_overlap, 4), "min": round(min_overlap, 4)}
+        print(f"   • overlap@{k}: mean {mean_overlap:.4f}, worst user {min_overlap:.4f}")
+
+    manifest['quantization'] = report
+    with open(os.path.join(dst, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"\n💾 Quantized bundle saved to: {dst}")
+
+
+if __name__ == "__main__":
+    main()
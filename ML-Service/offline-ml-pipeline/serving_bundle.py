@@ -0,0 +1,118 @@
+# serving_bundle.py
+# Writes the torch-free artifact bundle that ML-Service/app.py loads with np.load(mmap_mode='r').
+#
+# Layout of a bundle directory:
+#   manifest.json             - format version, sizes, dtypes and file names
+#   user_embeddings.npy       - (num_users, dim) rows of model.h; float32, float16 or int8
+#   user_embedding_scales.npy - float32 (num_users,) per-row scales, only for int8
+#   item_embeddings.npy       - float32 (num_products, dim), (p + q) / 2, L2-normalized
+#   product_to_idx.json       - Instacart product_id -> embedding row
+#   user_to_idx.json          - Instacart user_id -> embedding row
+#   user_topk_*.npy           - optional, added later by precompute_user_topk.py; derived from the
+#                               embeddings, so remove_stale_topk() drops them when a new bundle is exported
+import json
+import os
+import time
+
+import numpy as np
+
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+USER_EMBEDDINGS_FILE = "user_embeddings.npy"
+ITEM_EMBEDDINGS_FILE = "item_embeddings.npy"
+PROD2IDX_FILE = "product_to_idx.json"
+USER2IDX_FILE = "user_to_idx.json"
+USER_SCALES_FILE = "user_embedding_scales.npy"
+USER_EMBEDDING_DTYPES = ("float32", "float16", "int8")
+USER_TOPK_INDICES_FILE = "user_topk_indices.npy"
+USER_TOPK_SCORES_FILE = "user_topk_scores.npy"
+
+
+def combine_item_embeddings(item_p, item_q):
+    """Averages the p/q tables and L2-normalizes each row (same as app.py used to do at startup)."""
+    item_embeddings = ((item_p + item_q) / 2.0).astype('float32')
+    norms = np.linalg.norm(item_embeddings, axis=1, keepdims=True)
+    item_embeddings /= np.maximum(norms, 1e-12)
+    return item_embeddings
+
+
+def quantize_user_embeddings(user_embeddings, dtype):
+    """
+    Returns (stored, scales). float16 is a plain cast; int8 is symmetric per-row scalar
+    quantization (row = stored * scale), so every user keeps its own dynamic range.
+    """
+    user_embeddings = np.ascontiguousarray(user_embeddings, dtype='float32')
+    if dtype == "float32":
+        return user_embeddings, None
+    if dtype == "float16":
+        return user_embeddings.astype('float16'), None
+    if dtype == "int8":
+        scales = np.abs(user_embeddings).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        stored = np.clip(np.rint(user_embeddings / scales[:, None]), -127, 127).astype('int8')
+        return stored, scales.astype('float32')
+    raise ValueError(f"Unsupported user embedding dtype '{dtype}'. Choose one of {USER_EMBEDDING_DTYPES}.")
+
+
+def dequantize_user_embeddings(stored, scales=None):
+    """Inverse of quantize_user_embeddings for a row or a block of rows. Always returns a new float32 array."""
+    rows = np.array(stored, dtype='float32')
+    if scales is not None:
+        rows = rows * np.asarray(scales, dtype='float32')[..., None]
+    return rows
+
+
+def export_serving_bundle(out_dir, user_embeddings, item_p, item_q, prod2idx, user2idx, extra_manifest=None,
+                          user_dtype="float32"):
+    """Writes raw .npy files, id maps and a manifest into out_dir. Returns the manifest."""
+    os.makedirs(out_dir, exist_ok=True)
+
+    user_embeddings, user_scales = quantize_user_embeddings(user_embeddings, user_dtype)
+    item_embeddings = combine_item_embeddings(item_p, item_q)
+
+    np.save(os.path.join(out_dir, USER_EMBEDDINGS_FILE), user_embeddings)
+    if user_scales is not None:
+        np.save(os.path.join(out_dir, USER_SCALES_FILE), user_scales)
+    np.save(os.path.join(out_dir, ITEM_EMBEDDINGS_FILE), item_embeddings)
+    with open(os.path.join(out_dir, PROD2IDX_FILE), 'w') as f:
+        json.dump({int(k): int(v) for k, v in prod2idx.items()}, f)
+    with open(os.path.join(out_dir, USER2IDX_FILE), 'w') as f:
+        json.dump({int(k): int(v) for k, v in user2idx.items()}, f)
+
+    manifest = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "embedding_dim": int(item_embeddings.shape[1]),
+        "num_users": int(user_embeddings.shape[0]),
+        "num_products": int(item_embeddings.shape[0]),
+        "item_embeddings_normalized": True,
+        "files": {
+            "user_embeddings": {"path": USER_EMBEDDINGS_FILE, "dtype": user_dtype, "shape": list(user_embeddings.shape)},
+            "item_embeddings": {"path": ITEM_EMBEDDINGS_FILE, "dtype": "float32", "shape": list(item_embeddings.shape)},
+            "product_to_idx": {"path": PROD2IDX_FILE},
+            "user_to_idx": {"path": USER2IDX_FILE},
+        },
+    }
+    if user_scales is not None:
+        manifest["files"]["user_scales"] = {"path": USER_SCALES_FILE, "dtype": "float32", "shape": list(user_scales.shape)}
+    if extra_manifest:
+        manifest.update(extra_manifest)
+
+    # Manifest goes last so a reader never sees a manifest pointing at half-written files
+    with open(os.path.join(out_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def remove_stale_topk(out_dir):
+    """
+    Deletes precomputed top-K files left over from the previous embeddings (the freshly written
+    manifest no longer lists them). Returns the removed paths.
+    """
+    removed = []
+    for name in (USER_TOPK_INDICES_FILE, USER_TOPK_SCORES_FILE):
+        path = os.path.join(out_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+            removed.append(path)
+    return removed
@@ -0,0 +1,202 @@
+# triple2vec_incremental.py
+# Folds orders newer than the recorded watermark into an existing triple2vec model.
+#
+# Only the new baskets are trained on, new users get freshly initialized rows appended to h, and
+# negatives are drawn from the items in those baskets, so every row the optimizer touches belongs
+# to an affected user or item. SparseAdam keeps the step cost proportional to those rows.
+# Products outside the trained vocabulary are skipped (the item tables keep their size).
+import argparse
+import json
+import os
+
+import numpy as np
+import pyarrow.compute as pc
+import torch
+from tqdm import tqdm
+
+from preprocess_baskets import ORDER_PRODUCTS_FILE, ORDERS_FILE, dense_lookup, read_int32_columns
+from serving_bundle import export_serving_bundle, remove_stale_topk
+from triple_sampler import BasketCSR, TripleBatchSampler
+from triple2vec_model import OPTIMIZERS, build_model, make_optimizer, train_step
+
+# --- Configuration (Should match triple2vec_train.py) ---
+BATCH = 512
+EPOCHS = 2
+NEG_SAMPLES = 5
+LR = 0.001
+OPTIMIZER = "sparse_adam" # Must be a sparse optimizer: dense Adam would move every row
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+OUTPUT_DIR = "data/embeddings"
+MODEL_FILE = os.path.join(OUTPUT_DIR, "triple2vec_model.pth")
+EMBEDDINGS_FILE = os.path.join(OUTPUT_DIR, "product_embeddings.npy")
+PROD2IDX_FILE = os.path.join(OUTPUT_DIR, "product_to_idx.json")
+USER2IDX_FILE = os.path.join(OUTPUT_DIR, "user2idx.json")
+USER2IDX_DELTA_FILE = "user2idx_delta.json" # Written to OUTPUT_DIR and into the serving bundle
+WATERMARK_FILE = os.path.join(OUTPUT_DIR, "watermark.json")
+SERVING_BUNDLE_DIR = os.path.join(OUTPUT_DIR, "serving")
+SERVING_USER_DTYPE = "float32"
+# ---------------------------------------------------------
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Incrementally train triple2vec on orders newer than the watermark.")
+    parser.add_argument("--order-products", default=ORDER_PRODUCTS_FILE, help="Order lines CSV containing the new orders")
+    parser.add_argument("--orders", default=ORDERS_FILE, help="orders.csv with order_id -> user_id for the new orders")
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--lr", type=float, default=LR)
+    parser.add_argument("--optimizer", choices=[name for name, sparse in OPTIMIZERS.items() if sparse], default=OPTIMIZER)
+    return parser.parse_args()
+
+
+def load_new_baskets(order_products_file, orders_file, watermark, prod2idx, user2idx):
+    """CSR baskets for orders with order_id > watermark. New users are appended to user2idx (in place)."""
+    lines = read_int32_columns(order_products_file, ["order_id", "product_id"])
+    lines = lines.filter(pc.greater(lines.column("order_id"), watermark))
+    orders_meta = read_int32_columns(orders_file, ["order_id", "user_id"])
+    orders_meta = orders_meta.filter(pc.greater(orders_meta.column("order_id"), watermark))
+    if lines.num_rows == 0 or orders_meta.num_rows == 0:
+        return None, {}
+
+    line_orders = lines.column("order_id").to_numpy()
+    line_products = lines.column("product_id").to_numpy()
+    meta_order_ids = orders_meta.column("order_id").to_numpy()
+    meta_user_ids = orders_meta.column("user_id").to_numpy()
+
+    # Grow the user vocabulary in first-appearance order
+    added = {}
+    for uid in dict.fromkeys(meta_user_ids.tolist()):
+        if uid not in user2idx:
+            added[uid] = user2idx[uid] = len(user2idx)
+
+    product_ids = np.fromiter(prod2idx.keys(), dtype='int32', count=len(prod2idx))
+    product_rows = np.fromiter(prod2idx.values(), dtype='int32', count=len(prod2idx))
+    product_lookup = dense_lookup(product_ids, product_rows, size=int(line_products.max()) + 1)
+    user_ids = np.fromiter(user2idx.keys(), dtype='int32', count=len(user2idx))
+    user_rows = np.fromiter(user2idx.values(), dtype='int32', count=len(user2idx))
+    user_lookup = dense_lookup(user_ids, user_rows)
+
+    order_to_user = dense_lookup(meta_order_ids, user_lookup[meta_user_ids], size=int(line_orders.max()) + 1)
+    line_items = product_lookup[line_products]
+    line_users = order_to_user[line_orders]
+    known = (line_items >= 0) & (line_users >= 0)
+    skipped = int((~known).sum())
+    if skipped:
+        print(f"   • Skipped {skipped:,} lines with products outside the vocabulary or unknown orders")
+
+    return BasketCSR.from_orders(line_orders[known], line_items[known], line_users[known]), added
+
+
+def grow_user_table(state, num_users):
+    """Appends rows for new users, drawn at the scale of the trained table."""
+    old = state['h.weight']
+    extra = num_users - old.shape[0]
+    if extra > 0:
+        state['h.weight'] = torch.cat([old, torch.randn(extra, old.shape[1]) * old.std()])
+    return state
+
+
+def main():
+    args = parse_args()
+    print(f"Using device: {DEVICE}")
+
+    # --- 1. Load the current model, id maps and watermark ---
+    try:
+        state = torch.load(MODEL_FILE, map_location='cpu')
+        with open(PROD2IDX_FILE, 'r') as f:
+            prod2idx = {int(k): v for k, v in json.load(f).items()}
+        with open(USER2IDX_FILE, 'r') as f:
+            user2idx = {int(k): v for k, v in json.load(f).items()}
+        with open(WATERMARK_FILE, 'r') as f:
+            watermark = int(json.load(f)['max_order_id'])
+    except FileNotFoundError as e:
+        print(f"❌ Error: {e}")
+        print("➡ Please run 'triple2vec_train.py' first (it records the watermark).")
+        exit()
+    base_num_users = len(user2idx)
+    print(f"✅ Loaded model with {base_num_users} users and {len(prod2idx)} products. Watermark: order {watermark}")
+
+    # --- 2. New baskets since the watermark ---
+    try:
+        baskets, added_users = load_new_baskets(args.order_products, args.orders, watermark, prod2idx, user2idx)
+    except FileNotFoundError as e:
+        print(f"❌ Error loading data: {e}")
+        exit()
+    if baskets is None or len(baskets) == 0:
+        print("✅ No new baskets after the watermark. Nothing to do.")
+        return
+    new_watermark = int(baskets.order_ids.max())
+    affected_items = np.unique(baskets.items)
+    affected_users = np.unique(baskets.users)
+    print(f"🧺 {len(baskets):,} new baskets: {len(affected_users):,} affected users ({len(added_users):,} new), "
+          f"{len(affected_items):,} affected items")
+
+    # --- 3. Model with the grown user table ---
+    U, V = len(user2idx), len(prod2idx)
+    D = state['h.weight'].shape[1]
+    model = build_model(U, V, D, args.optimizer, DEVICE)
+    model.load_state_dict(grow_user_table(state, U))
+    opt = make_optimizer(model, args.optimizer, args.lr)
+
+    # Negatives from the affected items only, so untouched rows stay exactly as they were
+    if len(affected_items) > 2:
+        negative_sampler = lambda rng, shape: affected_items[rng.integers(0, len(affected_items), size=shape)]
+    else:
+        print("⚠️ Too few affected items for restricted negatives; sampling from the full catalog.")
+        negative_sampler = None
+    loader = TripleBatchSampler(baskets, V, BATCH, NEG_SAMPLES, negative_sampler=negative_sampler)
+
+    # --- 4. Train on the new baskets ---
+    print("\n🔥 Starting incremental training...")
+    for epoch in range(args.epochs):
+        total_loss = 0.0
+        for batch in tqdm(loader, desc=f"Epoch {epoch+1}/{args.epochs}"):
+            total_loss += train_step(model, opt, batch, DEVICE)
+        print(f"Epoch {epoch+1}/{args.epochs} -> Average Loss: {total_loss/len(loader):.4f}")
+
+    # --- 5. Save the model, maps, delta and serving bundle ---
+    print("\n💾 Saving updated model and embeddings...")
+    torch.save(model.state_dict(), MODEL_FILE)
+    p_embed = model.p.weight.detach().cpu().numpy()
+    q_embed = model.q.weight.detach().cpu().numpy()
+    np.save(EMBEDDINGS_FILE, (p_embed + q_embed) / 2.0)
+    with open(USER2IDX_FILE, 'w') as f:
+        json.dump(user2idx, f)
+
+    delta = {
+        "base_watermark": watermark,
+        "watermark": new_watermark,
+        "base_num_users": base_num_users,
+        "num_users": U,
+        "added": {str(uid): idx for uid, idx in added_users.items()},
+    }
+    with open(os.path.join(OUTPUT_DIR, USER2IDX_DELTA_FILE), 'w') as f:
+        json.dump(delta, f)
+    print(f"   - User map delta ({len(added_users)} new users) saved to: {os.path.join(OUTPUT_DIR, USER2IDX_DELTA_FILE)}")
+
+    export_serving_bundle(
+        SERVING_BUNDLE_DIR,
+        user_embeddings=model.h.weight.detach().cpu().numpy(),
+        item_p=p_embed,
+        item_q=q_embed,
+        prod2idx=prod2idx,
+        user2idx=user2idx,
+        extra_manifest={"incremental": {k: v for k, v in delta.items() if k != "added"}},
+        user_dtype=SERVING_USER_DTYPE,
+    )
+    with open(os.path.join(SERVING_BUNDLE_DIR, USER2IDX_DELTA_FILE), 'w') as f:
+        json.dump(delta, f)
+    print(f"   - Serving bundle saved to: {SERVING_BUNDLE_DIR}")
+    if remove_stale_topk(SERVING_BUNDLE_DIR):
+        print("   ⚠️ Removed the precomputed user top-K built from the old embeddings (precomputed serving is off).")
+        print("      Rerun build_faiss.py and precompute_user_topk.py to rebuild the index and top-K for this bundle.")
+
+    # Advance the watermark last, so a failed run is simply retried from the old one
+    with open(WATERMARK_FILE, 'w') as f:
+        json.dump({"max_order_id": new_watermark}, f)
+    print(f"   - Watermark advanced to order {new_watermark}")
+    print("\n🎉 Incremental update done!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# triple2vec_model.py
+# Model, optimizer choice and the per-batch training step shared by triple2vec_train.py
+# and benchmark_optimizers.py. State-dict keys match ML-Service/model.py in every mode.
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+import torch
+import torch.nn as nn
+
+# name -> needs sparse embeddings
+#   adam           - dense Adam: every step updates moment state for ALL rows of h, p and q
+#   sparse_adam    - torch.optim.SparseAdam (lazy Adam): only rows present in the batch are touched
+#   sparse_adagrad - Adagrad on sparse gradients, also row-local
+OPTIMIZERS = {
+    "adam": False,
+    "sparse_adam": True,
+    "sparse_adagrad": True,
+}
+
+
+class Triple2Vec(nn.Module):
+    def __init__(self, U, V, D, sparse=False):
+        super().__init__()
+        self.h = nn.Embedding(U, D, sparse=sparse) # User embeddings
+        self.p = nn.Embedding(V, D, sparse=sparse) # Product "context" embeddings
+        self.q = nn.Embedding(V, D, sparse=sparse) # Product "center" embeddings
+
+    def forward(self, users, items_i, items_j, negs):
+        h_u = self.h(users)
+        p_i = self.p(items_i)
+        q_j = self.q(items_j)
+        pos_score = (h_u * (p_i + q_j)).sum(dim=1)
+
+        neg_p = self.p(negs)
+        neg_q = self.q(negs)
+        neg_scores = (h_u.unsqueeze(1) * (neg_p + neg_q)).sum(dim=2)
+        return pos_score, neg_scores
+
+
+def build_model(U, V, D, optimizer_name, device):
+    if optimizer_name not in OPTIMIZERS:
+        raise ValueError(f"Unknown optimizer '{optimizer_name}'. Choose one of: {', '.join(OPTIMIZERS)}")
+    return Triple2Vec(U, V, D, sparse=OPTIMIZERS[optimizer_name]).to(device)
+
+
+def make_optimizer(model, optimizer_name, lr):
+    params = list(model.parameters())
+    if optimizer_name == "adam":
+        return torch.optim.Adam(params, lr=lr)
+    if optimizer_name == "sparse_adam":
+        return torch.optim.SparseAdam(params, lr=lr)
+    if optimizer_name == "sparse_adagrad":
+        return torch.optim.Adagrad(params, lr=lr)
+    raise ValueError(f"Unknown optimizer '{optimizer_name}'. Choose one of: {', '.join(OPTIMIZERS)}")
+
+
+class PhaseTimer:
+    """
+    Accumulates wall time per training phase (sample / forward / backward / optimizer).
+    On CUDA the device is synchronized at phase boundaries so kernel time lands in the right phase.
+    """
+
+    def __init__(self, device):
+        self._sync = torch.cuda.synchronize if str(device).startswith("cuda") else None
+        self.totals = defaultdict(float)
+
+    @contextmanager
+    def phase(self, name):
+        if self._sync:
+            self._sync()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self._sync:
+                self._sync()
+            self.totals[name] += time.perf_counter() - started
+
+    def reset(self):
+        """Returns the accumulated seconds per phase and starts over."""
+        totals = dict(self.totals)
+        self.totals.clear()
+        return totals
+
+
+class _NoTimer:
+    def phase(self, name):
+        return nullcontext()
+
+
+_bce = nn.BCEWithLogitsLoss(reduction='none')
+
+
+def train_step(model, opt, batch, device, timer=None):
+    """One optimizer step on a (users, i, j, negs) batch; returns the mean loss as a float."""
+    timer = timer or _NoTimer()
+    with timer.phase("forward"):
+        users, i_idx, j_idx, negs = (t.to(device) for t in batch)
+        pos_score, neg_scores = model(users, i_idx, j_idx, negs)
+
+        pos_loss = _bce(pos_score, torch.ones_like(pos_score))
+        neg_loss = _bce(neg_scores, torch.zeros_like(neg_scores)).sum(dim=1)
+        loss = (pos_loss + neg_loss).mean()
+
+    with timer.phase("backward"):
+        opt.zero_grad()
+        loss.backward()
+
+    with timer.phase("optimizer"):
+        opt.step()
+    return loss.item()
@@ -1,12 +1,15 @@
 import torch
-import torch.nn as nn
-from torch.utils.data import Dataset, DataLoader
-import pandas as pd
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
 from tqdm import tqdm
-import random
 import numpy as np
 import json
 import os
+import time
+from serving_bundle import export_serving_bundle, remove_stale_topk
+from triple_sampler import TripleBatchSampler, unigram_negatives
+from preprocess_baskets import load_baskets
+from triple2vec_model import PhaseTimer, build_model, make_optimizer, train_step
 
 # ---------------- CONFIG ---------------- #
 EMBED_DIM = 64
@@ -14,116 +17,143 @@ BATCH = 512
 EPOCHS = 4
 NEG_SAMPLES = 5
 LR = 0.001
+OPTIMIZER = "adam" # "adam" (dense baseline), "sparse_adam" or "sparse_adagrad"; see benchmark_optimizers.py
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-MAX_PRODUCTS = 10000  # Use a subset for faster prototyping
+MAX_PRODUCTS = None  # None = full catalog; e.g. 10000 keeps the first rows of products.csv for prototyping
+NEGATIVES = "unigram" # "unigram" (count^NEG_POWER via an alias table) or "uniform"
+NEG_POWER = 0.75
 
 # --- Output Files ---
 OUTPUT_DIR = "data/embeddings"
 MODEL_FILE = os.path.join(OUTPUT_DIR, "triple2vec_model.pth")
 EMBEDDINGS_FILE = os.path.join(OUTPUT_DIR, "product_embeddings.npy")
 PROD2IDX_FILE = os.path.join(OUTPUT_DIR, "product_to_idx.json")
+USER2IDX_FILE = os.path.join(OUTPUT_DIR, "user2idx.json")
+WATERMARK_FILE = os.path.join(OUTPUT_DIR, "watermark.json") # Newest order trained on; triple2vec_incremental.py starts after it
+SERVING_BUNDLE_DIR = os.path.join(OUTPUT_DIR, "serving") # Copy this directory into ML-Service/ml_models
+SERVING_USER_DTYPE = "float32" # "float16" / "int8" shrink the user table 2x / 4x (see quantize_serving_bundle.py)
+RUN_SUMMARY_FILE = os.path.join(OUTPUT_DIR, "triple2vec_run_summary.json") # Per-phase timings + samples/sec, for comparing runs
+PROFILE_STEPS = 0 # > 0 captures that many steps of epoch 1 with torch.profiler
+PROFILE_TRACE_FILE = os.path.join(OUTPUT_DIR, "triple2vec_profile_trace.json") # Open in chrome://tracing or Perfetto
+SAMPLER_SEED = 0 # Shared by all ranks so they slice the same per-epoch basket permutation
 # --------------------------- #
 
+# ---------------- Distributed (optional) ---------------- #
+# `torchrun --nproc_per_node=N triple2vec_train.py` shards the baskets over N CPU processes (gloo).
+# Gradients are all-reduced by DistributedDataParallel (sparse gradients included), every rank
+# steps an identical optimizer, and only rank 0 writes artifacts. BATCH is per rank.
+WORLD_SIZE = int(os.environ.get("WORLD_SIZE", "1"))
+RANK = int(os.environ.get("RANK", "0"))
+DISTRIBUTED = WORLD_SIZE > 1
+IS_MAIN = RANK == 0
+if DISTRIBUTED:
+    DEVICE = "cpu"
+    dist.init_process_group(backend="gloo")
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // WORLD_SIZE))
+    print(f"Rank {RANK}/{WORLD_SIZE} using {torch.get_num_threads()} threads")
+
 print(f"Using device: {DEVICE}")
 
-# Load data
+# Load baskets: the CSVs are parsed once by preprocess_baskets.py and cached as a CSR artifact
+run_started = time.time()
+if DISTRIBUTED and not IS_MAIN:
+    dist.barrier() # Rank 0 builds the artifact on a cache miss; the others then reuse it
 try:
-    orders = pd.read_csv("data/kaggle/order_products__prior.csv")
-    orders_meta = pd.read_csv("data/kaggle/orders.csv")
-    products = pd.read_csv("data/kaggle/products.csv")[:MAX_PRODUCTS]
+    baskets, prod2idx, user2idx = load_baskets(max_products=MAX_PRODUCTS)
 except FileNotFoundError as e:
     print(f"❌ Error loading data: {e}")
     print("Please ensure the Kaggle Instacart data is in the 'data/kaggle/' directory.")
     exit()
-
-
-orders = orders.merge(orders_meta[['order_id','user_id']], on='order_id', how='left')
-
-# Build mappings
-prod2idx = {int(p):i for i,p in enumerate(products['product_id'].tolist())}
-user2idx = {int(u):i for i,u in enumerate(orders_meta['user_id'].unique().tolist())}
+if DISTRIBUTED and IS_MAIN:
+    dist.barrier()
 
 V = len(prod2idx)
 U = len(user2idx)
 print(f"Vocab sizes: Products={V}, Users={U}")
+print(f"Loaded {len(baskets)} baskets for training.")
+load_seconds = time.time() - run_started
 
-# Rebuild baskets per order (only products in the subset)
-print("Grouping orders into baskets...")
-orders_grouped = orders.groupby('order_id').agg({'user_id':'first','product_id': lambda x: [int(p) for p in x if int(p) in prod2idx]}).reset_index()
-orders_grouped = orders_grouped[orders_grouped['product_id'].map(len) > 1].reset_index(drop=True)
-print(f"Created {len(orders_grouped)} baskets for training.")
-
-# ---------------- Dataset ---------------- #
-class TripleDataset(Dataset):
-    def __init__(self, orders_grouped, user2idx, prod2idx, neg_k=5):
-        self.orders_grouped = orders_grouped
-        self.user2idx = user2idx
-        self.prod2idx = prod2idx
-        self.neg_k = neg_k
-        self.V = len(prod2idx)
-
-    def __len__(self):
-        return len(self.orders_grouped)
-
-    def __getitem__(self, idx):
-        row = self.orders_grouped.iloc[idx]
-        u = self.user2idx[int(row['user_id'])]
-        items = row['product_id']
-        # Pick two distinct products from the basket
-        i, j = random.sample(items, 2)
-        i_idx, j_idx = self.prod2idx[i], self.prod2idx[j]
-        # Generate negative samples (random products not in the positive pair)
-        negs = []
-        while len(negs) < self.neg_k:
-            n = random.randint(0, self.V-1)
-            if n != i_idx and n != j_idx:
-                negs.append(n)
-        return torch.tensor(u), torch.tensor(i_idx), torch.tensor(j_idx), torch.tensor(negs)
-
-dataset = TripleDataset(orders_grouped, user2idx, prod2idx, NEG_SAMPLES)
-loader = DataLoader(dataset, batch_size=BATCH, shuffle=True, num_workers=0) # num_workers=0 for Windows/macOS compatibility
+# ---------------- Sampler ---------------- #
+# Whole (u, i, j, negs) batches are drawn in NumPy; each basket is visited once per epoch
+# Negatives follow item popularity^0.75 (one alias-table draw per batch) instead of uniform
+negative_sampler = unigram_negatives(baskets, V, NEG_POWER) if NEGATIVES == "unigram" else None
+loader = TripleBatchSampler(baskets, V, BATCH, NEG_SAMPLES, negative_sampler=negative_sampler,
+                            seed=SAMPLER_SEED, rank=RANK, world_size=WORLD_SIZE)
 
 # ---------------- Model ---------------- #
-class Triple2Vec(nn.Module):
-    def __init__(self, U, V, D):
-        super().__init__()
-        self.h = nn.Embedding(U, D) # User embeddings
-        self.p = nn.Embedding(V, D) # Product "context" embeddings
-        self.q = nn.Embedding(V, D) # Product "center" embeddings
-
-    def forward(self, users, items_i, items_j, negs):
-        h_u = self.h(users)
-        p_i = self.p(items_i)
-        q_j = self.q(items_j)
-        pos_score = (h_u * (p_i + q_j)).sum(dim=1)
-
-        neg_p = self.p(negs)
-        neg_q = self.q(negs)
-        neg_scores = (h_u.unsqueeze(1) * (neg_p + neg_q)).sum(dim=2)
-        return pos_score, neg_scores
-
-model = Triple2Vec(U, V, EMBED_DIM).to(DEVICE)
-opt = torch.optim.Adam(model.parameters(), lr=LR)
-bce = nn.BCEWithLogitsLoss(reduction='none')
+# Sparse optimizers only update the rows a batch touches instead of all U + 2V rows per step
+model = build_model(U, V, EMBED_DIM, OPTIMIZER, DEVICE)
+# DDP broadcasts rank 0's initial weights, then averages gradients after every backward
+train_model = DistributedDataParallel(model) if DISTRIBUTED else model
+opt = make_optimizer(model, OPTIMIZER, LR)
+print(f"Optimizer: {OPTIMIZER}")
 
 # ---------------- Training ---------------- #
+def start_profiler():
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if DEVICE == "cuda":
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    profiler = torch.profiler.profile(
+        activities=activities,
+        schedule=torch.profiler.schedule(wait=0, warmup=1, active=PROFILE_STEPS, repeat=1),
+        on_trace_ready=lambda prof: prof.export_chrome_trace(PROFILE_TRACE_FILE),
+        record_shapes=True,
+    )
+    profiler.start()
+    return profiler
+
 print("\n🔥 Starting model training...")
+timer = PhaseTimer(DEVICE)
+profiler = start_profiler() if PROFILE_STEPS > 0 and IS_MAIN else None
+epoch_stats = []
 for epoch in range(EPOCHS):
     total_loss = 0.0
+    epoch_started = time.perf_counter()
+    batches = iter(loader)
     # Use tqdm for a nice progress bar
-    for users, i_idx, j_idx, negs in tqdm(loader, desc=f"Epoch {epoch+1}/{EPOCHS}"):
-        users, i_idx, j_idx, negs = users.to(DEVICE), i_idx.to(DEVICE), j_idx.to(DEVICE), negs.to(DEVICE)
-        pos_score, neg_scores = model(users, i_idx, j_idx, negs)
-
-        pos_loss = bce(pos_score, torch.ones_like(pos_score))
-        neg_loss = bce(neg_scores, torch.zeros_like(neg_scores)).sum(dim=1)
-        loss = (pos_loss + neg_loss).mean()
-
-        opt.zero_grad()
-        loss.backward()
-        opt.step()
-        total_loss += loss.item()
-    print(f"Epoch {epoch+1}/{EPOCHS} -> Average Loss: {total_loss/len(loader):.4f}")
+    for step in tqdm(range(len(loader)), desc=f"Epoch {epoch+1}/{EPOCHS}", disable=not IS_MAIN):
+        with timer.phase("sample"):
+            batch = next(batches)
+        total_loss += train_step(train_model, opt, batch, DEVICE, timer)
+
+        if profiler is not None:
+            profiler.step()
+            if step >= PROFILE_STEPS: # 1 warmup + PROFILE_STEPS active steps are done
+                profiler.stop()
+                print(profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=15))
+                print(f"   - Profiler trace saved to: {PROFILE_TRACE_FILE}")
+                profiler = None
+
+    epoch_seconds = time.perf_counter() - epoch_started
+    phases = timer.reset()
+    epoch_loss = total_loss / len(loader)
+    if DISTRIBUTED:
+        loss_tensor = torch.tensor([epoch_loss])
+        dist.all_reduce(loss_tensor)
+        epoch_loss = loss_tensor.item() / WORLD_SIZE
+    epoch_samples = loader.num_samples * WORLD_SIZE
+    stats = {
+        "epoch": epoch + 1,
+        "loss": round(epoch_loss, 6),
+        "seconds": round(epoch_seconds, 3),
+        "samples": epoch_samples,
+        "samples_per_sec": round(epoch_samples / epoch_seconds, 1),
+        "phase_seconds": {name: round(seconds, 3) for name, seconds in phases.items()},
+    }
+    epoch_stats.append(stats)
+    phase_text = ", ".join(f"{name} {seconds / epoch_seconds:.0%}" for name, seconds in phases.items())
+    if IS_MAIN:
+        print(f"Epoch {epoch+1}/{EPOCHS} -> Average Loss: {stats['loss']:.4f} | "
+              f"{stats['samples_per_sec']:,.0f} samples/s | {phase_text}")
+
+if profiler is not None: # fewer steps than requested
+    profiler.stop()
+
+if DISTRIBUTED:
+    dist.destroy_process_group()
+    if not IS_MAIN:
+        exit() # Weights are identical on every rank; rank 0 saves them
 
 print("✅ Training complete.")
 
@@ -149,4 +179,51 @@ with open(PROD2IDX_FILE, 'w') as f:
     json.dump(prod2idx, f)
 print(f"   - Product-to-index mapping (.json) saved to: {PROD2IDX_FILE}")
 
+# 4. Save the user_id -> index mapping (used by ingest_user_embedings.py)
+with open(USER2IDX_FILE, 'w') as f:
+    json.dump(user2idx, f)
+print(f"   - User-to-index mapping (.json) saved to: {USER2IDX_FILE}")
+
+# 5. Export the torch-free serving bundle (raw .npy + id maps + manifest)
+export_serving_bundle(
+    SERVING_BUNDLE_DIR,
+    user_embeddings=model.h.weight.detach().cpu().numpy(),
+    item_p=p_embed,
+    item_q=q_embed,
+    prod2idx=prod2idx,
+    user2idx=user2idx,
+    user_dtype=SERVING_USER_DTYPE,
+)
+print(f"   - Serving bundle saved to: {SERVING_BUNDLE_DIR}")
+if remove_stale_topk(SERVING_BUNDLE_DIR):
+    print("   ⚠️ Removed the precomputed user top-K built from the old embeddings (precomputed serving is off).")
+    print("      Rerun build_faiss.py and precompute_user_topk.py to rebuild the index and top-K for this bundle.")
+
+# 6. Record the watermark so incremental runs only consume newer orders
+with open(WATERMARK_FILE, 'w') as f:
+    json.dump({"max_order_id": int(baskets.order_ids.max())}, f)
+print(f"   - Training watermark saved to: {WATERMARK_FILE}")
+
+# 7. Machine-readable run summary for tracking training speed between runs
+train_seconds = sum(e["seconds"] for e in epoch_stats)
+run_summary = {
+    "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    "device": DEVICE,
+    "torch_threads": torch.get_num_threads(),
+    "world_size": WORLD_SIZE,
+    "config": {"embed_dim": EMBED_DIM, "batch": BATCH, "epochs": EPOCHS, "neg_samples": NEG_SAMPLES, "lr": LR,
+               "optimizer": OPTIMIZER, "negatives": NEGATIVES, "max_products": MAX_PRODUCTS},
+    "num_users": U,
+    "num_products": V,
+    "num_baskets": len(baskets),
+    "load_seconds": round(load_seconds, 3),
+    "train_seconds": round(train_seconds, 3),
+    "samples_per_sec": round(sum(e["samples"] for e in epoch_stats) / train_seconds, 1) if train_seconds else None,
+    "epochs": epoch_stats,
+    "total_seconds": round(time.time() - run_started, 3),
+}
+with open(RUN_SUMMARY_FILE, 'w') as f:
+    json.dump(run_summary, f, indent=2)
+print(f"   - Run summary saved to: {RUN_SUMMARY_FILE}")
+
 print("\n🎉 All done!")
\ No newline at end of file
@@ -0,0 +1,176 @@
+# triple_sampler.py
+# CSR basket storage + a vectorized (u, i, j, negs) batch sampler for triple2vec training.
+import numpy as np
+import torch
+
+
+class BasketCSR:
+    """
+    Baskets in CSR form: basket b holds items[offsets[b]:offsets[b+1]] and belongs to users[b].
+    Items and users are already embedding indices. Only baskets with >= 2 items are kept.
+    order_ids (optional) keeps the source order id of each basket.
+    """
+
+    def __init__(self, offsets, items, users, order_ids=None):
+        self.offsets = np.asarray(offsets, dtype='int64')
+        self.items = np.asarray(items, dtype='int32')
+        self.users = np.asarray(users, dtype='int32')
+        self.order_ids = np.asarray(order_ids, dtype='int32') if order_ids is not None else None
+
+    def __len__(self):
+        return len(self.users)
+
+    @property
+    def sizes(self):
+        return np.diff(self.offsets)
+
+    @classmethod
+    def from_orders(cls, order_ids, item_indices, user_indices):
+        """
+        Builds CSR from flat per-line arrays (one entry per order line), no per-order Python:
+        order_ids / item_indices / user_indices must already be filtered to the vocabulary.
+        """
+        order_ids = np.asarray(order_ids)
+        order = np.argsort(order_ids, kind='stable')
+        order_ids = order_ids[order]
+        item_indices = np.asarray(item_indices)[order]
+        user_indices = np.asarray(user_indices)[order]
+
+        unique_orders, starts, counts = np.unique(order_ids, return_index=True, return_counts=True)
+        keep = counts > 1
+        line_keep = np.repeat(keep, counts)
+
+        offsets = np.zeros(int(keep.sum()) + 1, dtype='int64')
+        np.cumsum(counts[keep], out=offsets[1:])
+        return cls(offsets, item_indices[line_keep], user_indices[starts[keep]], unique_orders[keep])
+
+    def save(self, path):
+        arrays = dict(offsets=self.offsets, items=self.items, users=self.users)
+        if self.order_ids is not None:
+            arrays['order_ids'] = self.order_ids
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['offsets'], data['items'], data['users'],
+                       data['order_ids'] if 'order_ids' in data.files else None)
+
+
+def uniform_negatives(num_items):
+    def draw(rng, shape):
+        return rng.integers(0, num_items, size=shape)
+    return draw
+
+
+class AliasTable:
+    """
+    Walker/Vose alias table: O(V) to build, then any number of draws from an arbitrary discrete
+    distribution cost two vectorized random arrays and one select, independent of V.
+    """
+
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype='float64')
+        n = len(weights)
+        scaled = weights * (n / weights.sum())
+        self.prob = np.ones(n, dtype='float64')
+        self.alias = np.arange(n, dtype='int32')
+
+        small = list(np.flatnonzero(scaled < 1.0))
+        large = list(np.flatnonzero(scaled >= 1.0))
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # Leftovers are 1.0 up to rounding error and keep prob = 1
+
+    def __len__(self):
+        return len(self.prob)
+
+    def draw(self, rng, shape):
+        columns = rng.integers(0, len(self.prob), size=shape)
+        keep = rng.random(shape) < self.prob[columns]
+        return np.where(keep, columns, self.alias[columns])
+
+
+def unigram_negatives(baskets, num_items, power=0.75):
+    """
+    word2vec-style negatives: item frequency in the training baskets raised to `power`.
+    Items that never occur get a pseudo-count of 1 so they are still pushed away occasionally.
+    """
+    counts = np.bincount(baskets.items, minlength=num_items).astype('float64')
+    table = AliasTable(np.maximum(counts, 1.0) ** power)
+    return table.draw
+
+
+class TripleBatchSampler:
+    """
+    Yields whole batches of (users, items_i, items_j, negs) as LongTensors.
+
+    Every basket is visited once per epoch in random order. Two distinct positions are drawn
+    per basket, and negatives come from `negative_sampler(rng, shape)` (uniform by default; see
+    unigram_negatives for the alias-table sampler) with collisions against i / j redrawn in
+    vectorized passes. All of it is NumPy, so there is no per-sample Python or DataLoader collation.
+
+    With world_size > 1 each rank takes an equal slice of the same per-epoch permutation (the
+    shuffle RNG is seeded identically on every rank), so all ranks run the same number of steps
+    and together cover the epoch; up to world_size - 1 baskets are left out per epoch.
+    """
+
+    def __init__(self, baskets, num_items, batch_size, neg_k, negative_sampler=None, seed=None,
+                 rank=0, world_size=1):
+        self.baskets = baskets
+        self.num_items = num_items
+        self.batch_size = batch_size
+        self.neg_k = neg_k
+        self.negative_sampler = negative_sampler or uniform_negatives(num_items)
+        self.rank = rank
+        self.world_size = world_size
+        if world_size > 1 and seed is None:
+            raise ValueError("A shared seed is required when sharding baskets across ranks.")
+        self.shuffle_rng = np.random.default_rng(seed)
+        # Per-rank stream for positions and negatives, so ranks do not draw identical negatives
+        self.rng = np.random.default_rng(None if seed is None else (seed, rank))
+
+    @property
+    def num_samples(self):
+        """Baskets this rank visits per epoch."""
+        return len(self.baskets) // self.world_size
+
+    def __len__(self):
+        return (self.num_samples + self.batch_size - 1) // self.batch_size
+
+    def sample(self, basket_ids):
+        rng = self.rng
+        starts = self.baskets.offsets[basket_ids]
+        sizes = self.baskets.offsets[basket_ids + 1] - starts
+
+        # Two distinct positions per basket: j is drawn from the remaining size-1 slots
+        pos_i = (rng.random(len(basket_ids)) * sizes).astype('int64')
+        pos_j = (rng.random(len(basket_ids)) * (sizes - 1)).astype('int64')
+        pos_j += pos_j >= pos_i
+
+        users = self.baskets.users[basket_ids]
+        items_i = self.baskets.items[starts + pos_i]
+        items_j = self.baskets.items[starts + pos_j]
+
+        negs = self.negative_sampler(rng, (len(basket_ids), self.neg_k))
+        clash = (negs == items_i[:, None]) | (negs == items_j[:, None])
+        while clash.any():
+            negs[clash] = self.negative_sampler(rng, int(clash.sum()))
+            clash = (negs == items_i[:, None]) | (negs == items_j[:, None])
+
+        return (
+            torch.from_numpy(users.astype('int64')),
+            torch.from_numpy(items_i.astype('int64')),
+            torch.from_numpy(items_j.astype('int64')),
+            torch.from_numpy(negs.astype('int64')),
+        )
+
+    def __iter__(self):
+        order = self.shuffle_rng.permutation(len(self.baskets))
+        order = order[self.rank * self.num_samples:(self.rank + 1) * self.num_samples]
+        for start in range(0, len(order), self.batch_size):
+            yield self.sample(order[start:start + self.batch_size])
@@ -0,0 +1,138 @@
+import faiss
+import numpy as np
+
+from artifacts import HEALTH_BUCKETS, pack_rows
+
+# Below this many eligible rows an exact dot product over just those rows is cheaper than
+# a filtered graph walk, and it can never come back short.
+EXACT_SEARCH_MAX_ROWS = 4096
+
+FILTER_FIELDS = ('include_ids', 'exclude_ids', 'departments', 'aisles', 'min_health')
+LIST_FILTER_FIELDS = ('include_ids', 'exclude_ids', 'departments', 'aisles')
+
+
+def validate_filters(filters):
+    """Raises ValueError unless filters is None or an object with list / numeric fields (-> 400)."""
+    if filters is None:
+        return
+    if not isinstance(filters, dict):
+        raise ValueError("'filters' must be an object.")
+    for name in LIST_FILTER_FIELDS:
+        value = filters.get(name)
+        if value is not None and not isinstance(value, (list, tuple)):
+            raise ValueError(f"'filters.{name}' must be a list.")
+    min_health = filters.get('min_health')
+    if min_health is not None and (isinstance(min_health, bool) or not isinstance(min_health, (int, float))):
+        raise ValueError("'filters.min_health' must be a number.")
+
+
+def has_filters(filters):
+    validate_filters(filters)
+    return bool(filters) and any(filters.get(name) not in (None, [], ()) for name in FILTER_FIELDS)
+
+
+def filters_key(filters):
+    """Hashable, order-independent form of a request's filters (part of the candidate cache key)."""
+    if not has_filters(filters):
+        return None
+    return tuple(
+        (name, frozenset(value) if isinstance(value, (list, tuple)) else value)
+        for name in FILTER_FIELDS
+        for value in [filters.get(name)]
+        if value not in (None, [], ())
+    )
+
+
+def _ids_to_rows(snap, product_ids):
+    return [snap.prod2idx[pid] for pid in product_ids if pid in snap.prod2idx]
+
+
+def build_filter_bitmap(snap, filters, basket_indices):
+    """
+    Packed bitmap of embedding rows a request may receive: mapped rows, minus the basket,
+    intersected with the requested categories / min health / include set, minus the exclude set.
+    Raises ValueError for malformed filters (the endpoints turn that into a 400).
+    """
+    filters = filters or {}
+    bitmap = np.array(snap.mapped_bitmap)
+
+    min_health = filters.get('min_health')
+    if min_health is not None:
+        threshold = float(min_health)
+        bucket = int(np.floor(threshold * HEALTH_BUCKETS))
+        if 0 <= bucket < HEALTH_BUCKETS and bucket / HEALTH_BUCKETS == threshold:
+            # Threshold on a bucket boundary (0.1 steps): the precomputed bitmap is exact
+            bitmap &= snap.health_bitmaps[bucket]
+        else:
+            bitmap &= pack_rows(snap.item_health >= threshold)
+
+    for kind, field in (("department", 'departments'), ("aisle", 'aisles')):
+        category_ids = filters.get(field)
+        if not category_ids:
+            continue
+        known = snap.category_bitmaps.get(kind, {})
+        if not known:
+            raise ValueError(f"Model '{snap.version}' has no {kind} data to filter on.")
+        union = np.zeros_like(bitmap)
+        for category_id in category_ids:
+            if int(category_id) in known:
+                union |= known[int(category_id)]
+        bitmap &= union
+
+    num_items = len(snap.item_embeddings)
+    include_ids = filters.get('include_ids')
+    if include_ids:
+        mask = np.zeros(num_items, dtype=bool)
+        mask[_ids_to_rows(snap, include_ids)] = True
+        bitmap &= pack_rows(mask)
+
+    excluded_rows = list(basket_indices) + _ids_to_rows(snap, filters.get('exclude_ids') or [])
+    if excluded_rows:
+        mask = np.zeros(num_items, dtype=bool)
+        mask[excluded_rows] = True
+        bitmap &= ~pack_rows(mask)
+
+    return bitmap
+
+
+def _search_params(index, selector):
+    """Search parameters carrying the selector plus the index's own efSearch / nprobe."""
+    base = faiss.downcast_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=base.hnsw.efSearch)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    return faiss.SearchParameters(sel=selector)
+
+
+def _exact_search(snap, query_row, rows, k):
+    scores = snap.item_embeddings[rows] @ query_row
+    top = np.argpartition(-scores, k - 1)[:k] if len(rows) > k else np.arange(len(rows))
+    return rows[top]
+
+
+def filtered_search(snap, query_row, bitmap, k, min_results):
+    """
+    Candidate rows for ONE normalized query restricted to `bitmap`, padded with -1 to width k.
+    Uses FAISS with an IDSelectorBitmap; small eligible sets (or a short FAISS answer) go exact.
+    """
+    num_items = len(snap.item_embeddings)
+    eligible = np.flatnonzero(np.unpackbits(bitmap, count=num_items, bitorder='little'))
+    candidates = np.full(k, -1, dtype='int64')
+    if len(eligible) == 0:
+        return candidates
+
+    if len(eligible) <= EXACT_SEARCH_MAX_ROWS:
+        found = _exact_search(snap, query_row, eligible, k)
+    else:
+        selector = faiss.IDSelectorBitmap(num_items, faiss.swig_ptr(bitmap))
+        params = _search_params(snap.faiss_index, selector)
+        _, found = snap.faiss_index.search(query_row.reshape(1, -1), k, params=params)
+        found = found[0][found[0] >= 0]
+        if len(found) < min(min_results, len(eligible)):
+            # Very selective filters can starve a graph walk; fall back to exact scoring
+            found = _exact_search(snap, query_row, eligible, k)
+
+    candidates[:len(found)] = found
+    return candidates
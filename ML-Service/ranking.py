@@ -0,0 +1,64 @@
+# ranking.py
+# Flask-free scoring and gamma re-ranking shared by app.py (serving) and evaluate.py (offline gate).
+import numpy as np
+
+N_CANDIDATES = 100
+N_RECOMMENDATIONS = 12
+
+
+def score_candidates(snap, query_matrix, candidate_indices, basket_indices_list):
+    """
+    Gamma-independent half of the re-rank. Returns (safe_indices, pref_scores), both (B, N_CANDIDATES);
+    pref_scores is -inf for FAISS padding, unmapped rows and basket items.
+    """
+    num_rows = candidate_indices.shape[0]
+    num_items = len(snap.item_embeddings)
+
+    # Drop FAISS padding (-1), out-of-range rows and rows without a product ID
+    valid = (candidate_indices >= 0) & (candidate_indices < num_items)
+    safe_indices = np.where(valid, candidate_indices, 0)
+    valid &= snap.idx2prod_array[safe_indices] >= 0
+
+    # Masked exclusion of basket rows: encode (row, item) pairs as one int64 key per pair
+    basket_keys = np.fromiter(
+        (row * num_items + idx for row, basket_indices in enumerate(basket_indices_list) for idx in basket_indices),
+        dtype='int64',
+    )
+    if basket_keys.size:
+        candidate_keys = np.arange(num_rows, dtype='int64')[:, None] * num_items + safe_indices
+        valid &= ~np.isin(candidate_keys, basket_keys)
+
+    pref_scores = np.einsum('bd,bkd->bk', query_matrix, snap.item_embeddings[safe_indices])
+    pref_scores[~valid] = -np.inf
+    return safe_indices, pref_scores
+
+
+def rank_rows_by_gamma(snap, safe_indices, pref_scores, gammas, top_n=N_RECOMMENDATIONS):
+    """
+    Fused (1-gamma)*pref + gamma*health, then top N per row. Returns (B, top_n) embedding rows,
+    -1 where a slot has no finite score. gammas: one per row, or a single value for all rows.
+    evaluate.py ranks with this too, so the offline gate matches the service.
+    """
+    gamma_col = np.asarray(gammas, dtype='float32').reshape(-1, 1)
+    final_scores = np.where(
+        np.isfinite(pref_scores),
+        (1 - gamma_col) * pref_scores + gamma_col * snap.item_health[safe_indices],
+        -np.inf,
+    )
+
+    # Top-N per row without sorting the full candidate list
+    top_n = min(top_n, final_scores.shape[1])
+    top_cols = np.argpartition(-final_scores, top_n - 1, axis=1)[:, :top_n]
+    top_scores = np.take_along_axis(final_scores, top_cols, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    top_cols = np.take_along_axis(top_cols, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+    rows = np.take_along_axis(safe_indices, top_cols, axis=1)
+    return np.where(np.isfinite(top_scores), rows, -1)
+
+
+def rank_by_gamma(snap, safe_indices, pref_scores, gammas):
+    """Gamma-only half of the re-rank: one product ID list per row."""
+    ranked_rows = rank_rows_by_gamma(snap, safe_indices, pref_scores, gammas)
+    top_pids = snap.idx2prod_array[np.maximum(ranked_rows, 0)]
+    return [pids[rows >= 0].tolist() for pids, rows in zip(top_pids, ranked_rows)]
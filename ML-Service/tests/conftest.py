@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The service modules and the offline pipeline are flat script directories, not packages
+ML_SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ML_SERVICE_DIR)
+sys.path.insert(0, os.path.join(ML_SERVICE_DIR, 'offline-ml-pipeline'))
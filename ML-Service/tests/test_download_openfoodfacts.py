@@ -0,0 +1,80 @@
+import importlib.util
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("pyarrow")
+pytest.importorskip("pandas")
+
+DOWNLOAD_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'offline-ml-pipeline',
+                               'data', 'openfoodfacts', 'download_openfoodfacts.py')
+PAYLOAD = os.urandom(3 << 20)
+CUT_AFTER = 1 << 20  # Bytes sent before the first response is cut
+
+
+def load_download_module():
+    spec = importlib.util.spec_from_file_location("download_openfoodfacts", DOWNLOAD_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FlakyFileHandler(BaseHTTPRequestHandler):
+    """Serves PAYLOAD; the first response is cut after CUT_AFTER bytes. Range support is switchable."""
+    support_range = True
+    requests_seen = None
+
+    def do_GET(self):
+        first = not self.requests_seen
+        self.requests_seen.append(self.headers.get("Range"))
+        start = 0
+        if self.support_range and self.headers.get("Range"):
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(PAYLOAD) - start))
+        self.send_header("ETag", '"off-dump-1"')
+        self.end_headers()
+        body = PAYLOAD[start:]
+        if first:
+            self.wfile.write(body[:CUT_AFTER])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(params=[True, False], ids=["range", "no-range"])
+def flaky_server(request):
+    handler = type("Handler", (FlakyFileHandler,), {"support_range": request.param, "requests_seen": []})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/off.tsv.gz", handler
+    server.shutdown()
+    server.server_close()
+
+
+def test_resumes_after_connection_is_cut(flaky_server):
+    url, handler = flaky_server
+    download = load_download_module()
+
+    stream = download.ResumableHTTPStream(url, backoff=0)
+    try:
+        received = stream.read()
+    finally:
+        stream.close()
+
+    assert received == PAYLOAD
+    assert len(handler.requests_seen) == 2
+    if handler.support_range:
+        assert handler.requests_seen[1].startswith("bytes=")
+        assert int(handler.requests_seen[1].split("=")[1].rstrip("-")) > 0
@@ -0,0 +1,25 @@
+import pytest
+
+from micro_batcher import MicroBatcher
+
+
+def double_non_negative(items):
+    if any(item < 0 for item in items):
+        raise ValueError(f"negative item in {items}")
+    return [item * 2 for item in items]
+
+
+def test_results_go_to_their_own_callers():
+    batcher = MicroBatcher(double_non_negative, max_wait_ms=50)
+    futures = [batcher.submit(item) for item in (1, 2, 3)]
+    assert [future.result(timeout=5) for future in futures] == [2, 4, 6]
+
+
+def test_bad_item_only_fails_its_own_request():
+    batcher = MicroBatcher(double_non_negative, max_wait_ms=50)
+    good_before, bad, good_after = (batcher.submit(item) for item in (1, -1, 3))
+
+    assert good_before.result(timeout=5) == 2
+    assert good_after.result(timeout=5) == 6
+    with pytest.raises(ValueError):
+        bad.result(timeout=5)
@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+pytest.importorskip("pandas")
+
+from artifacts import HEALTH_BUCKETS, pack_rows
+from prefilter import build_filter_bitmap, has_filters
+
+
+def make_snapshot(item_health):
+    item_health = np.asarray(item_health, dtype='float32')
+    num_items = len(item_health)
+    return SimpleNamespace(
+        version="test",
+        item_health=item_health,
+        item_embeddings=np.zeros((num_items, 4), dtype='float32'),
+        prod2idx={pid: pid for pid in range(num_items)},
+        mapped_bitmap=pack_rows(np.ones(num_items, dtype=bool)),
+        health_bitmaps=tuple(pack_rows(item_health >= b / HEALTH_BUCKETS) for b in range(HEALTH_BUCKETS)),
+        category_bitmaps={},
+    )
+
+
+def eligible_rows(snap, bitmap):
+    return np.flatnonzero(np.unpackbits(bitmap, count=len(snap.item_health), bitorder='little')).tolist()
+
+
+@pytest.mark.parametrize("min_health", [0.25, 0.3, 0.05, 0.95])
+def test_min_health_is_exact(min_health):
+    snap = make_snapshot([0.0, 0.04, 0.05, 0.2, 0.25, 0.27, 0.3, 0.5, 0.94, 0.95, 1.0])
+    bitmap = build_filter_bitmap(snap, {"min_health": min_health}, basket_indices=[])
+    expected = np.flatnonzero(snap.item_health >= np.float32(min_health)).tolist()
+    assert eligible_rows(snap, bitmap) == expected
+
+
+def test_min_health_between_buckets_keeps_items_below_next_bucket():
+    # 0.25 must not be rounded up to the 0.3 bucket
+    snap = make_snapshot([0.1, 0.25, 0.27, 0.3])
+    bitmap = build_filter_bitmap(snap, {"min_health": 0.25}, basket_indices=[])
+    assert eligible_rows(snap, bitmap) == [1, 2, 3]
+
+
+@pytest.mark.parametrize("filters", [[1, 2], "x", 5, {"departments": 3}, {"min_health": "high"}])
+def test_malformed_filters_raise_value_error(filters):
+    with pytest.raises(ValueError):
+        has_filters(filters)
+
+
+def test_missing_or_empty_filters_are_not_filters():
+    assert not has_filters(None)
+    assert not has_filters({})
+    assert has_filters({"min_health": 0.5})